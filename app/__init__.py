@@ -1,11 +1,29 @@
+import atexit
+
 from flask import Flask
 
+from app import metrics
+from app.auth import TokenVerifier
+from app.config import Config
+from app.json_provider import JSONProvider
+from app.model.storage import get_storage
+
 app = Flask(__name__)
+app.config.from_object(Config)
+app.json = JSONProvider(app)
+app.json.configure(app.config)
+metrics.REGISTRY.enabled = app.config['METRICS_ENABLED']
+app.extensions['song_storage'] = get_storage(app.config['SONG_STORAGE'])
+app.extensions['song_storage'].configure(app.config)
+atexit.register(app.extensions['song_storage'].flush)
+app.extensions['token_verifier'] = TokenVerifier.from_config(app.config)
 
 
+from app.resources.metrics_resource import metrics_api
 from app.resources.song_resource import song_api
 
 app.register_blueprint(song_api)
+app.register_blueprint(metrics_api)
 
 # with app.app_context():
 #    app.run(debug=True)
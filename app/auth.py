@@ -0,0 +1,95 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from authlib.jose import JsonWebKey, JsonWebToken
+from authlib.jose.errors import JoseError
+
+from app import metrics
+
+
+def load_keys(path):
+    """ Signing keys from a local file
+    :param path: file holding a JWK set, a single JWK or a PEM public key
+    :return: key or KeySet
+    """
+    with open(path, 'rb') as f:
+        raw = f.read()
+    try:
+        data = json.loads(raw)
+    except ValueError:
+        return JsonWebKey.import_key(raw)
+    if isinstance(data, dict) and 'keys' in data:
+        return JsonWebKey.import_key_set(data)
+    return JsonWebKey.import_key(data)
+
+
+class TokenVerifier:
+    """ Checks the signature and claims of JWT bearer tokens
+    Tokens found valid are remembered by their hash in a bounded LRU
+    cache until they expire, or for at most ttl seconds, so a client
+    repeating its token only pays for the signature check once. Invalid
+    tokens are never cached, they could push valid ones out.
+    """
+
+    def __init__(self, keys, algorithms=('RS256',), cache_size=1024, ttl=300, claims_options=None):
+        self.keys = keys
+        self.cache_size = cache_size
+        self.ttl = ttl
+        self.claims_options = claims_options or {}
+        self._jwt = JsonWebToken(list(algorithms))
+        # token hash -> (time the entry expires, claims)
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        """ Verifier set up from a mapping such as app.config
+        :param config: dictionary
+        :return: TokenVerifier, None when AUTH_JWT_KEY_FILE is not set
+        """
+        if not config.get('AUTH_JWT_KEY_FILE'):
+            return None
+        claims_options = {}
+        for claim, setting in (('iss', 'AUTH_JWT_ISSUER'), ('aud', 'AUTH_JWT_AUDIENCE')):
+            if config.get(setting):
+                claims_options[claim] = {'essential': True, 'value': config[setting]}
+        return cls(load_keys(config['AUTH_JWT_KEY_FILE']), config.get('AUTH_JWT_ALGORITHMS', ('RS256',)),
+                   config.get('AUTH_TOKEN_CACHE_SIZE', 1024), config.get('AUTH_TOKEN_CACHE_TTL', 300),
+                   claims_options)
+
+    def verify(self, token):
+        """ Claims of a valid token
+        :param token: string
+        :return: dictionary or None when the token is not valid
+        """
+        key = hashlib.sha256(token.encode('utf-8', 'surrogateescape')).digest()
+        now = time.time()
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._cache.move_to_end(key)
+                    metrics.AUTH_CACHE.inc('hit')
+                    return entry[1]
+                del self._cache[key]
+        metrics.AUTH_CACHE.inc('miss')
+
+        try:
+            claims = self._jwt.decode(token, self.keys, claims_options=self.claims_options)
+            claims.validate(now)
+        except (JoseError, ValueError):
+            return None
+        claims = dict(claims)
+        expires = now + self.ttl
+        if isinstance(claims.get('exp'), (int, float)):
+            expires = min(expires, claims['exp'])
+        if self.cache_size:
+            with self._lock:
+                self._cache[key] = (expires, claims)
+                self._cache.move_to_end(key)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return claims
@@ -0,0 +1,61 @@
+import os
+
+
+class Config:
+    # 'json' or 'sqlite'
+    SONG_STORAGE = os.environ.get('SONG_STORAGE', 'json')
+    SONG_DB_PATH = os.environ.get('SONG_DB_PATH', 'app/mock/song_lists.db')
+    SONG_PATH_FILE = os.environ.get('SONG_PATH_FILE', 'app/mock/song_lists.json')
+    # 'snapshot', 'journal' or 'sharded'
+    SONG_PERSISTENCE = os.environ.get('SONG_PERSISTENCE', 'snapshot')
+    # 'json', 'json-min', 'json-gzip' or 'packed', see app/model/file_format.py
+    SONG_FILE_FORMAT = os.environ.get('SONG_FILE_FORMAT', 'json')
+    # files the lists are spread over in 'sharded' persistence
+    SONG_SHARDS = int(os.environ.get('SONG_SHARDS', 64))
+    SONG_JOURNAL_COMPACT_BYTES = int(os.environ.get('SONG_JOURNAL_COMPACT_BYTES', 1024 * 1024))
+    SONG_JOURNAL_COMPACT_RATIO = float(os.environ.get('SONG_JOURNAL_COMPACT_RATIO', 0.5))
+    # 'sync', 'group' or 'async', when journaled changes reach the disk
+    SONG_JOURNAL_DURABILITY = os.environ.get('SONG_JOURNAL_DURABILITY', 'sync')
+    # seconds between journal syncs with 'async' durability
+    SONG_JOURNAL_FLUSH_INTERVAL = float(os.environ.get('SONG_JOURNAL_FLUSH_INTERVAL', 1))
+    # seconds after which the journal is folded into a snapshot whatever its size, 0 disables
+    SONG_SNAPSHOT_INTERVAL = float(os.environ.get('SONG_SNAPSHOT_INTERVAL', 0))
+    # 0 disables the search cache
+    SONG_SEARCH_CACHE_SIZE = int(os.environ.get('SONG_SEARCH_CACHE_SIZE', 1024))
+    SONG_SEARCH_CACHE_TTL = float(os.environ.get('SONG_SEARCH_CACHE_TTL', 60))
+    SONG_SEARCH_CACHE_MAX_RESULTS = int(os.environ.get('SONG_SEARCH_CACHE_MAX_RESULTS', 10000))
+    # changes kept for GET /changes, 0 disables the feed
+    SONG_CHANGE_FEED_SIZE = int(os.environ.get('SONG_CHANGE_FEED_SIZE', 10000))
+    # longest a GET /changes request waits for a change, in seconds
+    SONG_CHANGE_FEED_MAX_WAIT = float(os.environ.get('SONG_CHANGE_FEED_MAX_WAIT', 30))
+    # worker processes searching the json backend in parallel, 0 searches in the process
+    SONG_SEARCH_WORKERS = int(os.environ.get('SONG_SEARCH_WORKERS', 0))
+    # searches over fewer candidate lists are not worth sending to the workers
+    SONG_SEARCH_PARALLEL_MIN_LISTS = int(os.environ.get('SONG_SEARCH_PARALLEL_MIN_LISTS', 5000))
+    # threads running requests when served over ASGI (asgi.py)
+    ASGI_THREADS = int(os.environ.get('ASGI_THREADS', 32))
+    # production server (serve.py)
+    SERVER_HOST = os.environ.get('SERVER_HOST', '127.0.0.1')
+    SERVER_PORT = int(os.environ.get('SERVER_PORT', 5000))
+    # one worker process per CPU by default
+    SERVER_WORKERS = int(os.environ.get('SERVER_WORKERS', os.cpu_count() or 1))
+    SERVER_THREADS = int(os.environ.get('SERVER_THREADS', 8))
+    # GET /changes requests waiting for a change at once, the others are answered
+    # right away; a quarter of the server threads by default
+    SONG_CHANGE_FEED_MAX_WAITERS = int(os.environ.get('SONG_CHANGE_FEED_MAX_WAITERS', max(1, SERVER_THREADS // 4)))
+    # JWK set, JWK or PEM public key bearer tokens are verified with, when
+    # unset any 'Bearer ' Authorization header is accepted
+    AUTH_JWT_KEY_FILE = os.environ.get('AUTH_JWT_KEY_FILE', '')
+    AUTH_JWT_ALGORITHMS = os.environ.get('AUTH_JWT_ALGORITHMS', 'RS256').split(',')
+    # claims tokens must carry when set
+    AUTH_JWT_ISSUER = os.environ.get('AUTH_JWT_ISSUER', '')
+    AUTH_JWT_AUDIENCE = os.environ.get('AUTH_JWT_AUDIENCE', '')
+    # valid tokens remembered, for at most the TTL in seconds or until they expire
+    AUTH_TOKEN_CACHE_SIZE = int(os.environ.get('AUTH_TOKEN_CACHE_SIZE', 1024))
+    AUTH_TOKEN_CACHE_TTL = float(os.environ.get('AUTH_TOKEN_CACHE_TTL', 300))
+    # 'auto' encodes responses with orjson when it is installed, 'orjson' or 'json'
+    JSON_ENCODER = os.environ.get('JSON_ENCODER', 'auto')
+    # encoded song lists kept for later responses, 0 disables the cache
+    JSON_FRAGMENT_CACHE_BYTES = int(os.environ.get('JSON_FRAGMENT_CACHE_BYTES', 64 * 1024 * 1024))
+    # records request and storage timings served on /metrics
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '0') in ('1', 'true')
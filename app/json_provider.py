@@ -0,0 +1,146 @@
+import threading
+from collections import OrderedDict
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # optional, responses are encoded with the json module
+    orjson = None
+
+from app import metrics
+from app.model.song import Song
+
+
+class FragmentCache:
+    """ Encoded lists, kept to be pasted into later responses
+    A list is stored with the version it was encoded at, a newer version
+    replaces it and an older one is never returned, so changing a list
+    is enough to invalidate it. The least recently used lists are dropped
+    past max_bytes.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._size = 0
+        # list id -> (version, bytes)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def configure(self, max_bytes):
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._entries.clear()
+            self._size = 0
+
+    def get(self, list_id, version):
+        """ Encoded list, if encoded at that version
+        :param list_id: string
+        :param version: string from get_list_version
+        :return: bytes or None
+        """
+        with self._lock:
+            entry = self._entries.get(list_id)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(list_id)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, list_id, version, fragment):
+        if len(fragment) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(list_id, None)
+            if previous is not None:
+                self._size -= len(previous[1])
+            self._entries[list_id] = (version, fragment)
+            self._size += len(fragment)
+            while self._size > self.max_bytes:
+                _, (_, dropped) = self._entries.popitem(last=False)
+                self._size -= len(dropped)
+
+    def stats(self):
+        """ Counters for monitoring
+        :return: dictionary
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries), 'bytes': self._size}
+
+
+class JSONProvider(DefaultJSONProvider):
+    """ Flask's JSON provider, timing every response it encodes
+    Compact output is encoded with orjson when it is installed, or when
+    ENCODER says so, falling back to the json module for anything orjson
+    cannot encode. Song lists can be encoded once per version, see
+    encode_list.
+    """
+    # 'auto', 'orjson' or 'json'
+    encoder = 'auto'
+
+    def __init__(self, app):
+        super().__init__(app)
+        self.fragments = FragmentCache()
+
+    def configure(self, config):
+        """ Apply encoding settings from a mapping such as app.config
+        :param config: dictionary
+        :return:
+        """
+        encoder = config.get('JSON_ENCODER', self.encoder)
+        if encoder not in ('auto', 'orjson', 'json'):
+            raise ValueError(f'Unknown JSON encoder {encoder!r}')
+        if encoder == 'orjson' and orjson is None:
+            raise ValueError('JSON_ENCODER is orjson but orjson is not installed')
+        self.encoder = encoder
+        self.fragments.configure(config.get('JSON_FRAGMENT_CACHE_BYTES', self.fragments.max_bytes))
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, Song):
+            return o.to_dict()
+        return DefaultJSONProvider.default(o)
+
+    def _fast(self):
+        return orjson is not None and self.encoder != 'json'
+
+    def _encode(self, obj, indent=False):
+        if self._fast():
+            option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_SORT_KEYS if self.sort_keys else 0) | \
+                (orjson.OPT_INDENT_2 if indent else 0)
+            try:
+                return orjson.dumps(obj, default=self.default, option=option)
+            except orjson.JSONEncodeError:
+                # integers past 64 bits and the like
+                pass
+        separators = None if indent else (',', ':')
+        return super().dumps(obj, indent=2 if indent else None, separators=separators).encode()
+
+    def dumps(self, obj, **kwargs):
+        with metrics.JSON_SECONDS.time():
+            if self._fast() and kwargs in ({'separators': (',', ':')}, {'indent': 2}):
+                payload = self._encode(obj, 'indent' in kwargs).decode()
+            else:
+                payload = super().dumps(obj, **kwargs)
+        metrics.JSON_BYTES.inc(amount=len(payload))
+        return payload
+
+    def encode_list(self, list_data, version):
+        """ Compact encoding of a song list, reused while its version does not change
+        :param list_data: dictionary
+        :param version: string from get_list_version, None when unknown
+        :return: bytes
+        """
+        if version is not None and self.fragments.max_bytes:
+            fragment = self.fragments.get(list_data.get('id'), version)
+            if fragment is not None:
+                return fragment
+        with metrics.JSON_SECONDS.time():
+            fragment = self._encode(list_data)
+        metrics.JSON_BYTES.inc(amount=len(fragment))
+        if version is not None and self.fragments.max_bytes:
+            self.fragments.put(list_data.get('id'), version, fragment)
+        return fragment
@@ -0,0 +1,169 @@
+import bisect
+import threading
+import time
+
+# seconds, from half a millisecond to ten seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _format(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class Registry:
+    """ Metrics exposed on /metrics
+    Nothing is recorded while disabled, every hook then costs a flag check.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def clear(self):
+        for metric in self.metrics:
+            metric.clear()
+
+    def render(self):
+        """ All metrics in the Prometheus text exposition format
+        :return: string
+        """
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, help, labels=(), registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        self.registry = registry
+        registry.register(self)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def render(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f'{self.name}{_labels(self.labels, labels)} {_format(value)}' for labels, value in values]
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, *labels, amount=1):
+        if not self.registry.enabled:
+            return
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+
+class _Timer:
+    __slots__ = ('histogram', 'labels', 'start')
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter() if self.histogram.registry.enabled else None
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.start is not None:
+            self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS, registry=REGISTRY):
+        super().__init__(name, help, labels, registry)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        if not self.registry.enabled:
+            return
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                # a count per bucket, the last one for +Inf, then the sum
+                entry = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            entry[bisect.bisect_left(self.buckets, value)] += 1
+            entry[-1] += value
+
+    def time(self, *labels):
+        """ Context manager observing the duration of its block
+        :param labels: label values
+        :return:
+        """
+        return _Timer(self, labels)
+
+    def render(self):
+        with self._lock:
+            values = sorted((labels, list(entry)) for labels, entry in self._values.items())
+        lines = []
+        for labels, entry in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), entry[:-1]):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{_labels(self.labels, labels, [("le", _format(bound))])} '
+                             f'{cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labels, labels)} {_format(entry[-1])}')
+            lines.append(f'{self.name}_count{_labels(self.labels, labels)} {cumulative}')
+        return lines
+
+
+REQUEST_SECONDS = Histogram('song_api_request_duration_seconds', 'Time spent answering a request',
+                            ('method', 'endpoint', 'status'))
+AUTH_SECONDS = Histogram('song_api_auth_duration_seconds', 'Time spent checking the Authorization header')
+AUTH_CACHE = Counter('song_api_auth_token_cache_total', 'Token checks answered from the cache or not', ('result',))
+JSON_SECONDS = Histogram('song_api_json_encode_duration_seconds', 'Time spent encoding JSON responses')
+JSON_BYTES = Counter('song_api_json_encoded_bytes_total', 'Characters of JSON encoded for responses')
+STORAGE_READ_SECONDS = Histogram('song_storage_read_duration_seconds', 'Time spent reading song lists from storage',
+                                 ('storage',))
+STORAGE_READ_BYTES = Counter('song_storage_read_bytes_total', 'Bytes of song lists read from storage', ('storage',))
+STORAGE_WRITE_SECONDS = Histogram('song_storage_write_duration_seconds', 'Time spent writing song lists to storage',
+                                  ('storage',))
+STORAGE_WRITE_BYTES = Counter('song_storage_write_bytes_total', 'Bytes of song lists written to storage',
+                              ('storage',))
+STORAGE_SIZE = Gauge('song_storage_size_bytes', 'Size of the stored song lists on disk', ('storage',))
+STORAGE_LISTS = Gauge('song_storage_lists', 'Number of song lists', ('storage',))
+STORAGE_SONGS = Gauge('song_storage_songs', 'Number of songs across all lists', ('storage',))
@@ -0,0 +1,155 @@
+import os
+import threading
+import time
+import uuid
+from bisect import bisect_right
+from collections import deque
+from itertools import count, islice
+from operator import itemgetter
+
+
+def change_event(record):
+    """ Change event for a journal record
+    Created lists are copied, the live dictionary keeps changing.
+    :param record: dictionary
+    :return: dictionary
+    """
+    if record['op'] == 'create_list':
+        list_data = record['list']
+        return {'op': 'create_list', 'list_id': list_data.get('id'),
+                'list': dict(list_data, songs=list(list_data.get('songs', [])))}
+    return {key: record[key] for key in ('op', 'list_id', 'song') if key in record}
+
+
+class ChangeFeed:
+    """ Bounded log of the changes made to the song lists, in order
+    Every change gets the next sequence number, and only the last size
+    changes are kept. A client asks for the changes after the last number
+    it saw and, when those are no longer known, is told to reset: fetch
+    what it shows again and follow the feed from the current number.
+    Changes that cannot be told apart, such as a library reloaded from
+    disk, reset every client too, see invalidate.
+
+    Numbers are only meaningful within the process, the feed token
+    changes with the process and whenever the feed is configured, unless
+    the publisher numbers the changes itself the same way in every
+    process, such as the journal does, and gives a shared token.
+
+    At most max_waiters clients wait for a change at once, the others are
+    answered right away so waiting clients cannot hold every server thread.
+    """
+    # seconds between calls to refresh while a client waits
+    refresh_interval = 1.0
+
+    def __init__(self, size=10000, max_waiters=None):
+        self.size = size
+        self.max_waiters = max_waiters
+        self._id = uuid.uuid4().hex
+        self._shared_token = None
+        self._refresh = None
+        self._events = deque(maxlen=size)
+        self._seq = 0
+        # oldest sequence number changes can still be asked after
+        self._floor = 0
+        self._waiters = 0
+        self._changed = threading.Condition()
+
+    def configure(self, size, max_waiters=None, token=None, refresh=None):
+        """ Apply feed settings
+        :param size: changes kept
+        :param max_waiters: clients waiting at once, None for no limit
+        :param token: token shared by the processes numbering changes the same way,
+            None when numbers are per process
+        :param refresh: callable publishing the changes of other processes, called
+            every refresh_interval seconds while a client waits
+        :return:
+        """
+        with self._changed:
+            self.size = size
+            self.max_waiters = max_waiters
+            self._id = uuid.uuid4().hex
+            self._shared_token = token
+            self._refresh = refresh
+            self._events = deque(maxlen=size)
+            self._floor = self._seq
+            self._changed.notify_all()
+
+    @property
+    def token(self):
+        if self._shared_token is not None:
+            return self._shared_token
+        # processes forked from this one hold a copy but number their own changes
+        return f'{self._id}-{os.getpid()}'
+
+    def publish(self, events, seqs=None):
+        """ Append changes and wake the clients waiting for them
+        :param events: list of dictionaries from change_event
+        :param seqs: increasing sequence numbers of the events, the next ones by default
+        :return:
+        """
+        if not self.size or not events:
+            return
+        with self._changed:
+            for event, seq in zip(events, seqs or count(self._seq + 1)):
+                if seq <= self._seq:
+                    continue
+                self._seq = seq
+                if len(self._events) == self._events.maxlen:
+                    self._floor = self._events[0][0]
+                self._events.append((seq, event))
+            self._changed.notify_all()
+
+    def invalidate(self, seq=None):
+        """ Reset every client, for changes that are not published
+        :param seq: sequence number the feed goes on from, the next one by default
+        :return:
+        """
+        with self._changed:
+            self._seq = self._seq + 1 if seq is None else seq
+            self._floor = self._seq
+            self._events.clear()
+            self._changed.notify_all()
+
+    def changes(self, since=None, limit=1000, timeout=0, token=None):
+        """ Changes after a sequence number, waiting for one when there is none yet
+        :param since: int, last sequence number seen, None for the current one
+        :param limit: maximum number of changes returned
+        :param timeout: seconds to wait for a change
+        :param token: feed token since was read from
+        :return: dictionary with the feed 'token', the 'seq' to ask after next time,
+            whether the client has to 'reset' and the 'changes'
+        """
+        deadline = time.monotonic() + timeout
+        with self._changed:
+            if since is None:
+                since = self._seq
+            if token not in (None, self.token):
+                since = -1
+            if since != self._seq or timeout <= 0 or \
+                    (self.max_waiters is not None and self._waiters >= self.max_waiters):
+                return self._answer(since, limit)
+            self._waiters += 1
+        try:
+            while True:
+                with self._changed:
+                    remaining = deadline - time.monotonic()
+                    if since == self._seq and remaining > 0:
+                        self._changed.wait(remaining if self._refresh is None
+                                           else min(remaining, self.refresh_interval))
+                    if since != self._seq or time.monotonic() >= deadline:
+                        return self._answer(since, limit)
+                    refresh = self._refresh
+                # not under the condition, refresh publishes
+                if refresh is not None:
+                    refresh()
+        finally:
+            with self._changed:
+                self._waiters -= 1
+
+    def _answer(self, since, limit):
+        if not self._floor <= since <= self._seq:
+            return {'token': self.token, 'seq': self._seq, 'reset': True, 'changes': []}
+        start = bisect_right(self._events, since, key=itemgetter(0))
+        changes = [dict(event, seq=seq) for seq, event in islice(self._events, start, start + limit)]
+        return {'token': self.token, 'seq': changes[-1]['seq'] if changes else since, 'reset': False,
+                'changes': changes}
@@ -0,0 +1,148 @@
+import gzip
+import io
+import json
+import zlib
+
+from app.model.packing import pack, unpack
+from app.model.song import json_default, to_dict
+
+GZIP_MAGIC = b'\x1f\x8b'
+PACKED_MAGIC = b'SLP\x01'
+# trades a slightly bigger file for several times faster compression than level 9
+GZIP_LEVEL = 3
+
+
+class FileFormat:
+    """ Encoding of the song lists file
+    Every format can be told apart from the first bytes of the file, so
+    files are read whatever format they were written in.
+    """
+    name = None
+
+    def dumps(self, data):
+        """ Encode a document
+        :param data: dictionary
+        :return: bytes
+        """
+        raise NotImplementedError
+
+    def dump(self, data, f):
+        """ Encode a document into a file opened in binary mode
+        :param data: dictionary
+        :param f: file
+        :return:
+        """
+        f.write(self.dumps(data))
+
+
+class IndentedJson(FileFormat):
+    """ JSON indented by 4 spaces, the original format, easy to read and diff
+    Lists are encoded one at a time with their song records turned into
+    dictionaries, as the encoder used for indented output is much slower
+    with a default hook, and converting the whole document at once would
+    double its memory while saving.
+    """
+    name = 'json'
+
+    @staticmethod
+    def _encode(obj, margin=''):
+        buffer = io.StringIO()
+        json.dump(obj, buffer, indent=4, default=json_default)
+        return buffer.getvalue().replace('\n', '\n' + margin) if margin else buffer.getvalue()
+
+    def _chunks(self, data):
+        if not isinstance(data, dict) or not isinstance(data.get('lists'), list) or not data['lists']:
+            yield self._encode(data)
+            return
+        yield '{'
+        for position, (key, value) in enumerate(data.items()):
+            yield (',\n    ' if position else '\n    ') + json.dumps(key) + ': '
+            if key != 'lists':
+                yield self._encode(value, '    ')
+                continue
+            yield '['
+            for list_position, list_data in enumerate(value):
+                if isinstance(list_data, dict) and isinstance(list_data.get('songs'), list):
+                    list_data = dict(list_data, songs=[to_dict(song) for song in list_data['songs']])
+                yield (',\n        ' if list_position else '\n        ') + self._encode(list_data, '        ')
+            yield '\n    ]'
+        yield '\n}'
+
+    def dumps(self, data):
+        return ''.join(self._chunks(data)).encode('utf-8')
+
+    def dump(self, data, f):
+        writer = io.TextIOWrapper(f, encoding='utf-8')
+        try:
+            writer.writelines(self._chunks(data))
+            writer.flush()
+        finally:
+            writer.detach()
+
+
+class MinifiedJson(FileFormat):
+    """ JSON without whitespace, encoded by the C accelerated encoder """
+    name = 'json-min'
+
+    def dumps(self, data):
+        return json.dumps(data, separators=(',', ':'), ensure_ascii=False, default=json_default).encode('utf-8')
+
+
+class GzipJson(MinifiedJson):
+    """ Gzip compressed minified JSON """
+    name = 'json-gzip'
+
+    def dumps(self, data):
+        return gzip.compress(super().dumps(data), compresslevel=GZIP_LEVEL, mtime=0)
+
+
+class Packed(FileFormat):
+    """ MessagePack behind a 4 byte header, see app.model.packing """
+    name = 'packed'
+
+    def dumps(self, data):
+        return PACKED_MAGIC + pack(data)
+
+
+FORMATS = {file_format.name: file_format for file_format in (IndentedJson(), MinifiedJson(), GzipJson(), Packed())}
+
+
+def get_format(name):
+    """ File format by name
+    :param name: string, one of FORMATS
+    :return: FileFormat
+    """
+    try:
+        return FORMATS[name]
+    except KeyError:
+        raise ValueError(f'Unknown song file format {name!r}, expected one of {", ".join(FORMATS)}')
+
+
+def loads(raw):
+    """ Decode a document in any of the formats
+    :param raw: bytes
+    :return: decoded object, {} for an empty file
+    """
+    if not raw:
+        return {}
+    try:
+        if raw.startswith(GZIP_MAGIC):
+            raw = gzip.decompress(raw)
+        elif raw.startswith(PACKED_MAGIC):
+            return unpack(raw[len(PACKED_MAGIC):])
+    except (OSError, EOFError, zlib.error) as e:
+        raise ValueError(f'Corrupted compressed file: {e}') from e
+    return json.loads(raw)
+
+
+def detect(raw):
+    """ Name of the format raw was written in
+    Indented and minified JSON are not told apart.
+    :param raw: bytes
+    :return: string
+    """
+    if raw.startswith(GZIP_MAGIC):
+        return GzipJson.name
+    if raw.startswith(PACKED_MAGIC):
+        return Packed.name
+    return IndentedJson.name
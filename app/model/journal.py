@@ -0,0 +1,166 @@
+import json
+import os
+import threading
+
+from app import metrics
+from app.model.song import json_default
+
+
+def apply_record(index, record):
+    """ Replay one journal record on top of an indexed document
+    :param index: SongIndex
+    :param record: dictionary
+    :return:
+    """
+    op = record.get('op')
+    if op == 'create_list':
+        index.append(record['list'])
+    elif op == 'add_song':
+        index.add_song(record['list_id'], record['song'])
+    elif op == 'remove_song':
+        index.remove_song(record['list_id'], record['song'])
+    elif op == 'remove_list':
+        index.remove(record['list_id'])
+
+
+class Journal:
+    """ Append-only log of song list mutations
+    Every record is one JSON line carrying an increasing 'seq'. A line torn
+    by a crash during append is skipped when reading, and the next append
+    starts on a fresh line so it cannot be glued to it.
+    A position is the (inode, offset) pair up to which the log was read.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def size(self):
+        """ Current size of the log in bytes
+        :return: int
+        """
+        try:
+            return os.stat(self.path).st_size
+        except OSError:
+            return 0
+
+    def position(self):
+        """ Position at the end of the log
+        :return: tuple or None when there is no log
+        """
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_size
+
+    def append(self, records, sync=True):
+        """ Append records and flush them to disk
+        :param records: list of dictionaries
+        :param sync: False leaves the records in the OS cache, see sync
+        :return: position after the appended records
+        """
+        payload = ''.join(json.dumps(record, separators=(',', ':'), default=json_default) + '\n' for record in records)
+        with open(self.path, 'ab+') as f:
+            if f.tell():
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    payload = '\n' + payload
+            data = payload.encode('utf-8')
+            f.write(data)
+            f.flush()
+            if sync:
+                os.fsync(f.fileno())
+            stat = os.fstat(f.fileno())
+        metrics.STORAGE_WRITE_BYTES.inc('json', amount=len(data))
+        return stat.st_ino, stat.st_size
+
+    def sync(self):
+        """ Flush the records appended so far to disk
+        :return: position up to which the log is on disk, None when there is no log
+        """
+        try:
+            with open(self.path, 'rb') as f:
+                # only what was appended before the fsync started is known to be covered
+                stat = os.fstat(f.fileno())
+                os.fsync(f.fileno())
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_size
+
+    def read(self, offset=0):
+        """ Read the complete records written after offset
+        :param offset: int
+        :return: list of dictionaries and the position after them
+        """
+        try:
+            with open(self.path, 'rb') as f:
+                inode = os.fstat(f.fileno()).st_ino
+                f.seek(offset)
+                chunk = f.read()
+        except OSError:
+            return [], None
+        end = chunk.rfind(b'\n') + 1
+        records = []
+        for line in chunk[:end].splitlines():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(record, dict):
+                records.append(record)
+        return records, (inode, offset + end)
+
+    def rewrite(self, records):
+        """ Atomically replace the log with the given records
+        :param records: list of dictionaries
+        :return: position at the end of the new log
+        """
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            for record in records:
+                f.write(json.dumps(record, separators=(',', ':'), default=json_default) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        return self.position()
+
+
+class GroupSync:
+    """ Flushes of a log shared by the writers waiting for them
+    Writers append without syncing and, once they released the log, wait
+    for a sync covering their position. One of them syncs everything
+    appended so far while the others wait, so writers arriving together
+    share a single fsync. A log rewritten since the append was synced by
+    rewrite, syncing the new one is then enough.
+    """
+
+    def __init__(self):
+        # position covered by the last sync
+        self._synced = None
+        self._syncing = False
+        self._done = threading.Condition()
+
+    def _covered(self, position):
+        return self._synced is not None and self._synced[0] == position[0] and self._synced[1] >= position[1]
+
+    def sync(self, journal, position):
+        """ Return once the log is on disk up to position
+        :param journal: Journal
+        :param position: position returned by append
+        :return:
+        """
+        with self._done:
+            while self._syncing and not self._covered(position):
+                self._done.wait()
+            if self._covered(position):
+                return
+            self._syncing = True
+        synced = None
+        try:
+            synced = journal.sync()
+        finally:
+            with self._done:
+                self._syncing = False
+                if synced is not None:
+                    self._synced = synced
+                self._done.notify_all()
@@ -0,0 +1,205 @@
+""" MessagePack encoding of JSON-like documents
+
+Only the types a JSON document can hold are supported: None, booleans,
+integers up to 64 bits, floats, strings, lists and mappings, such as
+dictionaries and song records. The output is plain MessagePack, so other
+tools can read it.
+"""
+import struct
+from collections.abc import Mapping
+
+_uint8 = struct.Struct('>B')
+_uint16 = struct.Struct('>H')
+_uint32 = struct.Struct('>I')
+_uint64 = struct.Struct('>Q')
+_int8 = struct.Struct('>b')
+_int16 = struct.Struct('>h')
+_int32 = struct.Struct('>i')
+_int64 = struct.Struct('>q')
+_float32 = struct.Struct('>f')
+_float64 = struct.Struct('>d')
+
+
+def _header(out, size, fixed, small, medium, large):
+    if size < 16 and fixed is not None:
+        out.append(fixed | size)
+    elif small is not None and size < 0x100:
+        out.append(small)
+        out.append(size)
+    elif size < 0x10000:
+        out.append(medium)
+        out += _uint16.pack(size)
+    elif size < 0x100000000:
+        out.append(large)
+        out += _uint32.pack(size)
+    else:
+        raise ValueError('Object too large to pack')
+
+
+def _pack_int(out, value):
+    if 0 <= value < 0x80:
+        out.append(value)
+    elif -0x20 <= value < 0:
+        out.append(value & 0xff)
+    elif 0 <= value < 0x10000000000000000:
+        for limit, code, packer in ((0x100, 0xcc, _uint8), (0x10000, 0xcd, _uint16),
+                                    (0x100000000, 0xce, _uint32), (0x10000000000000000, 0xcf, _uint64)):
+            if value < limit:
+                out.append(code)
+                out += packer.pack(value)
+                return
+    elif -0x8000000000000000 <= value < 0:
+        for limit, code, packer in ((-0x80, 0xd0, _int8), (-0x8000, 0xd1, _int16),
+                                    (-0x80000000, 0xd2, _int32), (-0x8000000000000000, 0xd3, _int64)):
+            if value >= limit:
+                out.append(code)
+                out += packer.pack(value)
+                return
+    else:
+        raise ValueError(f'Integer {value} does not fit in 64 bits')
+
+
+def pack(obj):
+    """ Encode a document
+    :param obj: JSON-like object
+    :return: bytes
+    """
+    out = bytearray()
+    append = out.append
+
+    def _pack(value):
+        kind = type(value)
+        if kind is str:
+            encoded = value.encode('utf-8')
+            size = len(encoded)
+            if size < 32:
+                append(0xa0 | size)
+            else:
+                _header(out, size, None, 0xd9, 0xda, 0xdb)
+            out.extend(encoded)
+        elif kind is dict:
+            _header(out, len(value), 0x80, None, 0xde, 0xdf)
+            for key, item in value.items():
+                _pack(key)
+                _pack(item)
+        elif kind is list or kind is tuple:
+            _header(out, len(value), 0x90, None, 0xdc, 0xdd)
+            for item in value:
+                _pack(item)
+        elif value is None:
+            append(0xc0)
+        elif value is True:
+            append(0xc3)
+        elif value is False:
+            append(0xc2)
+        elif isinstance(value, int):
+            _pack_int(out, value)
+        elif isinstance(value, float):
+            append(0xcb)
+            out.extend(_float64.pack(value))
+        elif isinstance(value, str):
+            _pack(str(value))
+        elif isinstance(value, Mapping):
+            _pack(dict(value.items()))
+        elif isinstance(value, (list, tuple)):
+            _pack(list(value))
+        else:
+            raise TypeError(f'Object of type {kind.__name__} cannot be packed')
+
+    _pack(obj)
+    return bytes(out)
+
+
+# code: (struct, number of bytes) of the fixed size scalars
+_SCALARS = {
+    0xca: (_float32, 4), 0xcb: (_float64, 8),
+    0xcc: (_uint8, 1), 0xcd: (_uint16, 2), 0xce: (_uint32, 4), 0xcf: (_uint64, 8),
+    0xd0: (_int8, 1), 0xd1: (_int16, 2), 0xd2: (_int32, 4), 0xd3: (_int64, 8),
+}
+# code: (kind, struct of the length)
+_SIZED = {
+    0xd9: ('str', _uint8), 0xda: ('str', _uint16), 0xdb: ('str', _uint32),
+    0xdc: ('array', _uint16), 0xdd: ('array', _uint32),
+    0xde: ('map', _uint16), 0xdf: ('map', _uint32),
+}
+
+
+def unpack(data):
+    """ Decode a document encoded by pack
+    Dictionary keys are shared between all the dictionaries using them.
+    :param data: bytes
+    :return: JSON-like object
+    """
+    keys = {}
+    length = len(data)
+
+    def _str(start, end):
+        if end > length:
+            raise IndexError('string out of range')
+        return data[start:end].decode('utf-8')
+
+    def _map(pos, size):
+        result = {}
+        for _ in range(size):
+            code = data[pos]
+            if 0xa0 <= code <= 0xbf:
+                end = pos + 1 + (code & 0x1f)
+                raw = data[pos + 1:end]
+                key = keys.get(raw)
+                if key is None:
+                    key = keys[raw] = _str(pos + 1, end)
+                pos = end
+            else:
+                key, pos = _unpack(pos)
+            result[key], pos = _unpack(pos)
+        return result, pos
+
+    def _array(pos, size):
+        result = []
+        append = result.append
+        for _ in range(size):
+            item, pos = _unpack(pos)
+            append(item)
+        return result, pos
+
+    def _unpack(pos):
+        code = data[pos]
+        pos += 1
+        if code < 0x80:
+            return code, pos
+        if code >= 0xe0:
+            return code - 0x100, pos
+        if code >= 0xa0 and code <= 0xbf:
+            end = pos + (code & 0x1f)
+            return _str(pos, end), end
+        if code <= 0x8f:
+            return _map(pos, code & 0x0f)
+        if code <= 0x9f:
+            return _array(pos, code & 0x0f)
+        if code == 0xc0:
+            return None, pos
+        if code == 0xc2:
+            return False, pos
+        if code == 0xc3:
+            return True, pos
+        if code in _SCALARS:
+            packer, width = _SCALARS[code]
+            return packer.unpack_from(data, pos)[0], pos + width
+        if code in _SIZED:
+            kind, packer = _SIZED[code]
+            size = packer.unpack_from(data, pos)[0]
+            pos += packer.size
+            if kind == 'str':
+                return _str(pos, pos + size), pos + size
+            if kind == 'array':
+                return _array(pos, size)
+            return _map(pos, size)
+        raise ValueError(f'Unsupported type 0x{code:02x} at offset {pos - 1}')
+
+    try:
+        obj, pos = _unpack(0)
+    except (IndexError, struct.error, UnicodeDecodeError) as e:
+        raise ValueError(f'Truncated or corrupted data: {e}') from e
+    if pos != length:
+        raise ValueError(f'Extra data after offset {pos}')
+    return obj
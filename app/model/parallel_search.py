@@ -0,0 +1,159 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from heapq import merge
+
+from app.model.song import matcher
+
+# lists held by a worker process: sequence number -> dictionary
+_lists = {}
+# token of the SongIndex the lists were copied from
+_token = None
+
+
+def _sync(token, updates, reset):
+    global _token
+    if reset:
+        _lists.clear()
+        _token = token
+    elif token != _token:
+        raise RuntimeError('Worker does not hold the lists the update is based on')
+    for seq, list_data in updates:
+        if list_data is None:
+            _lists.pop(seq, None)
+        else:
+            _lists[seq] = list_data
+
+
+def _search(token, updates, reset, seqs, title, artist, album):
+    """ Runs in a worker: apply the updates, then search the partition
+    :param seqs: sequence numbers of the candidates in the partition
+    :return: sequence numbers of the lists found, in order
+    """
+    _sync(token, updates, reset)
+    matches = matcher(title, artist, album)
+    found = []
+    for seq in seqs:
+        list_data = _lists.get(seq)
+        if list_data is None:
+            continue
+        for song in list_data.get('songs', []):
+            if matches(song):
+                found.append(seq)
+                break
+    return found
+
+
+def _copy(list_data):
+    # songs are added and removed in place, their dictionaries never change
+    return dict(list_data, songs=list(list_data.get('songs', [])))
+
+
+class ParallelSearch:
+    """ Search song lists with a pool of worker processes
+    The lists are split in partitions by sequence number, each held by
+    its own worker process. Workers are sent the lists changed since
+    their last search along with the query, so the library is copied to
+    them once and kept up to date from the SongIndex change log. The
+    partitions are searched at the same time and the lists found merged
+    back in document order.
+
+    Workers are started on first use in the process that searches, so
+    they are not shared with processes forked afterwards.
+    """
+
+    def __init__(self, workers=0, min_lists=5000):
+        self.workers = workers
+        self.min_lists = min_lists
+        self._executors = []
+        self._pid = None
+        # token and change log mark of the index the workers hold
+        self._token = None
+        self._mark = None
+        self._lock = threading.Lock()
+
+    def configure(self, workers, min_lists):
+        with self._lock:
+            self._close(wait=True)
+            self.workers = workers
+            self.min_lists = min_lists
+
+    def enabled(self, candidates):
+        """ Whether a search over that many candidate lists runs in parallel
+        :param candidates: int
+        :return: bool
+        """
+        return self.workers > 0 and candidates >= self.min_lists
+
+    def close(self):
+        """ Stop the worker processes, they are started again when needed
+        :return:
+        """
+        with self._lock:
+            self._close(wait=True)
+
+    def _close(self, wait=False):
+        if self._pid == os.getpid():
+            for executor in self._executors:
+                executor.shutdown(wait=wait, cancel_futures=True)
+        # executors inherited through a fork belong to the parent
+        self._executors = []
+        self._token = self._mark = None
+
+    def _start(self):
+        if self._pid != os.getpid():
+            self._close()
+        if not self._executors:
+            # a fork of a threaded server could inherit locks held by other threads
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+            self._executors = [ProcessPoolExecutor(1, context) for _ in range(self.workers)]
+            self._pid = os.getpid()
+
+    def _updates(self, index, lock):
+        """ Changes to send to each worker, copied under the storage lock
+        :return: list of updates per worker and whether workers start over
+        """
+        count = len(self._executors)
+        with lock:
+            changed = index.changes_since(self._mark) if self._token == index.token else None
+            reset = changed is None
+            if reset:
+                changed = index.seqs()
+            updates = [[] for _ in range(count)]
+            for seq in changed:
+                list_data = index.by_seq(seq)
+                updates[seq % count].append((seq, None if list_data is None else _copy(list_data)))
+            self._token, self._mark = index.token, index.mark()
+        return updates, reset
+
+    def search(self, index, lock, seqs, title, artist, album):
+        """ Lists holding a matching song
+        :param index: SongIndex of the lists
+        :param lock: lock the index is changed under
+        :param seqs: sequence numbers of the candidate lists, in document order
+        :param title: string
+        :param artist: string
+        :param album: string
+        :return: sequence numbers in document order, None when the workers failed
+        """
+        with self._lock:
+            self._start()
+            executors = self._executors
+            count = len(executors)
+            updates, reset = self._updates(index, lock)
+            parts = [[] for _ in range(count)]
+            for seq in seqs:
+                parts[seq % count].append(seq)
+            # workers run their tasks in order, so updates are applied in order too
+            futures = [executor.submit(_search, index.token, update, reset, part, title, artist, album)
+                       for executor, update, part in zip(executors, updates, parts)]
+        try:
+            return list(merge(*(future.result() for future in futures)))
+        except Exception:
+            # a worker died or lost track of its lists, start over on the next search
+            with self._lock:
+                if self._executors is executors:
+                    self._close()
+            return None
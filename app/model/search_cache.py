@@ -0,0 +1,129 @@
+import threading
+import time
+from collections import OrderedDict
+
+from app.model.song import fold
+
+
+def normalize_query(title, artist, album):
+    return tuple(fold(term) for term in (title, artist, album))
+
+
+class SearchCache:
+    """ LRU cache of search results with a time to live
+    Results are kept as references to the live list dictionaries, so song
+    changes inside a cached list show up without invalidation. An entry is
+    only dropped when a change can alter which lists it holds: a list or a
+    song matching its query is added, or a list it holds loses a matching
+    song or is removed.
+
+    Each entry keeps the function matching its query, built once by
+    matcher. A change bringing more than max_checked_songs songs clears
+    the cache rather than matching them against every entry.
+    """
+    max_checked_songs = 100
+
+    def __init__(self, matcher, max_entries=1024, ttl=60, max_results=10000):
+        self.matcher = matcher
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_results = max_results
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def configure(self, max_entries, ttl, max_results):
+        with self._lock:
+            self.max_entries = max_entries
+            self.ttl = ttl
+            self.max_results = max_results
+            self._clear()
+
+    def get(self, key):
+        """ Cached lists for a normalized query
+        :param key: tuple from normalize_query
+        :return: list of dictionaries or None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def generation(self):
+        """ Changes after every invalidation, see put
+        :return: int
+        """
+        return self._generation
+
+    def put(self, key, lists, generation, matches=None):
+        """ Cache the lists found for a query
+        Nothing is stored when an invalidation happened since generation
+        was read, as the lists may already be stale.
+        :param key: tuple from normalize_query
+        :param lists: list of dictionaries
+        :param generation: value of generation() before searching
+        :param matches: function matching the query, when the search built one
+        :return:
+        """
+        if not self.max_entries or len(lists) > self.max_results:
+            return
+        if matches is None:
+            matches = self.matcher(*key)
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, lists, {id(item) for item in lists}, matches)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _clear(self):
+        self._entries.clear()
+        self._generation += 1
+
+    def clear(self):
+        with self._lock:
+            self._clear()
+
+    def _invalidate(self, stale):
+        with self._lock:
+            self._generation += 1
+            for key, (_, _, ids, matches) in list(self._entries.items()):
+                if stale(ids, matches):
+                    del self._entries[key]
+                    self.invalidations += 1
+
+    def list_created(self, list_data):
+        songs = list_data.get('songs', [])
+        if len(songs) > self.max_checked_songs:
+            with self._lock:
+                self.invalidations += len(self._entries)
+                self._clear()
+            return
+        self._invalidate(lambda ids, matches: any(matches(song) for song in songs))
+
+    def song_added(self, list_data, song):
+        self._invalidate(lambda ids, matches: id(list_data) not in ids and matches(song))
+
+    def song_removed(self, list_data, song):
+        self._invalidate(lambda ids, matches: id(list_data) in ids and matches(song))
+
+    def list_removed(self, list_data):
+        self._invalidate(lambda ids, matches: id(list_data) in ids)
+
+    def stats(self):
+        """ Counters for monitoring
+        :return: dictionary
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'invalidations': self.invalidations, 'entries': len(self._entries)}
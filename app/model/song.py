@@ -0,0 +1,169 @@
+from collections.abc import Mapping
+from sys import intern
+
+# fields every song is expected to have, in the order they are written
+FIELDS = ('title', 'artist', 'album', 'id')
+# fields searched by substring, and the slots holding their search keys
+SEARCH_FIELDS = ('title', 'artist', 'album')
+KEY_SLOTS = ('title_key', 'artist_key', 'album_key')
+
+_MISSING = object()
+
+
+def fold(value):
+    """ Search key of a field, its casefolded text
+    :param value: field value
+    :return: string, empty for missing or non text values
+    """
+    if type(value) is not str:
+        return ''
+    folded = value.casefold()
+    return value if folded == value else intern(folded)
+
+
+class Song(Mapping):
+    """ Read-only song record, taking a fraction of the memory of a dict
+    Known fields are kept in slots, titles, artists and albums interned
+    so a song held by many lists shares the strings, and any other field
+    in a dictionary of its own. It reads like the dictionary it was made
+    from and is turned back into one when encoded, see json_default.
+    Records are never changed once made.
+
+    The search key of each searched field is computed once, when the
+    record is made, see matcher.
+    """
+    __slots__ = FIELDS + ('extra',) + KEY_SLOTS
+
+    def __init__(self, title=_MISSING, artist=_MISSING, album=_MISSING, id=_MISSING, extra=None):
+        self.title = title
+        self.artist = artist
+        self.album = album
+        self.id = id
+        self.extra = extra
+        self.title_key = fold(title)
+        self.artist_key = fold(artist)
+        self.album_key = fold(album)
+
+    @classmethod
+    def from_dict(cls, song):
+        """ Record holding a song dictionary's fields
+        :param song: dictionary
+        :return: Song
+        """
+        get = song.get
+        title, artist, album, song_id = get('title', _MISSING), get('artist', _MISSING), \
+            get('album', _MISSING), get('id', _MISSING)
+        extra = None
+        if len(song) != len(FIELDS) or _MISSING in (title, artist, album, song_id):
+            extra = {key: value for key, value in song.items() if key not in FIELDS} or None
+        return cls(intern(title) if type(title) is str else title,
+                   intern(artist) if type(artist) is str else artist,
+                   intern(album) if type(album) is str else album,
+                   song_id, extra)
+
+    def __reduce__(self):
+        # the marker of missing fields is not the same object in another process
+        return Song.from_dict, (self.to_dict(),)
+
+    def to_dict(self):
+        """ Dictionary with the song's fields
+        :return: dictionary
+        """
+        if self.extra is None and _MISSING not in (self.title, self.artist, self.album, self.id):
+            return {'title': self.title, 'artist': self.artist, 'album': self.album, 'id': self.id}
+        song = {field: getattr(self, field) for field in FIELDS if getattr(self, field) is not _MISSING}
+        if self.extra:
+            song.update(self.extra)
+        return song
+
+    def get(self, key, default=None):
+        if key in FIELDS:
+            value = getattr(self, key)
+            return default if value is _MISSING else value
+        return self.extra.get(key, default) if self.extra else default
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __iter__(self):
+        for field in FIELDS:
+            if getattr(self, field) is not _MISSING:
+                yield field
+        if self.extra:
+            yield from self.extra
+
+    def __len__(self):
+        return sum(getattr(self, field) is not _MISSING for field in FIELDS) + len(self.extra or ())
+
+    def items(self):
+        return self.to_dict().items()
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+
+def compact(song):
+    """ Song record for a song dictionary, anything else is returned as is
+    :param song: dictionary or Song
+    :return: Song
+    """
+    return Song.from_dict(song) if type(song) is dict else song
+
+
+def to_dict(song):
+    """ Dictionary for a Song record, anything else is returned as is
+    :param song: Song or dictionary
+    :return: dictionary
+    """
+    return song.to_dict() if type(song) is Song else song
+
+
+def search_key(song, field):
+    """ Search key of a song field
+    :param song: Song or dictionary
+    :param field: one of SEARCH_FIELDS
+    :return: string
+    """
+    if type(song) is Song:
+        return getattr(song, KEY_SLOTS[SEARCH_FIELDS.index(field)])
+    return fold(song.get(field))
+
+
+def matcher(title, artist, album):
+    """ Function telling whether a song matches a query
+    A song matches when each given term is a substring of the field,
+    ignoring case. The terms are folded once, records are matched
+    against their stored search keys.
+    :param title: string
+    :param artist: string
+    :param album: string
+    :return: callable taking a Song or dictionary, returning a bool
+    """
+    terms = [(field, key, fold(term)) for field, key, term in zip(SEARCH_FIELDS, KEY_SLOTS, (title, artist, album))
+             if term]
+
+    def matches(song):
+        if type(song) is Song:
+            for _, key, term in terms:
+                if term not in getattr(song, key):
+                    return False
+            return True
+        for field, _, term in terms:
+            if term not in fold(song.get(field)):
+                return False
+        return True
+
+    return matches
+
+
+def json_default(obj):
+    """ default hook of json.dump, encoding Song records as objects
+    :param obj: object json cannot encode
+    :return: dictionary
+    """
+    if isinstance(obj, Song):
+        return obj.to_dict()
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
@@ -0,0 +1,405 @@
+import json
+import os
+import uuid
+from bisect import bisect_left, insort
+from itertools import count
+
+from app.model.song import SEARCH_FIELDS, compact, fold, search_key
+
+GRAM_SIZE = 3
+# changes logged at least, even for small documents
+LOG_MIN_SIZE = 1024
+
+
+def _grams(text):
+    return {text[i:i + GRAM_SIZE] for i in range(len(text) - GRAM_SIZE + 1)}
+
+
+def song_key(song):
+    """ Hash of a song's content, leaving its id out
+    Equal songs get equal keys, so it can stand in for dict comparison.
+    :param song: dictionary
+    :return: int
+    """
+    items = tuple(sorted((key, value) for key, value in song.items() if key != 'id'))
+    try:
+        return hash(items)
+    except TypeError:
+        # nested values are not hashable
+        return hash(json.dumps(items, sort_keys=True, default=str))
+
+
+def _hashable(value):
+    # ids read from a file can be arrays or objects, those are not looked up by id
+    try:
+        hash(value)
+    except TypeError:
+        return False
+    return True
+
+
+def _same_content(stored, song):
+    return {key: value for key, value in stored.items() if key != 'id'} == song
+
+
+class SongPositions:
+    """ Where each song of one list sits in its songs array
+    Songs get increasing sequence numbers kept in an array parallel to
+    the songs, so a song found by id or by content key is located with a
+    bisect instead of comparing it against every other song.
+    """
+    __slots__ = ('seqs', 'next_seq', 'by_key', 'by_id')
+
+    def __init__(self, songs):
+        self.seqs = []
+        self.next_seq = count()
+        # content key -> sequence number of the song with that content, or
+        # a list of them when several songs share it
+        self.by_key = {}
+        self.by_id = {}
+        for song in songs:
+            self.add(song)
+
+    def add(self, song):
+        seq = next(self.next_seq)
+        self.seqs.append(seq)
+        key = song_key(song)
+        seqs = self.by_key.get(key)
+        if seqs is None:
+            self.by_key[key] = seq
+        elif type(seqs) is list:
+            seqs.append(seq)
+        else:
+            self.by_key[key] = [seqs, seq]
+        song_id = song.get('id')
+        if song_id is not None and _hashable(song_id):
+            self.by_id.setdefault(song_id, seq)
+
+    def find(self, songs, song):
+        """ Position of the first song matching song's id, or its content
+        :param songs: the list's songs
+        :param song: dictionary
+        :return: position and sequence number
+        """
+        if song.get('id') is not None:
+            seq = self.by_id.get(song['id'])
+            if seq is not None:
+                return bisect_left(self.seqs, seq), seq
+        else:
+            seqs = self.by_key.get(song_key(song), [])
+            for seq in seqs if type(seqs) is list else (seqs,):
+                position = bisect_left(self.seqs, seq)
+                if _same_content(songs[position], song):
+                    return position, seq
+        raise ValueError(f'{song!r} is not in list')
+
+    def remove(self, position, seq, song):
+        del self.seqs[position]
+        key = song_key(song)
+        seqs = self.by_key[key]
+        if type(seqs) is not list:
+            del self.by_key[key]
+        else:
+            seqs.remove(seq)
+            if len(seqs) == 1:
+                self.by_key[key] = seqs[0]
+        song_id = song.get('id')
+        if _hashable(song_id) and self.by_id.get(song_id) == seq:
+            del self.by_id[song_id]
+
+
+class SongIndex:
+    """ Lookup structures built over a song list document
+    Every list in data['lists'] gets an increasing sequence number kept in
+    a parallel array, so a list can be found by id and dropped from the
+    document without scanning it. Only the first list with a given id is
+    found by id, which matches what get/remove used to find; once it is
+    removed the next one with the id is.
+
+    Each list's songs are tracked by SongPositions, so a song is removed
+    by id or by content without scanning the list. Every change to a list
+    bumps its version, which together with the index token identifies
+    the list's content for as long as this index lives.
+
+    The search keys of song titles, artists and albums are split into trigrams
+    posting to the lists that contain them. A substring query can only
+    match lists holding all of its trigrams, so search only has to check
+    those candidates.
+
+    Sequence numbers can also be given by the caller, for lists stored
+    with their own, and a partition function groups the lists so that
+    each group can be listed in order, see part.
+
+    Songs are stored as Song records, converted as they enter the
+    document. The sequence numbers of changed lists are logged, so copies of the
+    lists kept elsewhere can be brought up to date, see changes_since.
+    """
+
+    def __init__(self, data, seqs=None, partition=None):
+        self.data = data
+        self._next_seq = count()
+        self._changes = count(1)
+        self._seqs = []
+        self._by_seq = {}
+        self._by_id = {}
+        # list id -> sorted seqs of the lists sharing it past the first, for the few ids used twice
+        self._duplicates = {}
+        self._songs = {}
+        self._versions = {}
+        self._partition = partition
+        # partition -> seqs of its lists in order
+        self._parts = {}
+        self.token = uuid.uuid4().hex
+        # sequence numbers of the lists changed since the index was built,
+        # dropped once longer than the document, see changes_since
+        self._log = []
+        self._log_start = 0
+        # field -> trigram -> {list seq: number of songs holding the trigram}
+        self._grams = {field: {} for field in SEARCH_FIELDS}
+        for list_data, seq in zip(data.get('lists', []), self._next_seq if seqs is None else seqs):
+            self._seqs.append(seq)
+            self._track(list_data, seq)
+            self._versions[seq] = 0
+        self._log.clear()
+
+    def _track(self, list_data, seq):
+        # whatever can fail comes first, so a list is indexed whole or not at all
+        songs = list_data.get('songs')
+        if isinstance(songs, list):
+            songs[:] = map(compact, songs)
+        positions = SongPositions(list_data.get('songs', []))
+        part = self._partition(list_data) if self._partition is not None else None
+        self._by_seq[seq] = list_data
+        list_id = list_data.get('id')
+        if _hashable(list_id):
+            first = self._by_id.setdefault(list_id, seq)
+            if first != seq:
+                insort(self._duplicates.setdefault(list_id, []), max(first, seq))
+                self._by_id[list_id] = min(first, seq)
+        self._songs[seq] = positions
+        self._changed(seq)
+        if self._partition is not None:
+            insort(self._parts.setdefault(part, []), seq)
+        for song in list_data.get('songs', []):
+            self._index_song(seq, song, 1)
+
+    def _changed(self, seq):
+        self._versions[seq] = next(self._changes)
+        self._log_change(seq)
+
+    def _log_change(self, seq):
+        self._log.append(seq)
+        if len(self._log) > max(LOG_MIN_SIZE, len(self._seqs)):
+            self._log_start += len(self._log)
+            self._log = []
+
+    def _index_song(self, seq, song, delta):
+        for field in SEARCH_FIELDS:
+            postings = self._grams[field]
+            for gram in _grams(search_key(song, field)):
+                lists = postings.setdefault(gram, {})
+                total = lists.get(seq, 0) + delta
+                if total > 0:
+                    lists[seq] = total
+                else:
+                    lists.pop(seq, None)
+                    if not lists:
+                        del postings[gram]
+
+    def get(self, list_id):
+        """ Get a list by id
+        :param list_id: string
+        :return: dictionary or None
+        """
+        seq = self._by_id.get(list_id) if _hashable(list_id) else None
+        return self._by_seq[seq] if seq is not None else None
+
+    def version(self, list_id):
+        """ Opaque version of a list, changing whenever the list does
+        :param list_id: string
+        :return: string or None
+        """
+        seq = self._by_id.get(list_id) if _hashable(list_id) else None
+        if seq is None:
+            return None
+        # processes forked after the index was built share its token
+        return f'{self.token}-{os.getpid()}-{seq}-{self._versions[seq]}'
+
+    def mark(self):
+        """ Position in the change log, to pass to changes_since later
+        :return: int
+        """
+        return self._log_start + len(self._log)
+
+    def changes_since(self, mark):
+        """ Lists changed, added or removed since mark was taken
+        :param mark: value returned by mark
+        :return: set of sequence numbers, None when the log no longer goes back to mark
+        """
+        if mark < self._log_start:
+            return None
+        return set(self._log[mark - self._log_start:])
+
+    def by_seq(self, seq):
+        """ Get a list by sequence number
+        :param seq: int
+        :return: dictionary or None
+        """
+        return self._by_seq.get(seq)
+
+    def lists(self, seqs):
+        """ Lists with the given sequence numbers, skipping removed ones
+        :param seqs: iterable of int
+        :return: list of dictionaries
+        """
+        by_seq = self._by_seq
+        return [by_seq[seq] for seq in seqs if seq in by_seq]
+
+    def seqs(self):
+        """ Sequence numbers of all the lists in document order
+        :return: list of int
+        """
+        return list(self._seqs)
+
+    def part(self, key):
+        """ Lists of a partition in order
+        :param key: value returned by the partition function
+        :return: list of (seq, dictionary) tuples
+        """
+        return [(seq, self._by_seq[seq]) for seq in self._parts.get(key, ())]
+
+    def append(self, list_data):
+        """ Append a list to the document and index it
+        :param list_data: dictionary
+        :return:
+        """
+        seq = next(self._next_seq)
+        self._track(list_data, seq)
+        self.data.setdefault('lists', []).append(list_data)
+        self._seqs.append(seq)
+
+    def insert(self, list_data, seq):
+        """ Insert a list where its sequence number sorts in the document
+        :param list_data: dictionary
+        :param seq: int, not used by any other list
+        :return:
+        """
+        if seq in self._by_seq:
+            raise ValueError(f'List sequence number {seq} is already used')
+        self._track(list_data, seq)
+        position = bisect_left(self._seqs, seq)
+        self.data.setdefault('lists', []).insert(position, list_data)
+        self._seqs.insert(position, seq)
+
+    def remove(self, list_id):
+        """ Remove a list from the document
+        :param list_id: string
+        :return: the removed dictionary or None
+        """
+        seq = self._by_id.get(list_id) if _hashable(list_id) else None
+        return self.discard(seq) if seq is not None else None
+
+    def discard(self, seq):
+        """ Remove the list with a sequence number from the document
+        :param seq: int
+        :return: the removed dictionary or None
+        """
+        list_data = self._by_seq.pop(seq, None)
+        if list_data is None:
+            return None
+        list_id = list_data.get('id')
+        if _hashable(list_id):
+            duplicates = self._duplicates.get(list_id)
+            if self._by_id.get(list_id) != seq:
+                del duplicates[bisect_left(duplicates, seq)]
+            elif duplicates:
+                # the next list with the id is found from now on
+                self._by_id[list_id] = duplicates.pop(0)
+            else:
+                del self._by_id[list_id]
+            if duplicates == []:
+                del self._duplicates[list_id]
+        del self._songs[seq]
+        del self._versions[seq]
+        self._log_change(seq)
+        if self._partition is not None:
+            seqs = self._parts[self._partition(list_data)]
+            del seqs[bisect_left(seqs, seq)]
+        for song in list_data.get('songs', []):
+            self._index_song(seq, song, -1)
+        position = bisect_left(self._seqs, seq)
+        del self._seqs[position]
+        del self.data['lists'][position]
+        return list_data
+
+    def add_song(self, list_id, song):
+        """ Append a song to a list and index it
+        :param list_id: string
+        :param song: dictionary
+        :return:
+        """
+        seq = self._by_id[list_id]
+        positions = self._songs[seq]
+        if song.get('id') is not None and song['id'] in positions.by_id:
+            raise ValueError(f'Song {song["id"]} is already in list {list_id}')
+        song = compact(song)
+        self._by_seq[seq]['songs'].append(song)
+        positions.add(song)
+        self._changed(seq)
+        self._index_song(seq, song, 1)
+
+    def remove_song(self, list_id, song):
+        """ Remove a song from a list
+        When song carries an id the song with that id is removed, otherwise
+        the first song with the same content, ignoring ids.
+        :param list_id: string
+        :param song: dictionary
+        :return: the removed dictionary
+        """
+        seq = self._by_id[list_id]
+        positions = self._songs[seq]
+        songs = self._by_seq[seq]['songs']
+        position, song_seq = positions.find(songs, song)
+        removed = songs.pop(position)
+        positions.remove(position, song_seq, removed)
+        self._changed(seq)
+        self._index_song(seq, removed, -1)
+        return removed
+
+    def candidates(self, title, artist, album):
+        """ Lists that may hold a song matching the query, in document order
+        Query terms shorter than a trigram do not narrow the result.
+        :param title: string
+        :param artist: string
+        :param album: string
+        :return: list of dictionaries
+        """
+        return self.lists(self.candidate_seqs(title, artist, album))
+
+    def candidate_seqs(self, title, artist, album):
+        """ Sequence numbers of the candidates, in document order
+        :param title: string
+        :param artist: string
+        :param album: string
+        :return: list of int
+        """
+        postings = []
+        for field, term in zip(SEARCH_FIELDS, (title, artist, album)):
+            term = fold(term)
+            if len(term) < GRAM_SIZE:
+                continue
+            for gram in _grams(term):
+                lists = self._grams[field].get(gram)
+                if not lists:
+                    return []
+                postings.append(lists)
+        if not postings:
+            return list(self._seqs)
+
+        postings.sort(key=len)
+        found = set(postings[0])
+        for lists in postings[1:]:
+            found.intersection_update(lists.keys())
+            if not found:
+                return []
+        return sorted(found)
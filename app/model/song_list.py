@@ -1,41 +1,905 @@
 import json
 import os
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+from contextlib import ExitStack, contextmanager, suppress
+from operator import itemgetter
 
+try:
+    import fcntl
+except ImportError:  # not available on Windows, only the in-process lock is used
+    fcntl = None
 
-class ListNotFoundException(Exception):
-    pass
+from app import metrics
+from app.model import file_format
+from app.model.change_feed import ChangeFeed, change_event
+from app.model.journal import GroupSync, Journal, apply_record
+from app.model.parallel_search import ParallelSearch
+from app.model.search_cache import SearchCache, normalize_query
+from app.model.song import matcher
+from app.model.song_index import SongIndex
+from app.model.storage import ListNotFoundException, SongStorage
 
+# low bits of a list's sequence number in sharded mode, holding its shard
+SHARD_BITS = 16
 
-class SongList:
+
+class SongList(SongStorage):
+    """ Song lists stored in a JSON file """
+    name = 'json'
     SONG_PATH_FILE = 'app/mock/song_lists.json'
+    # 'snapshot' rewrites SONG_PATH_FILE on every change, 'journal' appends
+    # changes to SONG_PATH_FILE + '.log' and folds them into the snapshot
+    # in the background once the log is big enough
+    PERSISTENCE = 'snapshot'
+    JOURNAL_COMPACT_BYTES = 1024 * 1024
+    JOURNAL_COMPACT_RATIO = 0.5
+    # when a journaled change is on disk: 'sync' before the writer lock is
+    # released, 'group' before the change returns, with one fsync shared by
+    # the writers waiting together, 'async' within FLUSH_INTERVAL seconds
+    DURABILITY = 'sync'
+    FLUSH_INTERVAL = 1.0
+    # seconds after which a non empty journal is folded into a snapshot,
+    # whatever its size, 0 only folds it past JOURNAL_COMPACT_BYTES
+    SNAPSHOT_INTERVAL = 0
+    # format new snapshots are written in, see app.model.file_format,
+    # snapshots are read in whatever format they were written
+    FILE_FORMAT = 'json'
+    # 'sharded' spreads the lists over SHARDS files by a hash of their id,
+    # in the directory named like SONG_PATH_FILE without extension plus
+    # '.shards', next to a manifest holding a version per shard. A change
+    # only rewrites the shards of the lists it touches, and changes to
+    # different shards are written in parallel. SONG_PATH_FILE is imported
+    # when the directory is first created.
+    SHARDS = 64
+
+    # serializes mutations and journal replay within the process, writers
+    # across processes also hold an flock on SONG_PATH_FILE + '.lock'
+    _lock = threading.RLock()
+    _lock_depth = 0
+    # process-resident copy of SONG_PATH_FILE, kept until the file changes on disk
+    _resident_data = None
+    _resident_signature = None
+    # lookup structures for the document last handed out by get_from_file
+    _index = None
+    # last journal record applied to the resident copy and where it ends
+    _journal_seq = 0
+    _journal_position = None
+    _compacting = False
+    _journal_sync = GroupSync()
+    # journal positions the thread's changes wait to be synced up to, in 'group' durability
+    _unsynced = threading.local()
+    # background thread syncing the journal and folding it into snapshots,
+    # its stop event and the process it runs in
+    _flusher = None
+    _flusher_stop = None
+    _flusher_pid = None
+    _snapshot_time = time.monotonic()
+    # manifest versions of the shards in the resident copy
+    _shard_versions = None
+    # (shard directory, shard) -> lock held by the thread writing the shard
+    _shard_locks = {}
+
+    search_cache = SearchCache(matcher)
+    # changes made to the lists, for clients following them
+    change_feed = ChangeFeed()
+    # searches over many lists are spread over worker processes when enabled
+    parallel_search = ParallelSearch()
+
+    @classmethod
+    def configure(cls, config):
+        """ Apply storage settings from a mapping such as app.config
+        :param config: dictionary
+        :return:
+        """
+        cls.SONG_PATH_FILE = config.get('SONG_PATH_FILE', cls.SONG_PATH_FILE)
+        cls.PERSISTENCE = config.get('SONG_PERSISTENCE', cls.PERSISTENCE)
+        cls.FILE_FORMAT = file_format.get_format(config.get('SONG_FILE_FORMAT', cls.FILE_FORMAT)).name
+        cls.JOURNAL_COMPACT_BYTES = config.get('SONG_JOURNAL_COMPACT_BYTES', cls.JOURNAL_COMPACT_BYTES)
+        cls.JOURNAL_COMPACT_RATIO = config.get('SONG_JOURNAL_COMPACT_RATIO', cls.JOURNAL_COMPACT_RATIO)
+        cls.DURABILITY = config.get('SONG_JOURNAL_DURABILITY', cls.DURABILITY)
+        if cls.DURABILITY not in ('sync', 'group', 'async'):
+            raise ValueError(f'Unknown journal durability {cls.DURABILITY!r}')
+        cls.FLUSH_INTERVAL = config.get('SONG_JOURNAL_FLUSH_INTERVAL', cls.FLUSH_INTERVAL)
+        cls.SNAPSHOT_INTERVAL = config.get('SONG_SNAPSHOT_INTERVAL', cls.SNAPSHOT_INTERVAL)
+        cls._stop_flusher()
+        cls.SHARDS = config.get('SONG_SHARDS', cls.SHARDS)
+        if not 0 < cls.SHARDS <= 1 << SHARD_BITS:
+            raise ValueError(f'SONG_SHARDS must be between 1 and {1 << SHARD_BITS}')
+        cls.search_cache.configure(config.get('SONG_SEARCH_CACHE_SIZE', cls.search_cache.max_entries),
+                                   config.get('SONG_SEARCH_CACHE_TTL', cls.search_cache.ttl),
+                                   config.get('SONG_SEARCH_CACHE_MAX_RESULTS', cls.search_cache.max_results))
+        journaled = cls.PERSISTENCE == 'journal'
+        cls.change_feed.configure(config.get('SONG_CHANGE_FEED_SIZE', cls.change_feed.size),
+                                  config.get('SONG_CHANGE_FEED_MAX_WAITERS', cls.change_feed.max_waiters),
+                                  cls._feed_token() if journaled else None, cls.warm if journaled else None)
+        cls.parallel_search.configure(config.get('SONG_SEARCH_WORKERS', cls.parallel_search.workers),
+                                      config.get('SONG_SEARCH_PARALLEL_MIN_LISTS', cls.parallel_search.min_lists))
+        cls.reset_resident()
+
+    @classmethod
+    def _signature(cls, stat):
+        return cls.SONG_PATH_FILE, stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    @classmethod
+    def _set_resident(cls, data, signature):
+        cls._resident_data = data
+        cls._resident_signature = signature
+
+    @classmethod
+    def reset_resident(cls):
+        """ Drop the in-memory copy so the next read goes to disk
+        :return:
+        """
+        cls._set_resident(None, None)
+        cls._journal_seq = 0
+        cls._journal_position = None
+        cls._shard_versions = None
+
+    @classmethod
+    def warm(cls):
+        """ Load and index the song lists ahead of the first request
+        :return:
+        """
+        cls._read_index()
+
+    @classmethod
+    def usage(cls):
+        """ Size of the stored library, for monitoring
+        :return: dictionary
+        """
+        lists = cls.get_from_file().get('lists', [])
+        if cls.PERSISTENCE == 'sharded':
+            paths = [entry.path for entry in os.scandir(cls._shard_dir()) if entry.name.endswith('.json')]
+        else:
+            paths = [cls.SONG_PATH_FILE, cls._journal().path]
+        size = 0
+        for path in paths:
+            with suppress(OSError):
+                size += os.stat(path).st_size
+        return {'lists': len(lists), 'songs': sum(len(song_list.get('songs', ())) for song_list in lists),
+                'bytes': size}
+
+    @classmethod
+    def _read_index(cls):
+        """ Index of the current document, for callers not holding the lock
+        Indexes are only built under the lock: a writer could otherwise be
+        changing the document through another index, which the reader's
+        would then replace. Writers check the index matches the document
+        they change, one built over a document since reloaded is replaced.
+        :return: SongIndex
+        """
+        json_data = cls.get_from_file()
+        index = cls._index
+        if index is not None and index.data is json_data:
+            return index
+        with cls._lock:
+            return cls._get_index(json_data)
+
+    @classmethod
+    def _get_index(cls, json_data):
+        # the caller holds cls._lock
+        if cls._index is None or cls._index.data is not json_data:
+            cls._index = SongIndex(json_data)
+            cls.search_cache.clear()
+            # journaled changes are numbered by their seq, the feed goes on from the loaded one
+            cls.change_feed.invalidate(cls._journal_seq if cls.PERSISTENCE == 'journal' else None)
+        return cls._index
+
+    @classmethod
+    def _feed_token(cls):
+        # the same for every process journaling to the file, as the seqs numbering the changes
+        return 'journal-' + uuid.uuid5(uuid.NAMESPACE_URL, os.path.abspath(cls.SONG_PATH_FILE)).hex
+
+    @classmethod
+    def _journal(cls):
+        return Journal(cls.SONG_PATH_FILE + '.log')
+
+    @classmethod
+    def _make_dirs(cls):
+        directory = os.path.dirname(cls.SONG_PATH_FILE)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    @contextmanager
+    def _write_lock(cls, *list_ids):
+        """ Serialize writers within the process and across processes
+        Readers never take it: files are only ever replaced by a rename.
+        In sharded mode only the writers of the shards holding list_ids, or
+        of every shard without list_ids, are serialized.
+        """
+        if cls.PERSISTENCE == 'sharded':
+            with cls._shard_lock(list_ids):
+                yield
+            return
+        with cls._lock:
+            outermost = cls._lock_depth == 0
+            lock_file = None
+            if outermost and fcntl is not None:
+                cls._make_dirs()
+                lock_file = open(cls.SONG_PATH_FILE + '.lock', 'a')
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            cls._lock_depth += 1
+            try:
+                yield
+            finally:
+                cls._lock_depth -= 1
+                if lock_file is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+                    lock_file.close()
+        if outermost:
+            cls._wait_synced()
+
+    @classmethod
+    @contextmanager
+    def _shard_lock(cls, list_ids):
+        count = cls._shard_count()
+        shards = sorted({cls._shard_of(list_id, count) for list_id in list_ids}) if list_ids else range(count)
+        with ExitStack() as stack:
+            for shard in shards:
+                with cls._lock:
+                    lock = cls._shard_locks.setdefault((cls._shard_dir(), shard), threading.Lock())
+                stack.enter_context(lock)
+                if fcntl is not None:
+                    lock_file = stack.enter_context(open(cls._shard_path(shard, '.lock'), 'a'))
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    @classmethod
+    def _write_temp(cls, write, path=None):
+        """ Write a file next to path, ready to be renamed over it
+        :param write: callable receiving the open file
+        :param path: file to replace, SONG_PATH_FILE by default
+        :return: temporary path and the signature the file will have
+        """
+        path = path or cls.SONG_PATH_FILE
+        cls._make_dirs()
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+        try:
+            try:
+                os.fchmod(fd, os.stat(path).st_mode & 0o777)
+            except OSError:
+                os.fchmod(fd, 0o644)
+            with open(fd, 'wb') as f:
+                write(f)
+                f.flush()
+                os.fsync(f.fileno())
+                signature = cls._signature(os.fstat(f.fileno()))
+        except BaseException:
+            with suppress(OSError):
+                os.remove(tmp_path)
+            raise
+        return tmp_path, signature
 
     @classmethod
     def save_to_file(cls, data):
         """ Save the song list to a file
+        The file is replaced atomically, so a crash never leaves it truncated.
+        In sharded mode it is only an export, the shards are not changed.
         :param data: dictionary
         :return:
         """
-        os.makedirs(os.path.dirname(cls.SONG_PATH_FILE), exist_ok=True)
-        with open(cls.SONG_PATH_FILE, 'w') as f:
-            json.dump(data, f, indent=4)
+        payload = data
+        if cls.PERSISTENCE == 'journal':
+            # records up to this seq are already part of the snapshot
+            payload = dict(data, journal_seq=cls._journal_seq)
+        try:
+            with metrics.STORAGE_WRITE_SECONDS.time(cls.name):
+                tmp_path, signature = cls._write_temp(
+                    lambda f: file_format.get_format(cls.FILE_FORMAT).dump(payload, f))
+                os.replace(tmp_path, cls.SONG_PATH_FILE)
+        except Exception:
+            cls.reset_resident()
+            raise
+        metrics.STORAGE_WRITE_BYTES.inc(cls.name, amount=signature[-1])
+        if cls.PERSISTENCE != 'sharded':
+            cls._set_resident(data, signature)
+
+    @classmethod
+    def convert(cls, format_name):
+        """ Rewrite SONG_PATH_FILE in another format
+        New snapshots keep being written in FILE_FORMAT, set it as well to
+        stay on the new format.
+        :param format_name: string, one of file_format.FORMATS
+        :return: name of the format the file was in
+        """
+        target = file_format.get_format(format_name)
+        if cls.PERSISTENCE == 'sharded':
+            raise ValueError('Shards are rewritten in SONG_FILE_FORMAT as they change')
+        with cls._write_lock():
+            with open(cls.SONG_PATH_FILE, 'rb') as f:
+                raw = f.read()
+            # refuses to overwrite a file it cannot read
+            file_format.loads(raw)
+            data = cls.get_from_file()
+            previous, cls.FILE_FORMAT = cls.FILE_FORMAT, target.name
+            try:
+                cls.save_to_file(data)
+            finally:
+                cls.FILE_FORMAT = previous
+        return file_format.detect(raw)
+
+    @classmethod
+    def _load_snapshot(cls):
+        try:
+            with metrics.STORAGE_READ_SECONDS.time(cls.name), open(cls.SONG_PATH_FILE, 'rb') as f:
+                signature = cls._signature(os.fstat(f.fileno()))
+                try:
+                    data = file_format.loads(f.read())
+                except ValueError:
+                    data = {}
+        except OSError:
+            return {}, None
+        metrics.STORAGE_READ_BYTES.inc(cls.name, amount=signature[-1])
+        if not data or not isinstance(data, dict):
+            data = {}
+        return data, signature
 
     @classmethod
     def get_from_file(cls):
         """ Get the song list from a file
+        The parsed content is kept in memory and only read again when
+        the file's inode, mtime or size changes.
         :return: dictionary
         """
-        if os.path.exists(cls.SONG_PATH_FILE):
-            with open(cls.SONG_PATH_FILE, 'r') as f:
-                try:
-                    data = json.load(f)
-                except json.JSONDecodeError:
-                    return {}
-            if not data or not isinstance(data, dict):
-                return {}
+        if cls.PERSISTENCE == 'journal':
+            return cls._get_from_journal()
+        if cls.PERSISTENCE == 'sharded':
+            return cls._get_from_shards()
+        try:
+            stat = os.stat(cls.SONG_PATH_FILE)
+        except OSError:
+            cls.reset_resident()
+            return {}
+        if cls._resident_signature == cls._signature(stat):
+            return cls._resident_data
+
+        data, signature = cls._load_snapshot()
+        cls._set_resident(data, signature)
+        return data
+
+    @classmethod
+    def _snapshot_signature(cls):
+        try:
+            return cls._signature(os.stat(cls.SONG_PATH_FILE))
+        except OSError:
+            return None
+
+    @classmethod
+    def _get_from_journal(cls):
+        """ Get the song list as the snapshot plus the journal replayed on it
+        Records appended since the last call are applied to the resident
+        copy; a new snapshot or a rewritten log causes a full reload.
+        :return: dictionary
+        """
+        journal = cls._journal()
+        if cls._resident_data is not None and cls._snapshot_signature() == cls._resident_signature \
+                and journal.position() == cls._journal_position:
+            return cls._resident_data
+
+        with cls._lock:
+            signature = cls._snapshot_signature()
+            position = cls._journal_position
+            current = journal.position()
+            if cls._resident_data is not None and signature == cls._resident_signature:
+                if current == position:
+                    return cls._resident_data
+                if current and position and current[0] == position[0] and current[1] > position[1]:
+                    cls._replay_journal(journal, position[1])
+                    return cls._resident_data
+
+            data, signature = cls._load_snapshot()
+            cls.reset_resident()
+            cls._journal_seq = data.pop('journal_seq', 0)
+            data.setdefault('lists', [])
+            cls._set_resident(data, signature)
+            cls._replay_journal(journal, 0)
+            return data
+
+    @classmethod
+    def _replay_journal(cls, journal, offset):
+        with metrics.STORAGE_READ_SECONDS.time(cls.name):
+            records, position = journal.read(offset)
+        if position:
+            metrics.STORAGE_READ_BYTES.inc(cls.name, amount=position[1] - offset)
+        index = cls._get_index(cls._resident_data)
+        if records:
+            # changes made by other processes, the cache cannot tell which entries they touch
+            cls.search_cache.clear()
+        applied = []
+        for record in records:
+            if record.get('seq', 0) <= cls._journal_seq:
+                continue
+            try:
+                apply_record(index, record)
+                applied.append(record)
+            except (KeyError, ValueError):
+                # the change failed when it was made as well
+                pass
+            cls._journal_seq = record['seq']
+        cls._journal_position = position
+        cls._publish(applied)
+
+    @classmethod
+    def _commit(cls, json_data, *records):
+        """ Persist a mutation already applied to json_data
+        :param json_data: dictionary
+        :param records: journal records describing the mutation
+        :return:
+        """
+        if cls.PERSISTENCE == 'sharded':
+            cls._commit_shards(records)
+            return
+        if cls.PERSISTENCE != 'journal':
+            cls.save_to_file(json_data)
+            return
+
+        for record in records:
+            cls._journal_seq += 1
+            record['seq'] = cls._journal_seq
+        try:
+            with metrics.STORAGE_WRITE_SECONDS.time(cls.name):
+                position = cls._journal().append(records, sync=cls.DURABILITY == 'sync')
+        except Exception:
+            cls.reset_resident()
+            raise
+        cls._journal_position = position
+        cls._set_resident(json_data, cls._resident_signature)
+        if cls.DURABILITY == 'group':
+            cls._unsynced.position = position
+        if cls.DURABILITY == 'async' or cls.SNAPSHOT_INTERVAL:
+            cls._start_flusher()
+
+        snapshot_size = cls._resident_signature[-1] if cls._resident_signature else 0
+        if position[1] >= cls.JOURNAL_COMPACT_BYTES and \
+                position[1] >= snapshot_size * cls.JOURNAL_COMPACT_RATIO:
+            cls._schedule_compaction()
+
+    @classmethod
+    def _wait_synced(cls):
+        """ Wait for the journal to be on disk up to the thread's last change
+        :return:
+        """
+        position = getattr(cls._unsynced, 'position', None)
+        if position is None:
+            return
+        cls._unsynced.position = None
+        try:
+            with metrics.STORAGE_WRITE_SECONDS.time(cls.name):
+                cls._journal_sync.sync(cls._journal(), position)
+        except Exception:
+            with cls._lock:
+                cls.reset_resident()
+            raise
+
+    @classmethod
+    def _start_flusher(cls):
+        # threads are not carried over by a fork
+        if cls._flusher is not None and cls._flusher.is_alive() and cls._flusher_pid == os.getpid():
+            return
+        cls._flusher_stop = threading.Event()
+        cls._flusher = threading.Thread(target=cls._flush_loop, args=(cls._flusher_stop,), daemon=True)
+        cls._flusher_pid = os.getpid()
+        cls._flusher.start()
+
+    @classmethod
+    def _stop_flusher(cls):
+        if cls._flusher_stop is not None:
+            cls._flusher_stop.set()
+        cls._flusher = cls._flusher_stop = None
+
+    @classmethod
+    def _flush_loop(cls, stop):
+        """ Sync the journal and fold it into snapshots until stop is set
+        Failures are retried on the next round, changes stay in the journal.
+        """
+        intervals = [interval for interval in (cls.FLUSH_INTERVAL if cls.DURABILITY == 'async' else 0,
+                                               cls.SNAPSHOT_INTERVAL) if interval]
+        while intervals and not stop.wait(min(intervals)):
+            with suppress(OSError):
+                position = cls._journal_position
+                if cls.DURABILITY == 'async' and position is not None:
+                    cls._journal_sync.sync(cls._journal(), position)
+                if cls.SNAPSHOT_INTERVAL and time.monotonic() - cls._snapshot_time >= cls.SNAPSHOT_INTERVAL \
+                        and cls._journal().size() and not cls._compacting:
+                    cls._compacting = True
+                    cls.compact_journal()
+
+    @classmethod
+    def flush(cls):
+        """ Write out the changes only kept in memory or in the OS cache, before shutting down
+        The journal is synced and folded into a new snapshot.
+        :return:
+        """
+        if cls.PERSISTENCE != 'journal':
+            return
+        cls._stop_flusher()
+        journal = cls._journal()
+        position = journal.position()
+        if position is None or not position[1]:
+            return
+        cls._journal_sync.sync(journal, position)
+        cls.compact_journal()
+
+    @classmethod
+    def _schedule_compaction(cls):
+        if cls._compacting:
+            return
+        cls._compacting = True
+        threading.Thread(target=cls.compact_journal, daemon=True).start()
+
+    @classmethod
+    def compact_journal(cls):
+        """ Fold the journal into a new snapshot and truncate it
+        Only a shallow copy of the document is taken under the write lock,
+        it is serialized and written outside it, and only the rename and the
+        log rewrite block writers again.
+        :return:
+        """
+        try:
+            with cls._write_lock():
+                json_data = cls.get_from_file()
+                seq = cls._journal_seq
+                position = cls._journal_position
+                snapshot = cls._resident_signature
+                offset = position[1] if position else 0
+                # songs are never changed in place, copying the lists holding them is enough
+                lists = [dict(list_data, songs=list(list_data['songs']))
+                         if isinstance(list_data.get('songs'), list) else dict(list_data)
+                         for list_data in json_data.get('lists', [])]
+                document = dict(json_data, lists=lists, journal_seq=seq)
+
+            payload = file_format.get_format(cls.FILE_FORMAT).dumps(document)
+
+            with metrics.STORAGE_WRITE_SECONDS.time(cls.name):
+                tmp_path, signature = cls._write_temp(lambda f: f.write(payload))
+            metrics.STORAGE_WRITE_BYTES.inc(cls.name, amount=signature[-1])
+
+            with cls._write_lock():
+                journal = cls._journal()
+                current = journal.position()
+                if cls._snapshot_signature() != snapshot or \
+                        (position is not None and (current is None or current[0] != position[0])):
+                    # another process compacted meanwhile, offset no longer points into the log,
+                    # the inode alone does not tell as the new log may reuse its number
+                    os.remove(tmp_path)
+                    return
+                # records other processes appended meanwhile stay in the log, the
+                # resident copy has to hold them too before moving past them
+                cls.get_from_file()
+                os.replace(tmp_path, cls.SONG_PATH_FILE)
+                records, _ = journal.read(offset)
+                cls._journal_position = journal.rewrite([r for r in records if r.get('seq', 0) > seq])
+                cls._resident_signature = signature
+                cls._snapshot_time = time.monotonic()
+        finally:
+            cls._compacting = False
+
+    @classmethod
+    def _shard_dir(cls):
+        return os.path.splitext(cls.SONG_PATH_FILE)[0] + '.shards'
+
+    @classmethod
+    def _shard_path(cls, shard, suffix='.json'):
+        return os.path.join(cls._shard_dir(), '%03d%s' % (shard, suffix))
+
+    @classmethod
+    def _manifest_path(cls):
+        return os.path.join(cls._shard_dir(), 'manifest.json')
+
+    @classmethod
+    def _shard_count(cls):
+        if cls._shard_versions is None:
+            cls.get_from_file()
+        return len(cls._shard_versions)
+
+    @classmethod
+    def _shard_of(cls, list_id, count=None):
+        """ Shard holding the lists with an id, the same in every process
+        :param list_id: string
+        :param count: number of shards, the loaded manifest's by default
+        :return: int
+        """
+        return zlib.crc32(json.dumps(list_id).encode('utf-8')) % (count or cls._shard_count())
+
+    @staticmethod
+    def _new_list_seq(shard, last):
+        """ Sequence number of a new list, ordering lists by creation
+        The shard in the low bits keeps numbers given by different
+        processes apart, writers of a same shard are serialized.
+        :param shard: int
+        :param last: greatest sequence number in the shard or None
+        :return: int
+        """
+        seq = (time.time_ns() // 1000000) << SHARD_BITS | shard
+        if last is not None and seq <= last:
+            seq = last + (1 << SHARD_BITS)
+        return seq
+
+    @classmethod
+    def _read_manifest(cls):
+        try:
+            with open(cls._manifest_path()) as f:
+                return json.load(f), cls._signature(os.fstat(f.fileno()))
+        except FileNotFoundError:
+            return None, None
+
+    @classmethod
+    def _write_manifest(cls, manifest):
+        # not synced to disk: versions only tell processes which shards to reload
+        tmp_path = cls._manifest_path() + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+            f.flush()
+            signature = cls._signature(os.fstat(f.fileno()))
+        os.replace(tmp_path, cls._manifest_path())
+        return signature
+
+    @classmethod
+    @contextmanager
+    def _manifest_lock(cls):
+        with open(os.path.join(cls._shard_dir(), 'manifest.lock'), 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    @classmethod
+    def _read_shard(cls, shard):
+        """ Lists stored in a shard
+        A shard that cannot be decoded raises, rather than being rewritten
+        with only the changes made afterwards.
+        :param shard: int
+        :return: list of (seq, dictionary) tuples
+        """
+        try:
+            with metrics.STORAGE_READ_SECONDS.time(cls.name), open(cls._shard_path(shard), 'rb') as f:
+                raw = f.read()
+        except FileNotFoundError:
+            return []
+        metrics.STORAGE_READ_BYTES.inc(cls.name, amount=len(raw))
+        content = file_format.loads(raw)
+        return list(zip(content.get('seqs', []), content.get('lists', [])))
+
+    @classmethod
+    def _write_shard(cls, shard, entries):
+        payload = {'seqs': [seq for seq, _ in entries], 'lists': [list_data for _, list_data in entries]}
+        path = cls._shard_path(shard)
+        with metrics.STORAGE_WRITE_SECONDS.time(cls.name):
+            tmp_path, signature = cls._write_temp(lambda f: file_format.get_format(cls.FILE_FORMAT).dump(payload, f),
+                                                  path)
+            os.replace(tmp_path, path)
+        metrics.STORAGE_WRITE_BYTES.inc(cls.name, amount=signature[-1])
+
+    @classmethod
+    def _load_single_file(cls):
+        """ SONG_PATH_FILE with its journal replayed, to import into shards
+        :return: dictionary
+        """
+        data, _ = cls._load_snapshot()
+        data.setdefault('lists', [])
+        journal_seq = data.pop('journal_seq', 0)
+        records, _ = cls._journal().read()
+        records = [record for record in records if record.get('seq', 0) > journal_seq]
+        if records:
+            index = SongIndex(data)
+            for record in records:
+                with suppress(KeyError, ValueError):
+                    apply_record(index, record)
+        return data
+
+    @classmethod
+    def _create_shards(cls):
+        """ Create the shard directory, importing SONG_PATH_FILE into it
+        :return: manifest and its signature
+        """
+        os.makedirs(cls._shard_dir(), exist_ok=True)
+        with cls._manifest_lock():
+            manifest, signature = cls._read_manifest()
+            if manifest is not None:
+                # created by another process meanwhile
+                return manifest, signature
+            count = cls.SHARDS
+            shards = {}
+            for position, list_data in enumerate(cls._load_single_file()['lists']):
+                shard = cls._shard_of(list_data.get('id'), count)
+                shards.setdefault(shard, []).append((position << SHARD_BITS | shard, list_data))
+            for shard, entries in shards.items():
+                cls._write_shard(shard, entries)
+            manifest = {'versions': [0] * count}
+            return manifest, cls._write_manifest(manifest)
+
+    @classmethod
+    def _partition(cls, count):
+        return lambda list_data: cls._shard_of(list_data.get('id'), count)
+
+    @classmethod
+    def _load_shards(cls, count):
+        entries = []
+        for shard in range(count):
+            entries.extend(cls._read_shard(shard))
+        entries.sort(key=itemgetter(0))
+        data = {'lists': [list_data for _, list_data in entries]}
+        cls._index = SongIndex(data, [seq for seq, _ in entries], cls._partition(count))
+        cls.search_cache.clear()
+        cls.change_feed.invalidate()
+        cls._set_resident(data, None)
+
+    @classmethod
+    def _reload_shards(cls, shards):
+        """ Replace the lists of some shards by their content on disk
+        Only shards nobody in the process is writing can be reloaded.
+        :param shards: list of int
+        :return:
+        """
+        if not shards:
+            return
+        index = cls._index
+        for shard in shards:
+            for seq, _ in index.part(shard):
+                index.discard(seq)
+            for seq, list_data in cls._read_shard(shard):
+                index.insert(list_data, seq)
+        # changes made by other processes, the cache cannot tell which entries they touch
+        cls.search_cache.clear()
+        cls.change_feed.invalidate()
+
+    @classmethod
+    def _get_from_shards(cls):
+        """ Get the song lists from the shards
+        The manifest is the only file checked on every call, shards whose
+        version changed since they were loaded are read again.
+        :return: dictionary
+        """
+        try:
+            signature = cls._signature(os.stat(cls._manifest_path()))
+        except OSError:
+            signature = None
+        if cls._resident_data is not None and signature is not None and signature == cls._resident_signature:
+            return cls._resident_data
+
+        with cls._lock:
+            manifest, signature = cls._read_manifest()
+            if manifest is None:
+                manifest, signature = cls._create_shards()
+            if cls._resident_data is not None and signature == cls._resident_signature:
+                return cls._resident_data
+            versions = manifest['versions']
+            if cls._resident_data is None or cls._shard_versions is None or \
+                    len(versions) != len(cls._shard_versions) or cls._index is None or \
+                    cls._index.data is not cls._resident_data:
+                cls._load_shards(len(versions))
             else:
-                return data
+                cls._reload_shards([shard for shard, version in enumerate(versions)
+                                    if version != cls._shard_versions[shard]])
+            cls._shard_versions = list(versions)
+            cls._resident_signature = signature
+            return cls._resident_data
+
+    @classmethod
+    def _commit_shards(cls, records):
+        """ Write the shards changed by records and bump their versions
+        The caller holds the shards' write lock, not the process lock,
+        so shards changed by different threads are written in parallel.
+        :param records: journal records describing the change
+        :return:
+        """
+        shards = sorted({cls._shard_of(record['list'].get('id') if record['op'] == 'create_list'
+                                       else record['list_id']) for record in records})
+        written = []
+        try:
+            for shard in shards:
+                with cls._lock:
+                    entries = cls._index.part(shard)
+                cls._write_shard(shard, entries)
+                written.append(shard)
+        except Exception:
+            with cls._lock:
+                # back to what is on disk for the shards left unwritten
+                cls._reload_shards([shard for shard in shards if shard not in written])
+            raise
+        finally:
+            if written:
+                with cls._lock, cls._manifest_lock():
+                    manifest, signature = cls._read_manifest()
+                    for shard in written:
+                        manifest['versions'][shard] += 1
+                        cls._shard_versions[shard] = manifest['versions'][shard]
+                    new_signature = cls._write_manifest(manifest)
+                    if signature == cls._resident_signature:
+                        cls._resident_signature = new_signature
+
+    @classmethod
+    def _publish(cls, records):
+        """ Tell the change feed about committed changes
+        :param records: journal records describing the changes
+        :return:
+        """
+        if records:
+            seqs = [record['seq'] for record in records] if cls.PERSISTENCE == 'journal' else None
+            cls.change_feed.publish([change_event(record) for record in records], seqs)
+
+    @staticmethod
+    def _check_id(kind, value):
+        # ids are looked up in dictionaries, arrays and objects cannot be
+        if isinstance(value, (list, dict)):
+            raise TypeError(f'{kind} id must not be an array or object')
+
+    @staticmethod
+    def _list_id(data):
+        return data.get('id') if isinstance(data, dict) else None
+
+    @classmethod
+    def _create(cls, index, data):
+        if not isinstance(data, dict):
+            raise TypeError('Song list must be an object')
+        songs = data.setdefault('songs', [])
+        if not isinstance(songs, list) or not all(isinstance(song, dict) for song in songs):
+            raise TypeError('Songs must be a list of objects')
+        cls._check_id('List', data.get('id'))
+        for song in songs:
+            song.setdefault('id', uuid.uuid4().hex)
+            cls._check_id('Song', song['id'])
+        if cls.PERSISTENCE == 'sharded':
+            shard = cls._shard_of(data.get('id'))
+            last = index.part(shard)
+            index.insert(data, cls._new_list_seq(shard, last[-1][0] if last else None))
         else:
-            return {}
+            index.append(data)
+        cls.search_cache.list_created(data)
+        return {'op': 'create_list', 'list': data}
+
+    @classmethod
+    def _add_song(cls, index, song, list_id):
+        if index.get(list_id) is None:
+            raise ListNotFoundException()
+        if not isinstance(song, dict):
+            raise TypeError('Song must be an object')
+        song.setdefault('id', uuid.uuid4().hex)
+        cls._check_id('Song', song['id'])
+        index.add_song(list_id, song)
+        cls.search_cache.song_added(index.get(list_id), song)
+        return {'op': 'add_song', 'list_id': list_id, 'song': song}
+
+    @classmethod
+    def _remove_song(cls, index, song, list_id):
+        if index.get(list_id) is None:
+            raise ListNotFoundException()
+        removed = index.remove_song(list_id, song)
+        cls.search_cache.song_removed(index.get(list_id), removed)
+        if removed.get('id') is not None:
+            # replaying by id removes exactly the same song
+            song = {'id': removed['id']}
+        return {'op': 'remove_song', 'list_id': list_id, 'song': song}
+
+    @classmethod
+    def _apply_batch(cls, apply, items, list_ids):
+        """ Apply a change per item with a single load and a single persist
+        :param apply: one of _create, _add_song or _remove_song
+        :param items: list of argument tuples for apply
+        :param list_ids: ids of the lists the items change
+        :return: list with None or the raised exception per item
+        """
+        with cls._write_lock(*list_ids):
+            with cls._lock:
+                json_data = cls.get_from_file()
+                if not json_data:
+                    json_data = {'lists': []}
+                index = cls._get_index(json_data)
+                results, records = [], []
+                for args in items:
+                    try:
+                        records.append(apply(index, *args))
+                        results.append(None)
+                    except Exception as e:
+                        results.append(e)
+            if records:
+                cls._commit(json_data, *records)
+                cls._publish(records)
+        return results
 
     @classmethod
     def create_song_list(cls, data):
@@ -43,12 +907,15 @@ class SongList:
         :param data: dictionary
         :return:
         """
-        json_data = cls.get_from_file()
-        if not json_data:
-            # creates the empty structure once
-            json_data = {'lists': []}
-        json_data.get('lists').append(data)
-        cls.save_to_file(json_data)
+        with cls._write_lock(cls._list_id(data)):
+            with cls._lock:
+                json_data = cls.get_from_file()
+                if not json_data:
+                    # creates the empty structure once
+                    json_data = {'lists': []}
+                record = cls._create(cls._get_index(json_data), data)
+            cls._commit(json_data, record)
+            cls._publish([record])
 
     @classmethod
     def add_song_to_list(cls, song, list_id):
@@ -59,13 +926,12 @@ class SongList:
         """
         if not cls.get_list_by_id(list_id):
             raise ListNotFoundException()
-        json_data = cls.get_from_file()
-        for list_data in json_data.get("lists", []):
-            if list_data.get('id') == list_id:
-                list_data['songs'].append(song)
-                break
-
-        cls.save_to_file(json_data)
+        with cls._write_lock(list_id):
+            with cls._lock:
+                json_data = cls.get_from_file()
+                record = cls._add_song(cls._get_index(json_data), song, list_id)
+            cls._commit(json_data, record)
+            cls._publish([record])
 
     @classmethod
     def remove_song_from_list(cls, song, list_id):
@@ -76,14 +942,36 @@ class SongList:
         """
         if not cls.get_list_by_id(list_id):
             raise ListNotFoundException()
-        json_data = cls.get_from_file()
-        for list_data in json_data.get("lists", []):
-            if list_data.get('id') == list_id:
-                index_to_remove = list_data['songs'].index(song)
-                list_data['songs'].pop(index_to_remove)
-                break
+        with cls._write_lock(list_id):
+            with cls._lock:
+                json_data = cls.get_from_file()
+                record = cls._remove_song(cls._get_index(json_data), song, list_id)
+            cls._commit(json_data, record)
+            cls._publish([record])
+
+    @classmethod
+    def create_song_lists(cls, lists):
+        """ Create several lists of songs at once
+        :param lists: list of dictionaries
+        :return: list with None or the raised exception per list
+        """
+        return cls._apply_batch(cls._create, [(data,) for data in lists], [cls._list_id(data) for data in lists])
+
+    @classmethod
+    def add_songs_to_lists(cls, items):
+        """ Add several songs at once
+        :param items: list of (song, list_id) tuples
+        :return: list with None or the raised exception per item
+        """
+        return cls._apply_batch(cls._add_song, items, [list_id for _, list_id in items])
 
-        cls.save_to_file(json_data)
+    @classmethod
+    def remove_songs_from_lists(cls, items):
+        """ Remove several songs at once
+        :param items: list of (song, list_id) tuples
+        :return: list with None or the raised exception per item
+        """
+        return cls._apply_batch(cls._remove_song, items, [list_id for _, list_id in items])
 
     @classmethod
     def get_list_by_id(cls, list_id):
@@ -91,9 +979,36 @@ class SongList:
         :param list_id: string
         :return: dictionary
         """
-        json_data = cls.get_from_file()
-        list_data = [slist for slist in json_data.get("lists", []) if slist['id'] == list_id]
-        return list_data
+        list_data = cls._read_index().get(list_id)
+        return [list_data] if list_data is not None else []
+
+    @classmethod
+    def get_list_version(cls, list_id):
+        """ Opaque version of a list, changing whenever the list does
+        :param list_id: string
+        :return: string or None
+        """
+        return cls._read_index().version(list_id)
+
+    @classmethod
+    def list_versions(cls, lists):
+        """ Versions of lists returned by the backend, see get_list_version
+        :param lists: list of dictionaries
+        :return: list of strings, None for lists no longer stored
+        """
+        # no lock: searches must not wait behind a write being saved, a list
+        # changed or dropped meanwhile just gets no version and is encoded again
+        index = cls._index
+        if index is None:
+            return [None] * len(lists)
+        versions = []
+        for list_data in lists:
+            try:
+                stored = index.get(list_data.get('id')) is list_data
+                versions.append(index.version(list_data.get('id')) if stored else None)
+            except KeyError:
+                versions.append(None)
+        return versions
 
     @classmethod
     def remove_list(cls, list_id):
@@ -101,12 +1016,16 @@ class SongList:
         :param list_id: string
         :return:
         """
-        json_data = cls.get_from_file()
-        for idx, item in enumerate(json_data["lists"]):
-            if item["id"] == list_id:
-                del json_data["lists"][idx]
-                break
-        cls.save_to_file(json_data)
+        with cls._write_lock(list_id):
+            with cls._lock:
+                json_data = cls.get_from_file()
+                removed = cls._get_index(json_data).remove(list_id)
+                if removed is None:
+                    return
+                cls.search_cache.list_removed(removed)
+            record = {'op': 'remove_list', 'list_id': list_id}
+            cls._commit(json_data, record)
+            cls._publish([record])
 
     @classmethod
     def search_songs(cls, title, artist, album):
@@ -116,18 +1035,40 @@ class SongList:
         :param album: string
         :return: list
         """
-        json_data = cls.get_from_file()
-        list_found = []
-        for song_list in json_data.get("lists", []):
-            for song in song_list.get("songs", []):
-                if cls._matched_songs(song, title, artist, album):
-                    list_found.append(song_list)
-                    break
+        return list(cls.iter_search_songs(title, artist, album))
 
-        return list_found
+    @classmethod
+    def iter_search_songs(cls, title, artist, album):
+        """ Yield the lists holding a matching song, one at a time
+        :param title: string
+        :param artist: string
+        :param album: string
+        :return: generator of dictionaries
+        """
+        index = cls._read_index()
+        key = normalize_query(title, artist, album)
+        cached = cls.search_cache.get(key)
+        if cached is not None:
+            yield from cached
+            return
 
-    @staticmethod
-    def _matched_songs(song, title, artist, album):
-        return (not title or title.lower() in song.get('title', '').lower()) and \
-            (not artist or artist.lower() in song.get('artist', '').lower()) and \
-            (not album or album.lower() in song.get('album', '').lower())
+        generation = cls.search_cache.generation()
+        seqs = index.candidate_seqs(title, artist, album)
+        found = matches = None
+        if cls.parallel_search.enabled(len(seqs)):
+            found = cls.parallel_search.search(index, cls._lock, seqs, title, artist, album)
+        if found is not None:
+            found = index.lists(found)
+            yield from found
+        else:
+            found = []
+            # the terms are folded once for the whole search
+            matches = matcher(title, artist, album)
+            for song_list in index.lists(seqs):
+                for song in song_list.get("songs", []):
+                    if matches(song):
+                        found.append(song_list)
+                        yield song_list
+                        break
+        # only a search that ran to the end has the complete result
+        cls.search_cache.put(key, found, generation, matches)
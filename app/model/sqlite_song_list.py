@@ -0,0 +1,383 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import uuid
+from contextlib import contextmanager
+
+from app import metrics
+from app.model.storage import ListNotFoundException, SongStorage
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS lists (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT,
+    version INTEGER NOT NULL DEFAULT 0,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS lists_id ON lists (id, seq);
+
+CREATE TABLE IF NOT EXISTS songs (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    list_seq INTEGER NOT NULL REFERENCES lists (seq),
+    song_id TEXT,
+    song_key TEXT NOT NULL,
+    title TEXT,
+    artist TEXT,
+    album TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS songs_list ON songs (list_seq, seq);
+CREATE INDEX IF NOT EXISTS songs_key ON songs (list_seq, song_key, seq);
+CREATE INDEX IF NOT EXISTS songs_id ON songs (list_seq, song_id);
+"""
+
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS songs_fts USING fts5 (
+    title, artist, album, content='songs', content_rowid='seq', tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS songs_fts_insert AFTER INSERT ON songs BEGIN
+    INSERT INTO songs_fts (rowid, title, artist, album)
+    VALUES (new.seq, new.title, new.artist, new.album);
+END;
+CREATE TRIGGER IF NOT EXISTS songs_fts_delete AFTER DELETE ON songs BEGIN
+    INSERT INTO songs_fts (songs_fts, rowid, title, artist, album)
+    VALUES ('delete', old.seq, old.title, old.artist, old.album);
+END;
+"""
+
+SEARCH_COLUMNS = ('title', 'artist', 'album')
+# FTS5 trigram phrases shorter than this match nothing
+MIN_MATCH_LENGTH = 3
+# keeps IN (...) lists under SQLite's bound parameter limit
+CHUNK_SIZE = 500
+
+
+def _song_key(song):
+    content = {key: value for key, value in song.items() if key != 'id'}
+    canonical = json.dumps(content, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+
+
+def _text(song, field):
+    value = song.get(field)
+    return value if isinstance(value, str) else None
+
+
+def _match_expression(title, artist, album):
+    terms = []
+    for column, term in zip(SEARCH_COLUMNS, (title, artist, album)):
+        if term and len(term) >= MIN_MATCH_LENGTH:
+            terms.append('%s : "%s"' % (column, term.replace('"', '""')))
+    return ' AND '.join(terms)
+
+
+class SqliteSongList(SongStorage):
+    """ Song lists stored in SQLite
+    Lists and songs live in their own tables, indexed by list id and by
+    song id or a hash of each song's content, and a trigram FTS5 table narrows searches down
+    to candidate songs. The database runs in WAL mode so readers do not
+    block the writer.
+    """
+    name = 'sqlite'
+    DB_PATH = 'app/mock/song_lists.db'
+
+    _local = threading.local()
+    _fts = None
+
+    @classmethod
+    def configure(cls, config):
+        cls.DB_PATH = config.get('SONG_DB_PATH', cls.DB_PATH)
+        cls._local = threading.local()
+
+    @classmethod
+    def warm(cls):
+        """ Create the schema ahead of the first request
+        The connection is closed again, as it cannot be shared with
+        processes forked afterwards.
+        :return:
+        """
+        cls._connection().close()
+        cls._local = threading.local()
+
+    @classmethod
+    def usage(cls):
+        """ Size of the stored library, for monitoring
+        :return: dictionary
+        """
+        conn = cls._connection()
+        size = 0
+        for path in (cls.DB_PATH, cls.DB_PATH + '-wal'):
+            try:
+                size += os.stat(path).st_size
+            except OSError:
+                pass
+        return {'lists': conn.execute('SELECT COUNT(*) FROM lists').fetchone()[0],
+                'songs': conn.execute('SELECT COUNT(*) FROM songs').fetchone()[0], 'bytes': size}
+
+    @classmethod
+    def _connection(cls):
+        conn = getattr(cls._local, 'conn', None)
+        if conn is not None and cls._local.path == cls.DB_PATH:
+            return conn
+
+        directory = os.path.dirname(cls.DB_PATH)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(cls.DB_PATH, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.executescript(SCHEMA)
+        try:
+            conn.executescript(FTS_SCHEMA)
+            cls._fts = True
+        except sqlite3.OperationalError:
+            # SQLite built without FTS5, searches fall back to a scan
+            cls._fts = False
+        cls._local.conn = conn
+        cls._local.path = cls.DB_PATH
+        return conn
+
+    @classmethod
+    @contextmanager
+    def _transaction(cls):
+        conn = cls._connection()
+        with metrics.STORAGE_WRITE_SECONDS.time(cls.name):
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+
+    @staticmethod
+    def _list_seq(conn, list_id):
+        row = conn.execute('SELECT seq FROM lists WHERE id = ? ORDER BY seq LIMIT 1', (list_id,)).fetchone()
+        if row is None:
+            raise ListNotFoundException()
+        return row[0]
+
+    @classmethod
+    def _insert_song(cls, conn, list_seq, song):
+        data = json.dumps(song)
+        conn.execute(
+            'INSERT INTO songs (list_seq, song_id, song_key, title, artist, album, data) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (list_seq, song.get('id'), _song_key(song), _text(song, 'title'), _text(song, 'artist'), _text(song, 'album'),
+             data)
+        )
+        metrics.STORAGE_WRITE_BYTES.inc(cls.name, amount=len(data))
+
+    @classmethod
+    def _load_lists(cls, conn, list_seqs):
+        """ Rebuild list dictionaries with their songs, in the given order
+        :param conn: sqlite3.Connection
+        :param list_seqs: list of int
+        :return: list of dictionaries
+        """
+        with metrics.STORAGE_READ_SECONDS.time(cls.name):
+            lists, size = cls._read_lists(conn, list_seqs)
+        metrics.STORAGE_READ_BYTES.inc(cls.name, amount=size)
+        return [lists[seq] for seq in list_seqs if seq in lists]
+
+    @staticmethod
+    def _read_lists(conn, list_seqs):
+        lists = {}
+        size = 0
+        for start in range(0, len(list_seqs), CHUNK_SIZE):
+            chunk = list_seqs[start:start + CHUNK_SIZE]
+            marks = ','.join('?' * len(chunk))
+            for seq, data in conn.execute(f'SELECT seq, data FROM lists WHERE seq IN ({marks})', chunk):
+                size += len(data)
+                list_data = json.loads(data)
+                list_data['songs'] = []
+                lists[seq] = list_data
+            songs = conn.execute(
+                f'SELECT list_seq, data FROM songs WHERE list_seq IN ({marks}) ORDER BY list_seq, seq', chunk
+            )
+            for list_seq, data in songs:
+                size += len(data)
+                lists[list_seq]['songs'].append(json.loads(data))
+        return lists, size
+
+    @classmethod
+    def _create(cls, conn, data):
+        if not isinstance(data, dict):
+            raise TypeError('Song list must be an object')
+        songs = data.get('songs', [])
+        if not isinstance(songs, list) or not all(isinstance(song, dict) for song in songs):
+            raise TypeError('Songs must be a list of objects')
+        list_data = {key: value for key, value in data.items() if key != 'songs'}
+        cursor = conn.execute('INSERT INTO lists (id, data) VALUES (?, ?)', (data.get('id'), json.dumps(list_data)))
+        for song in songs:
+            song.setdefault('id', uuid.uuid4().hex)
+            cls._insert_song(conn, cursor.lastrowid, song)
+
+    @classmethod
+    def _add_song(cls, conn, song, list_id):
+        list_seq = cls._list_seq(conn, list_id)
+        if not isinstance(song, dict):
+            raise TypeError('Song must be an object')
+        song_id = song.setdefault('id', uuid.uuid4().hex)
+        if conn.execute('SELECT 1 FROM songs WHERE list_seq = ? AND song_id = ?', (list_seq, song_id)).fetchone():
+            raise ValueError(f'Song {song_id} is already in list {list_id}')
+        cls._insert_song(conn, list_seq, song)
+        conn.execute('UPDATE lists SET version = version + 1 WHERE seq = ?', (list_seq,))
+
+    @classmethod
+    def _remove_song(cls, conn, song, list_id):
+        list_seq = cls._list_seq(conn, list_id)
+        if song.get('id') is not None:
+            row = conn.execute('SELECT seq FROM songs WHERE list_seq = ? AND song_id = ? ORDER BY seq LIMIT 1',
+                               (list_seq, song['id'])).fetchone()
+        else:
+            row = conn.execute('SELECT seq FROM songs WHERE list_seq = ? AND song_key = ? ORDER BY seq LIMIT 1',
+                               (list_seq, _song_key(song))).fetchone()
+        if row is None:
+            raise ValueError(f'{song!r} is not in list')
+        conn.execute('DELETE FROM songs WHERE seq = ?', row)
+        conn.execute('UPDATE lists SET version = version + 1 WHERE seq = ?', (list_seq,))
+
+    @classmethod
+    def _apply_batch(cls, apply, items):
+        """ Apply a change per item inside one transaction
+        Each item runs in its own savepoint, so a failing item is rolled
+        back without affecting the others.
+        :param apply: one of _create, _add_song or _remove_song
+        :param items: list of argument tuples for apply
+        :return: list with None or the raised exception per item
+        """
+        results = []
+        with cls._transaction() as conn:
+            for args in items:
+                conn.execute('SAVEPOINT item')
+                try:
+                    apply(conn, *args)
+                    results.append(None)
+                except Exception as e:
+                    conn.execute('ROLLBACK TO item')
+                    results.append(e)
+                conn.execute('RELEASE item')
+        return results
+
+    @classmethod
+    def create_song_list(cls, data):
+        """ Create a list of songs
+        :param data: dictionary
+        :return:
+        """
+        with cls._transaction() as conn:
+            cls._create(conn, data)
+
+    @classmethod
+    def add_song_to_list(cls, song, list_id):
+        """ Add a song to a list
+        :param song: dictionary
+        :param list_id: string
+        :return:
+        """
+        with cls._transaction() as conn:
+            cls._add_song(conn, song, list_id)
+
+    @classmethod
+    def remove_song_from_list(cls, song, list_id):
+        """ Remove a song from a list
+        :param song: dictionary
+        :param list_id: string
+        :return:
+        """
+        with cls._transaction() as conn:
+            cls._remove_song(conn, song, list_id)
+
+    @classmethod
+    def create_song_lists(cls, lists):
+        return cls._apply_batch(cls._create, [(data,) for data in lists])
+
+    @classmethod
+    def add_songs_to_lists(cls, items):
+        return cls._apply_batch(cls._add_song, items)
+
+    @classmethod
+    def remove_songs_from_lists(cls, items):
+        return cls._apply_batch(cls._remove_song, items)
+
+    @classmethod
+    def get_list_by_id(cls, list_id):
+        """ Get a list of songs from a list
+        :param list_id: string
+        :return: list
+        """
+        conn = cls._connection()
+        try:
+            return cls._load_lists(conn, [cls._list_seq(conn, list_id)])
+        except ListNotFoundException:
+            return []
+
+    @classmethod
+    def get_list_version(cls, list_id):
+        """ Opaque version of a list, changing whenever the list does
+        :param list_id: string
+        :return: string or None
+        """
+        row = cls._connection().execute(
+            'SELECT seq, version FROM lists WHERE id = ? ORDER BY seq LIMIT 1', (list_id,)
+        ).fetchone()
+        return f'{row[0]}-{row[1]}' if row else None
+
+    @classmethod
+    def remove_list(cls, list_id):
+        """ Remove a list
+        :param list_id: string
+        :return:
+        """
+        with cls._transaction() as conn:
+            try:
+                list_seq = cls._list_seq(conn, list_id)
+            except ListNotFoundException:
+                return
+            conn.execute('DELETE FROM songs WHERE list_seq = ?', (list_seq,))
+            conn.execute('DELETE FROM lists WHERE seq = ?', (list_seq,))
+
+    @classmethod
+    def search_songs(cls, title, artist, album):
+        """ Search for a list of songs
+        :param title: string
+        :param artist: string
+        :param album: string
+        :return: list
+        """
+        return list(cls.iter_search_songs(title, artist, album))
+
+    @classmethod
+    def iter_search_songs(cls, title, artist, album):
+        """ Yield the lists holding a matching song, one at a time
+        Matching lists are loaded in chunks as the caller consumes them.
+        :param title: string
+        :param artist: string
+        :param album: string
+        :return: generator of dictionaries
+        """
+        conn = cls._connection()
+        expression = _match_expression(title, artist, album) if cls._fts else ''
+        if expression:
+            songs = conn.execute(
+                'SELECT songs.list_seq, songs.data FROM songs_fts JOIN songs ON songs.seq = songs_fts.rowid '
+                'WHERE songs_fts MATCH ? ORDER BY songs.list_seq', (expression,)
+            )
+        else:
+            songs = conn.execute('SELECT list_seq, data FROM songs ORDER BY list_seq')
+
+        found = []
+        last_seq = None
+        for list_seq, data in songs:
+            if list_seq == last_seq:
+                continue
+            if cls._matched_songs(json.loads(data), title, artist, album):
+                last_seq = list_seq
+                found.append(list_seq)
+                if len(found) == CHUNK_SIZE:
+                    yield from cls._load_lists(conn, found)
+                    found = []
+        yield from cls._load_lists(conn, found)
@@ -0,0 +1,161 @@
+from importlib import import_module
+
+from app.model.song import Song, fold
+
+
+class ListNotFoundException(Exception):
+    pass
+
+
+class SongStorage:
+    """ Operations every song list backend provides
+    Backends are used as classes, the same way SongList always has been,
+    and are picked by name with get_storage.
+    """
+    # key of the backend in STORAGES
+    name = None
+    # SearchCache of backends that cache search results in the process
+    search_cache = None
+    # ChangeFeed of backends that publish the changes made in the process
+    change_feed = None
+
+    @classmethod
+    def configure(cls, config):
+        """ Apply backend settings from a mapping such as app.config
+        :param config: dictionary
+        :return:
+        """
+
+    @classmethod
+    def warm(cls):
+        """ Load whatever the backend keeps in memory ahead of the first request
+        :return:
+        """
+
+    @classmethod
+    def flush(cls):
+        """ Write out whatever the backend has not yet, before shutting down
+        :return:
+        """
+
+    @classmethod
+    def usage(cls):
+        """ Size of the stored library, for monitoring
+        :return: dictionary with any of 'lists', 'songs' and 'bytes'
+        """
+        return {}
+
+    @classmethod
+    def create_song_list(cls, data):
+        raise NotImplementedError
+
+    @classmethod
+    def add_song_to_list(cls, song, list_id):
+        raise NotImplementedError
+
+    @classmethod
+    def remove_song_from_list(cls, song, list_id):
+        raise NotImplementedError
+
+    @classmethod
+    def get_list_by_id(cls, list_id):
+        raise NotImplementedError
+
+    @classmethod
+    def get_list_version(cls, list_id):
+        """ Opaque version of a list, changing whenever the list does
+        :param list_id: string
+        :return: string or None when the list does not exist
+        """
+        raise NotImplementedError
+
+    @classmethod
+    def list_versions(cls, lists):
+        """ Versions of lists returned by the backend, see get_list_version
+        Backends that cannot tell cheaply return None for every list.
+        :param lists: list of dictionaries
+        :return: list of strings or None
+        """
+        return [None] * len(lists)
+
+    @staticmethod
+    def _each(operation, items):
+        results = []
+        for args in items:
+            try:
+                operation(*args)
+                results.append(None)
+            except Exception as e:
+                results.append(e)
+        return results
+
+    @classmethod
+    def create_song_lists(cls, lists):
+        """ Create several lists of songs at once
+        Backends override the batch operations to persist only once.
+        :param lists: list of dictionaries
+        :return: list with None or the raised exception per list
+        """
+        return cls._each(cls.create_song_list, [(data,) for data in lists])
+
+    @classmethod
+    def add_songs_to_lists(cls, items):
+        """ Add several songs at once
+        :param items: list of (song, list_id) tuples
+        :return: list with None or the raised exception per item
+        """
+        return cls._each(cls.add_song_to_list, items)
+
+    @classmethod
+    def remove_songs_from_lists(cls, items):
+        """ Remove several songs at once
+        :param items: list of (song, list_id) tuples
+        :return: list with None or the raised exception per item
+        """
+        return cls._each(cls.remove_song_from_list, items)
+
+    @classmethod
+    def remove_list(cls, list_id):
+        raise NotImplementedError
+
+    @classmethod
+    def search_songs(cls, title, artist, album):
+        raise NotImplementedError
+
+    @classmethod
+    def iter_search_songs(cls, title, artist, album):
+        """ Yield the lists holding a matching song, one at a time
+        :param title: string
+        :param artist: string
+        :param album: string
+        :return: generator of dictionaries
+        """
+        yield from cls.search_songs(title, artist, album)
+
+    @staticmethod
+    def _matched_songs(song, title, artist, album):
+        if type(song) is Song:
+            return (not title or fold(title) in song.title_key) and \
+                (not artist or fold(artist) in song.artist_key) and \
+                (not album or fold(album) in song.album_key)
+        return (not title or fold(title) in fold(song.get('title'))) and \
+            (not artist or fold(artist) in fold(song.get('artist'))) and \
+            (not album or fold(album) in fold(song.get('album')))
+
+
+STORAGES = {
+    'json': 'app.model.song_list.SongList',
+    'sqlite': 'app.model.sqlite_song_list.SqliteSongList',
+}
+
+
+def get_storage(name):
+    """ Get the backend class registered under name
+    :param name: string
+    :return: SongStorage subclass
+    """
+    try:
+        module_name, class_name = STORAGES[name].rsplit('.', 1)
+    except KeyError:
+        raise ValueError(f'Unknown song storage {name!r}')
+    return getattr(import_module(module_name), class_name)
@@ -0,0 +1,35 @@
+import time
+
+from flask import Blueprint, Response, current_app, g, request
+
+from app import metrics
+
+metrics_api = Blueprint('metrics_api', __name__)
+
+
+@metrics_api.before_app_request
+def start_timer():
+    if metrics.REGISTRY.enabled:
+        g.request_start = time.perf_counter()
+
+
+@metrics_api.after_app_request
+def record_request(response):
+    start = g.pop('request_start', None)
+    if start is not None:
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - start, request.method, request.endpoint or 'none',
+                                        str(response.status_code))
+    return response
+
+
+@metrics_api.route('/metrics', methods=['GET'])
+def get_metrics():
+    if not metrics.REGISTRY.enabled:
+        return {'message': 'Metrics are disabled'}, 404
+    storage = current_app.extensions['song_storage']
+    usage = storage.usage()
+    for gauge, key in ((metrics.STORAGE_SIZE, 'bytes'), (metrics.STORAGE_LISTS, 'lists'),
+                       (metrics.STORAGE_SONGS, 'songs')):
+        if key in usage:
+            gauge.set(usage[key], storage.name)
+    return Response(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
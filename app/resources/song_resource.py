@@ -1,16 +1,30 @@
+import hashlib
 from functools import wraps
-from flask import Blueprint, request, jsonify
-from app.model.song_list import SongList, ListNotFoundException
+from itertools import islice
+from flask import Blueprint, Response, g, request, jsonify, current_app, stream_with_context
+from werkzeug.http import quote_etag
+from app import metrics
+from app.model.storage import ListNotFoundException
 from flask_restful import marshal_with
 
 song_api = Blueprint('song_api', __name__)
 
 
+def song_storage():
+    return current_app.extensions['song_storage']
+
+
 def authenticate(func):
     @wraps(func)
     def validate_token(*args, **kwargs):
-        auth_header = request.headers.get('Authorization')
-        if not auth_header or not auth_header.startswith('Bearer '):
+        with metrics.AUTH_SECONDS.time():
+            auth_header = request.headers.get('Authorization')
+            authorized = auth_header and auth_header.startswith('Bearer ')
+            verifier = current_app.extensions.get('token_verifier')
+            if authorized and verifier is not None:
+                g.token_claims = verifier.verify(auth_header[len('Bearer '):])
+                authorized = g.token_claims is not None
+        if not authorized:
             return jsonify({'error': 'Request is unauthorized'}), 401
         return func(*args, **kwargs)
 
@@ -22,7 +36,7 @@ def authenticate(func):
 def create_song_list():
     list_data = request.get_json()
     try:
-        SongList.create_song_list(list_data)
+        song_storage().create_song_list(list_data)
         return {'message': 'Song List created Successfully!'}, 201
     except Exception as e:
         return {'message': str(e)}, 400
@@ -33,7 +47,7 @@ def create_song_list():
 def add_song_to_list(list_id: str):
     song_data = request.get_json()
     try:
-        SongList.add_song_to_list(song_data, list_id)
+        song_storage().add_song_to_list(song_data, list_id)
         return {'message': f'Song Added to list {list_id} Successfully!'}, 201
     except ListNotFoundException:
         return {'message': f'List {list_id} not found'}, 404
@@ -46,7 +60,7 @@ def add_song_to_list(list_id: str):
 def remove_song_from_list(list_id: str):
     song_data = request.get_json()
     try:
-        SongList.remove_song_from_list(song_data, list_id)
+        song_storage().remove_song_from_list(song_data, list_id)
         return {'message': f'Song removed from list {list_id} Successfully!'}, 410
     except ListNotFoundException:
         return {'message': f'List {list_id} not found'}, 404
@@ -54,27 +68,218 @@ def remove_song_from_list(list_id: str):
         return {'message': str(e)}, 400
 
 
+@song_api.route('/list/<string:list_id>/song/<string:song_id>', methods=['DELETE'])
+@authenticate
+def remove_song_by_id(list_id: str, song_id: str):
+    try:
+        song_storage().remove_song_from_list({'id': song_id}, list_id)
+        return {'message': f'Song removed from list {list_id} Successfully!'}, 410
+    except ListNotFoundException:
+        return {'message': f'List {list_id} not found'}, 404
+    except Exception as e:
+        return {'message': str(e)}, 400
+
+
+def _batch_result(error, success_status, success_message, list_id=None):
+    if error is None:
+        return {'status': success_status, 'message': success_message}
+    if isinstance(error, ListNotFoundException):
+        return {'status': 404, 'message': f'List {list_id} not found'}
+    return {'status': 400, 'message': str(error)}
+
+
+def _song_items():
+    items = request.get_json()
+    if not isinstance(items, list):
+        raise TypeError('Expected a list of {"list_id", "song"} objects')
+    return [(item.get('song'), item.get('list_id')) if isinstance(item, dict) else (None, None)
+            for item in items]
+
+
+@song_api.route('/list/batch', methods=['POST'])
+@authenticate
+def create_song_lists():
+    lists = request.get_json()
+    if not isinstance(lists, list):
+        return {'message': 'Expected a list of song lists'}, 400
+    try:
+        results = song_storage().create_song_lists(lists)
+        return [_batch_result(error, 201, 'Song List created Successfully!') for error in results], 207
+    except Exception as e:
+        return {'message': str(e)}, 400
+
+
+@song_api.route('/list/songs/add', methods=['PUT'])
+@authenticate
+def add_songs_to_lists():
+    try:
+        items = _song_items()
+        results = song_storage().add_songs_to_lists(items)
+        return [_batch_result(error, 201, f'Song Added to list {list_id} Successfully!', list_id)
+                for error, (_, list_id) in zip(results, items)], 207
+    except Exception as e:
+        return {'message': str(e)}, 400
+
+
+@song_api.route('/list/songs/remove', methods=['PUT'])
+@authenticate
+def remove_songs_from_lists():
+    try:
+        items = _song_items()
+        results = song_storage().remove_songs_from_lists(items)
+        return [_batch_result(error, 410, f'Song removed from list {list_id} Successfully!', list_id)
+                for error, (_, list_id) in zip(results, items)], 207
+    except Exception as e:
+        return {'message': str(e)}, 400
+
+
+def _list_view():
+    """ Function shaping the lists a request returns, from its query string
+    fields keeps only the listed fields of each list, songs_offset and
+    songs_limit return a page of its songs along with their 'songs_total'.
+    :return: callable taking and returning a list dictionary, None for whole lists
+    """
+    fields = request.args.get('fields')
+    songs_offset = request.args.get('songs_offset', type=int)
+    songs_limit = request.args.get('songs_limit', type=int)
+    if (songs_offset is not None and songs_offset < 0) or (songs_limit is not None and songs_limit < 0):
+        raise ValueError('songs_offset and songs_limit must not be negative')
+    if fields is None and songs_offset is None and songs_limit is None:
+        return None
+    fields = [field for field in fields.split(',') if field] if fields is not None else None
+    paged = songs_offset is not None or songs_limit is not None
+    start = songs_offset or 0
+    stop = None if songs_limit is None else start + songs_limit
+
+    def view(list_data):
+        if fields is None:
+            shaped = dict(list_data)
+        else:
+            shaped = {field: list_data[field] for field in fields if field in list_data}
+        if paged and 'songs' in shaped:
+            songs = shaped['songs']
+            shaped['songs'] = songs[start:stop]
+            shaped['songs_total'] = len(songs)
+        return shaped
+
+    return view
+
+
+def _encoded_lists(song_lists):
+    """ Lists encoded as JSON, reusing their encoding while they do not change
+    :param song_lists: list of dictionaries
+    :return: list of bytes
+    """
+    versions = song_storage().list_versions(song_lists)
+    return [current_app.json.encode_list(song_list, version) for song_list, version in zip(song_lists, versions)]
+
+
+def _content_etag(payload):
+    # derived from the response alone, the same in every worker and across restarts
+    return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+
+def _json_response(payload, status=200, headers=None):
+    return Response(payload + b'\n', status, headers, mimetype=current_app.json.mimetype)
+
+
 @song_api.route('/list/search', methods=['GET'])
 @authenticate
 def find_list_with_song():
     title = request.args.get('song_title')
     artist = request.args.get('artist')
     album = request.args.get('album')
+    offset = request.args.get('offset', 0, type=int)
+    limit = request.args.get('limit', type=int)
+    stream = request.args.get('stream') in ('1', 'true') or \
+        request.accept_mimetypes.best == 'application/x-ndjson'
+    if offset < 0 or (limit is not None and limit < 0):
+        return {'message': 'offset and limit must not be negative'}, 400
 
     try:
-        song_lists = SongList.search_songs(title, artist, album)
+        view = _list_view()
+        if stream:
+            song_lists = islice(song_storage().iter_search_songs(title, artist, album),
+                                offset, None if limit is None else offset + limit)
+            if view is not None:
+                lines = (current_app.json.dumps(song_list) + '\n' for song_list in map(view, song_lists))
+            else:
+                lines = (_encoded_lists([song_list])[0] + b'\n' for song_list in song_lists)
+            return Response(stream_with_context(lines), mimetype='application/x-ndjson')
+
+        headers = {}
+        if limit is None and not offset:
+            song_lists = song_storage().search_songs(title, artist, album)
+        else:
+            # one extra list tells whether there is a next page
+            stop = None if limit is None else offset + limit + 1
+            song_lists = list(islice(song_storage().iter_search_songs(title, artist, album), offset, stop))
+            if limit is not None and len(song_lists) > limit:
+                song_lists.pop()
+                headers['X-Next-Offset'] = str(offset + limit)
         if song_lists:
-            return song_lists, 200
+            if view is not None:
+                return [view(song_list) for song_list in song_lists], 200, headers
+            return _json_response(b'[' + b','.join(_encoded_lists(song_lists)) + b']', 200, headers)
         return {'message': 'No list found'}, 404
     except Exception as e:
         return {'message': str(e)}, 400
 
 
+@song_api.route('/list/search/stats', methods=['GET'])
+@authenticate
+def search_cache_stats():
+    search_cache = song_storage().search_cache
+    return search_cache.stats() if search_cache is not None else {}, 200
+
+
+@song_api.route('/changes', methods=['GET'])
+@authenticate
+def get_changes():
+    change_feed = song_storage().change_feed
+    if change_feed is None or not change_feed.size:
+        return {'message': 'Change feed is disabled'}, 404
+    since = request.args.get('since', type=int)
+    limit = request.args.get('limit', 1000, type=int)
+    timeout = request.args.get('timeout', 0, type=float)
+    if limit <= 0 or timeout < 0:
+        return {'message': 'limit must be positive and timeout must not be negative'}, 400
+
+    try:
+        # publishes the changes other processes journaled since the last read
+        song_storage().warm()
+        return change_feed.changes(since, limit, min(timeout, current_app.config['SONG_CHANGE_FEED_MAX_WAIT']),
+                                   request.args.get('token')), 200
+    except Exception as e:
+        return {'message': str(e)}, 400
+
+
+@song_api.route('/list/<string:list_id>', methods=['GET'])
+@authenticate
+def get_song_list(list_id: str):
+    try:
+        view = _list_view()
+        version = song_storage().get_list_version(list_id)
+        song_lists = song_storage().get_list_by_id(list_id) if version is not None else []
+        if not song_lists:
+            return {'message': f'List {list_id} not found'}, 404
+        if view is not None:
+            payload = current_app.json.encode_list(view(song_lists[0]), None)
+        else:
+            payload = current_app.json.encode_list(song_lists[0], version)
+        etag = _content_etag(payload)
+        if request.if_none_match.contains_weak(etag):
+            return '', 304, {'ETag': quote_etag(etag)}
+        return _json_response(payload, 200, {'ETag': quote_etag(etag)})
+    except Exception as e:
+        return {'message': str(e)}, 400
+
+
 @song_api.route('/list/<string:list_id>', methods=['DELETE'])
 @authenticate
 def remove_list(list_id: str):
     try:
-        SongList.remove_list(list_id)
+        song_storage().remove_list(list_id)
         return {'message': 'Song List removed Successfully!'}, 410
     except ListNotFoundException:
         return {'message': f'List {list_id} not found'}, 404
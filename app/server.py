@@ -0,0 +1,99 @@
+import gc
+import os
+import signal
+import socket
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import BaseWSGIServer
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """ Werkzeug server handing connections to a fixed pool of threads """
+    multithread = True
+
+    def __init__(self, host, port, app, threads, fd=None):
+        super().__init__(host, port, app, fd=fd)
+        self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='wsgi')
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self._process_request, request, client_address)
+
+    def _process_request(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        if hasattr(self, 'pool'):
+            self.pool.shutdown(wait=True)
+
+
+def _exit(signum, frame):
+    sys.exit(0)
+
+
+def _run_worker(app, sock, threads):
+    signal.signal(signal.SIGTERM, _exit)
+    signal.signal(signal.SIGINT, _exit)
+    host, port = sock.getsockname()[:2]
+    server = PooledWSGIServer(host, port, app, threads, fd=sock.fileno())
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+def serve(app, host='127.0.0.1', port=5000, workers=None, threads=8):
+    """ Serve the app from preforked worker processes
+    The song library is loaded and indexed once in the parent, before
+    forking, so every worker starts warm and shares those pages
+    copy-on-write. Workers that die are replaced until the parent gets
+    SIGTERM or SIGINT, which it forwards to them.
+    :param app: Flask app
+    :param host: string
+    :param port: int
+    :param workers: number of processes, one per CPU by default
+    :param threads: threads per process
+    :return:
+    """
+    app.extensions['song_storage'].warm()
+    # keeps the garbage collector from touching, and so copying, the preloaded objects
+    gc.freeze()
+
+    sock = socket.create_server((host, port), backlog=2048)
+    sock.set_inheritable(True)
+    children = set()
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            _run_worker(app, sock, threads)
+            sys.exit(0)
+        children.add(pid)
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+
+    for _ in range(workers or os.cpu_count() or 1):
+        spawn()
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while children:
+        try:
+            pid, _ = os.wait()
+        except ChildProcessError:
+            break
+        children.discard(pid)
+        if not stopping:
+            spawn()
+    sock.close()
@@ -0,0 +1,4 @@
+from app import app
+from app.asgi import AsgiApp
+
+application = AsgiApp(app, max_workers=app.config['ASGI_THREADS'])
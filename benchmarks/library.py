@@ -0,0 +1,51 @@
+import random
+
+WORDS = (
+    'love night heart fire rain blue dream road river light shadow gold summer city wild '
+    'moon star train ghost paper stone silver morning ocean dance sweet broken electric '
+    'highway wonder velvet thunder echo mirror garden winter honey neon radio lonely '
+    'glass midnight sugar storm angel desert island crystal forever'
+).split()
+
+
+def _name(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).title()
+
+
+def _id(rng):
+    return '%032x' % rng.getrandbits(128)
+
+
+def generate_library(lists, songs_per_list, seed=0):
+    """ Build a synthetic song library
+    The same arguments always give the same library. Artists and albums
+    are drawn from pools that grow with the library, so searches by
+    artist or album match a realistic share of the lists.
+    :param lists: number of lists
+    :param songs_per_list: number of songs in each list
+    :param seed: int
+    :return: dictionary in the song lists file format
+    """
+    rng = random.Random(seed)
+    artists = [_name(rng, 2) for _ in range(max(10, lists * songs_per_list // 200))]
+    albums = [(artist, _name(rng, 3)) for artist in artists for _ in range(3)]
+    return {
+        'lists': [
+            {
+                'id': _id(rng),
+                'name': _name(rng, 2),
+                'songs': [generate_song(rng, albums) for _ in range(songs_per_list)],
+            }
+            for _ in range(lists)
+        ]
+    }
+
+
+def generate_song(rng, albums):
+    """ Build one synthetic song
+    :param rng: random.Random
+    :param albums: list of (artist, album) tuples
+    :return: dictionary
+    """
+    artist, album = rng.choice(albums)
+    return {'id': _id(rng), 'title': _name(rng, rng.randint(1, 3)), 'artist': artist, 'album': album}
@@ -0,0 +1,261 @@
+""" Measure song storage operations and API endpoints at several library sizes
+
+    $ python -m benchmarks.run --sizes small,medium --output results.json
+    $ python -m benchmarks.run --baseline results.json
+
+Results are written as JSON, one record per size, backend and operation,
+and compared against a baseline run when one is given.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from app import app
+from app.model.storage import STORAGES, get_storage
+from benchmarks.library import generate_library
+
+# name: (lists, songs per list)
+SIZES = {
+    'small': (100, 10),
+    'medium': (1000, 100),
+    'large': (10000, 100),
+}
+HEADERS = {'Authorization': 'Bearer benchmark'}
+MISSING = 'zzqxj'
+
+
+def parse_size(value):
+    """ Size preset name or '<lists>x<songs per list>'
+    :param value: string
+    :return: tuple of name, lists and songs per list
+    """
+    if value in SIZES:
+        return (value,) + SIZES[value]
+    try:
+        lists, songs = (int(part) for part in value.lower().split('x'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'Unknown size {value!r}, use one of {", ".join(SIZES)} or <lists>x<songs>')
+    return value, lists, songs
+
+
+def summarize(samples):
+    """ Latency statistics in milliseconds
+    :param samples: list of durations in seconds
+    :return: dictionary
+    """
+    ms = sorted(sample * 1000 for sample in samples)
+    if len(ms) > 1:
+        cuts = statistics.quantiles(ms, n=100, method='inclusive')
+        p50, p95, p99 = cuts[49], cuts[94], cuts[98]
+    else:
+        p50 = p95 = p99 = ms[0]
+    total = sum(samples)
+    return {
+        'samples': len(ms),
+        'mean_ms': round(statistics.fmean(ms), 4),
+        'p50_ms': round(p50, 4),
+        'p95_ms': round(p95, 4),
+        'p99_ms': round(p99, 4),
+        'max_ms': round(ms[-1], 4),
+        'ops_per_sec': round(len(samples) / total, 2) if total else None,
+    }
+
+
+def measure(operation, repeat, before=None):
+    """ Time operation(i) for i in range(repeat)
+    :param operation: callable taking the iteration number
+    :param repeat: int
+    :param before: untimed callable run ahead of each iteration
+    :return: list of durations in seconds
+    """
+    samples = []
+    for i in range(repeat):
+        if before is not None:
+            before(i)
+        start = time.perf_counter()
+        operation(i)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def _check(response, expected=200):
+    if response.status_code != expected:
+        raise RuntimeError(f'{response.request.method} {response.request.path} answered {response.status_code}')
+
+
+def _check_search(response, song_count):
+    # a filter the endpoint ignores would match the whole library and skew the baseline
+    _check(response)
+    if sum(len(song_list.get('songs', [])) for song_list in response.json) >= song_count:
+        raise RuntimeError(f'GET {response.request.path} returned the whole library, is the query parameter right?')
+
+
+def _operations(storage, config, library, repeat):
+    """ Benchmarked operations as (name, operation, before) tuples, in run order """
+    lists = library['lists']
+    list_ids = [lists[i * 7919 % len(lists)]['id'] for i in range(repeat)]
+    titles = [lists[i * 104729 % len(lists)]['songs'][0]['title'].split()[0] for i in range(repeat)]
+    artists = [lists[i * 1299709 % len(lists)]['songs'][-1]['artist'] for i in range(repeat)]
+    added = [{'id': f'bench-{i}', 'title': f'Benchmark {i}', 'artist': 'Benchmark', 'album': 'Benchmark'}
+             for i in range(repeat)]
+    api_added = [dict(song, id=f'bench-api-{i}') for i, song in enumerate(added)]
+    song_count = sum(len(song_list['songs']) for song_list in lists)
+    client = app.test_client()
+
+    def reset(i):
+        storage.configure(config)
+
+    def clear_cache(i):
+        if storage.search_cache is not None:
+            storage.search_cache.clear()
+
+    operations = [
+        ('warm', lambda i: storage.warm(), reset),
+        ('get_list_by_id', lambda i: storage.get_list_by_id(list_ids[i]), None),
+        ('search_songs_title', lambda i: storage.search_songs(titles[i], None, None), clear_cache),
+        ('search_songs_artist', lambda i: storage.search_songs(None, artists[i], None), clear_cache),
+        ('search_songs_missing', lambda i: storage.search_songs(MISSING, None, None), clear_cache),
+        ('search_songs_cached', lambda i: storage.search_songs(titles[0], None, None), None),
+        ('add_song_to_list', lambda i: storage.add_song_to_list(added[i], list_ids[i]), None),
+        ('remove_song_from_list', lambda i: storage.remove_song_from_list({'id': added[i]['id']}, list_ids[i]), None),
+        ('api_get_list', lambda i: _check(client.get(f'/list/{list_ids[i]}', headers=HEADERS)), None),
+        ('api_search', lambda i: _check_search(client.get('/list/search', query_string={'song_title': titles[i]},
+                                                          headers=HEADERS), song_count), clear_cache),
+        ('api_add_song', lambda i: _check(client.put(f'/list/{list_ids[i]}/song/add', json=api_added[i],
+                                                     headers=HEADERS), 201), None),
+        ('api_remove_song', lambda i: _check(client.delete(f'/list/{list_ids[i]}/song/{api_added[i]["id"]}',
+                                                           headers=HEADERS), 410), None),
+    ]
+    if hasattr(storage, 'save_to_file'):
+        operations.append(('save_to_file', lambda i: storage.save_to_file(storage.get_from_file()), None))
+    return operations
+
+
+def run_size(size, backend, persistence, repeat, seed=0, log=None):
+    """ Benchmark one backend on a generated library
+    :param size: tuple from parse_size
+    :param backend: name in STORAGES
+    :param persistence: SONG_PERSISTENCE of the json backend
+    :param repeat: iterations per operation
+    :param seed: int
+    :param log: callable receiving each result as it is measured
+    :return: list of dictionaries
+    """
+    name, list_count, songs_per_list = size
+    library = generate_library(list_count, songs_per_list, seed)
+    storage = get_storage(backend)
+    previous = app.extensions['song_storage']
+    results = []
+
+    with tempfile.TemporaryDirectory() as directory:
+        config = {
+            'SONG_PATH_FILE': os.path.join(directory, 'song_lists.json'),
+            'SONG_DB_PATH': os.path.join(directory, 'song_lists.db'),
+            'SONG_PERSISTENCE': persistence,
+        }
+        storage.configure(config)
+        app.extensions['song_storage'] = storage
+        try:
+            populate = [('create_song_lists', lambda i: storage.create_song_lists(library['lists']), None)]
+            for operation, run, before in populate + _operations(storage, config, library, repeat):
+                samples = measure(run, 1 if operation == 'create_song_lists' else repeat, before)
+                result = {
+                    'size': name,
+                    'lists': list_count,
+                    'songs': list_count * songs_per_list,
+                    'storage': backend,
+                    'persistence': persistence if backend == 'json' else None,
+                    'operation': operation,
+                }
+                result.update(summarize(samples))
+                results.append(result)
+                if log is not None:
+                    log(result)
+        finally:
+            app.extensions['song_storage'] = previous
+            storage.configure(app.config)
+            previous.configure(app.config)
+    return results
+
+
+def _key(result):
+    return result['size'], result['storage'], result['persistence'], result['operation']
+
+
+def compare(results, baseline, tolerance):
+    """ Operations whose median latency grew past the tolerance
+    :param results: list of dictionaries from run_size
+    :param baseline: list of dictionaries from an earlier run
+    :param tolerance: allowed relative slowdown, 0.25 for 25%
+    :return: list of (result, baseline result) tuples
+    """
+    previous = {_key(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        before = previous.get(_key(result))
+        if before and before['p50_ms'] and result['p50_ms'] > before['p50_ms'] * (1 + tolerance):
+            regressions.append((result, before))
+    return regressions
+
+
+def _print_result(result):
+    print('{size:>8} {storage:>6} {operation:<24} p50 {p50_ms:>10.3f} ms  p95 {p95_ms:>10.3f} ms  '
+          '{ops_per_sec:>10} ops/s'.format(**result), file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', 1)[0])
+    parser.add_argument('--sizes', default='small,medium',
+                        help=f'comma separated presets ({", ".join(SIZES)}) or <lists>x<songs per list>')
+    parser.add_argument('--storage', default='json', help=f'comma separated backends ({", ".join(STORAGES)})')
+    parser.add_argument('--persistence', default='snapshot', choices=('snapshot', 'journal', 'sharded'))
+    parser.add_argument('--repeat', type=int, default=50, help='iterations per operation')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the results to this JSON file instead of stdout')
+    parser.add_argument('--baseline', help='JSON file of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='relative p50 slowdown reported as a regression')
+    args = parser.parse_args(argv)
+
+    try:
+        sizes = [parse_size(value) for value in args.sizes.split(',')]
+    except argparse.ArgumentTypeError as e:
+        parser.error(str(e))
+    results = []
+    for size in sizes:
+        for backend in args.storage.split(','):
+            results.extend(run_size(size, backend, args.persistence, args.repeat, args.seed, _print_result))
+
+    report = {
+        'created': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'repeat': args.repeat,
+        'seed': args.seed,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f)['results'], args.tolerance)
+        for result, before in regressions:
+            print('regression: {size} {storage} {operation} p50 {before:.3f} ms -> {after:.3f} ms'.format(
+                before=before['p50_ms'], after=result['p50_ms'], **result), file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
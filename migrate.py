@@ -0,0 +1,16 @@
+import argparse
+import sys
+
+from app import app
+from app.model.file_format import FORMATS
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rewrite the song lists file in another format')
+    parser.add_argument('format', choices=FORMATS)
+    args = parser.parse_args()
+
+    storage = app.extensions['song_storage']
+    if not hasattr(storage, 'convert'):
+        sys.exit(f'The {storage.name} storage has no file to convert')
+    previous = storage.convert(args.format)
+    print(f'{storage.SONG_PATH_FILE}: {previous} -> {args.format}, set SONG_FILE_FORMAT={args.format} to keep it')
@@ -0,0 +1,6 @@
+from app import app
+from app.server import serve
+
+if __name__ == '__main__':
+    serve(app, host=app.config['SERVER_HOST'], port=app.config['SERVER_PORT'],
+          workers=app.config['SERVER_WORKERS'], threads=app.config['SERVER_THREADS'])
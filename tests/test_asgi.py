@@ -0,0 +1,80 @@
+import asyncio
+import json
+
+import pytest
+
+from app import app
+from app.asgi import AsgiApp, build_environ
+
+
+def _call(asgi_app, method, path, query_string=b'', headers=(), body=b''):
+    scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query_string,
+             'headers': list(headers), 'http_version': '1.1', 'scheme': 'http',
+             'server': ('testserver', 80), 'client': ('127.0.0.1', 5000)}
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(asgi_app(scope, receive, send))
+    return sent
+
+
+@pytest.fixture
+def asgi_app():
+    asgi_app = AsgiApp(app, max_workers=2)
+    yield asgi_app
+    asgi_app.executor.shutdown()
+
+
+def test_build_environ():
+    scope = {'method': 'PUT', 'path': '/list/ñ', 'query_string': b'a=1', 'server': ('host', 8000),
+             'headers': [(b'content-type', b'application/json'), (b'authorization', b'Bearer 1')]}
+    environ = build_environ(scope, b'{}')
+
+    assert environ['PATH_INFO'] == '/list/ñ'.encode('utf-8').decode('latin-1')
+    assert environ['QUERY_STRING'] == 'a=1'
+    assert environ['CONTENT_TYPE'] == 'application/json'
+    assert environ['CONTENT_LENGTH'] == '2'
+    assert environ['HTTP_AUTHORIZATION'] == 'Bearer 1'
+    assert environ['wsgi.input'].read() == b'{}'
+
+
+def test_request_runs_in_thread_pool(asgi_app, mocker):
+    mock_search_songs = mocker.patch('app.model.song_list.SongList.search_songs')
+    mock_search_songs.return_value = [{'id': '123'}]
+
+    sent = _call(asgi_app, 'GET', '/list/search', b'artist=a', [(b'authorization', b'Bearer 123')])
+    assert sent[0]['type'] == 'http.response.start'
+    assert sent[0]['status'] == 200
+    assert json.loads(b''.join(message.get('body', b'') for message in sent[1:])) == [{'id': '123'}]
+    assert sent[-1]['more_body'] is False
+
+
+def test_request_body_is_forwarded(asgi_app, mocker):
+    mock_create_song_list = mocker.patch('app.model.song_list.SongList.create_song_list')
+    list_data = {'id': '1', 'name': 'lista', 'songs': []}
+
+    sent = _call(asgi_app, 'POST', '/list', headers=[(b'authorization', b'Bearer 123'),
+                                                    (b'content-type', b'application/json')],
+                 body=json.dumps(list_data).encode())
+    assert sent[0]['status'] == 201
+    mock_create_song_list.assert_called_once_with(list_data)
+
+
+def test_unauthorized(asgi_app):
+    sent = _call(asgi_app, 'GET', '/list/search')
+    assert sent[0]['status'] == 401
+
+
+def test_streamed_response_is_sent_in_chunks(asgi_app, mocker):
+    mock_iter_search_songs = mocker.patch('app.model.song_list.SongList.iter_search_songs')
+    mock_iter_search_songs.return_value = iter([{'id': '1'}, {'id': '2'}])
+
+    sent = _call(asgi_app, 'GET', '/list/search', b'stream=1', [(b'authorization', b'Bearer 123')])
+    chunks = [message['body'] for message in sent[1:] if message['body']]
+    assert [json.loads(chunk) for chunk in chunks] == [{'id': '1'}, {'id': '2'}]
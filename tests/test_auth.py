@@ -0,0 +1,102 @@
+import json
+import time
+
+import pytest
+from authlib.jose import JsonWebKey, JsonWebToken
+
+from app import app
+from app.auth import TokenVerifier, load_keys
+
+
+@pytest.fixture(scope='module')
+def signing_key():
+    return JsonWebKey.generate_key('RSA', 2048, is_private=True, options={'kid': 'k1'})
+
+
+@pytest.fixture
+def key_file(tmp_path, signing_key):
+    path = tmp_path / 'keys.json'
+    path.write_text(json.dumps({'keys': [signing_key.as_dict(is_private=False)]}))
+    return str(path)
+
+
+@pytest.fixture
+def sign(signing_key):
+    def sign(lifetime=60, key=signing_key, **claims):
+        claims.setdefault('exp', int(time.time()) + lifetime)
+        return JsonWebToken(['RS256']).encode({'alg': 'RS256', 'kid': 'k1'}, claims, key).decode()
+
+    return sign
+
+
+@pytest.fixture
+def verifier(key_file):
+    return TokenVerifier.from_config({'AUTH_JWT_KEY_FILE': key_file, 'AUTH_TOKEN_CACHE_SIZE': 2})
+
+
+def test_disabled_without_key_file():
+    assert TokenVerifier.from_config({'AUTH_JWT_KEY_FILE': ''}) is None
+
+
+def test_load_keys_from_pem(tmp_path, signing_key, sign):
+    path = tmp_path / 'key.pem'
+    path.write_bytes(signing_key.as_pem(is_private=False))
+
+    assert TokenVerifier(load_keys(str(path))).verify(sign(sub='me'))['sub'] == 'me'
+
+
+def test_valid_tokens_are_checked_once(verifier, sign, mocker):
+    token = sign(sub='me')
+    decode = mocker.spy(verifier._jwt, 'decode')
+
+    assert verifier.verify(token)['sub'] == 'me'
+    assert verifier.verify(token)['sub'] == 'me'
+    assert decode.call_count == 1
+
+
+def test_invalid_tokens_are_rejected(verifier, sign):
+    other_key = JsonWebKey.generate_key('RSA', 2048, is_private=True)
+
+    assert verifier.verify(sign(lifetime=-10)) is None
+    assert verifier.verify(sign(key=other_key)) is None
+    assert verifier.verify('not a token') is None
+    assert verifier.verify('') is None
+    assert not verifier._cache
+
+
+def test_required_claims(key_file, sign):
+    verifier = TokenVerifier.from_config({'AUTH_JWT_KEY_FILE': key_file, 'AUTH_JWT_ISSUER': 'us'})
+
+    assert verifier.verify(sign(iss='them')) is None
+    assert verifier.verify(sign(iss='us'))['iss'] == 'us'
+
+
+def test_cached_tokens_expire(verifier, sign, mocker):
+    token = sign(lifetime=30)
+    assert verifier.verify(token) is not None
+
+    mocker.patch('app.auth.time.time', return_value=time.time() + 60)
+    assert verifier.verify(token) is None
+    assert not verifier._cache
+
+
+def test_cache_is_bounded(verifier, sign, mocker):
+    tokens = [sign(sub=str(n)) for n in range(3)]
+    for token in tokens:
+        verifier.verify(token)
+    decode = mocker.spy(verifier._jwt, 'decode')
+
+    assert len(verifier._cache) == 2
+    verifier.verify(tokens[2])
+    assert decode.call_count == 0
+    verifier.verify(tokens[0])
+    assert decode.call_count == 1
+
+
+def test_authenticate_verifies_tokens(verifier, sign, mocker):
+    mocker.patch.dict(app.extensions, {'token_verifier': verifier})
+    mocker.patch('app.model.song_list.SongList.get_list_version', return_value=None)
+    client = app.test_client()
+
+    assert client.get('/list/a', headers={'Authorization': 'Bearer 123'}).status_code == 401
+    assert client.get('/list/a', headers={'Authorization': f'Bearer {sign()}'}).status_code == 404
@@ -0,0 +1,52 @@
+from types import SimpleNamespace
+
+import pytest
+
+from benchmarks.library import generate_library
+from benchmarks.run import _check_search, compare, parse_size, summarize
+
+
+def test_generate_library_is_reproducible():
+    library = generate_library(20, 5, seed=1)
+
+    assert library == generate_library(20, 5, seed=1)
+    assert library != generate_library(20, 5, seed=2)
+    assert len(library['lists']) == 20
+    assert all(len(song_list['songs']) == 5 for song_list in library['lists'])
+    assert len({song['id'] for song_list in library['lists'] for song in song_list['songs']}) == 100
+
+
+def test_parse_size():
+    assert parse_size('small') == ('small', 100, 10)
+    assert parse_size('50x4') == ('50x4', 50, 4)
+
+
+def test_summarize():
+    summary = summarize([0.001, 0.002, 0.003, 0.004])
+
+    assert summary['samples'] == 4
+    assert summary['mean_ms'] == 2.5
+    assert summary['p50_ms'] == 2.5
+    assert summary['max_ms'] == 4
+    assert summary['ops_per_sec'] == 400
+
+
+def test_compare_reports_regressions():
+    def result(operation, p50):
+        return {'size': 'small', 'storage': 'json', 'persistence': 'snapshot', 'operation': operation, 'p50_ms': p50}
+
+    baseline = [result('search', 1.0), result('add', 1.0)]
+    regressions = compare([result('search', 1.2), result('add', 1.3), result('new', 9.0)], baseline, 0.25)
+
+    assert [(after['operation'], before['p50_ms']) for after, before in regressions] == [('add', 1.0)]
+
+
+def test_check_search_rejects_unfiltered_results():
+    def response(*song_counts):
+        request = SimpleNamespace(method='GET', path='/list/search')
+        return SimpleNamespace(status_code=200, request=request,
+                               json=[{'songs': [{}] * count} for count in song_counts])
+
+    _check_search(response(1, 2), 10)
+    with pytest.raises(RuntimeError):
+        _check_search(response(5, 5), 10)
@@ -0,0 +1,170 @@
+import threading
+import time
+
+import pytest
+
+from app.model.change_feed import ChangeFeed
+from app.model.journal import Journal
+from app.model.song_list import SongList
+
+
+@pytest.fixture
+def feed():
+    return ChangeFeed(size=3)
+
+
+@pytest.fixture
+def stored(mocker, tmp_path):
+    mocker.patch.object(SongList, 'SONG_PATH_FILE', str(tmp_path / 'songs.json'))
+    SongList.reset_resident()
+    yield tmp_path
+    SongList.reset_resident()
+
+
+@pytest.fixture
+def journaled_feed(stored, mocker):
+    mocker.patch.object(SongList, 'PERSISTENCE', 'journal')
+    feed = SongList.change_feed
+    size, max_waiters = feed.size, feed.max_waiters
+    feed.configure(size, max_waiters, SongList._feed_token(), SongList.warm)
+    mocker.patch.object(feed, 'refresh_interval', 0.01)
+    yield feed
+    feed.configure(size, max_waiters)
+
+
+@pytest.fixture
+def song():
+    return {'title': 'Paranoid', 'artist': 'Black Sabbath', 'album': 'Paranoid', 'id': '1'}
+
+
+def test_changes_after_a_sequence_number(feed):
+    feed.publish([{'op': 'remove_list', 'list_id': 'a'}, {'op': 'remove_list', 'list_id': 'b'}])
+
+    assert feed.changes(0) == {'token': feed.token, 'seq': 2, 'reset': False, 'changes': [
+        {'op': 'remove_list', 'list_id': 'a', 'seq': 1}, {'op': 'remove_list', 'list_id': 'b', 'seq': 2}]}
+    assert feed.changes(1, limit=1)['changes'] == [{'op': 'remove_list', 'list_id': 'b', 'seq': 2}]
+    assert feed.changes(2, token=feed.token) == {'token': feed.token, 'seq': 2, 'reset': False, 'changes': []}
+    assert feed.changes()['seq'] == 2
+
+
+def test_clients_reset_when_changes_are_unknown(feed):
+    feed.publish([{'op': 'remove_list', 'list_id': str(n)} for n in range(5)])
+
+    assert feed.changes(2)['changes'][0]['seq'] == 3
+    assert feed.changes(1) == {'token': feed.token, 'seq': 5, 'reset': True, 'changes': []}
+    assert feed.changes(6)['reset']
+    assert feed.changes(5, token='other')['reset']
+
+    feed.invalidate()
+    assert feed.changes(5)['reset']
+    assert feed.changes(6) == {'token': feed.token, 'seq': 6, 'reset': False, 'changes': []}
+
+
+def test_waits_for_the_next_change(feed):
+    timer = threading.Timer(0.05, feed.publish, [[{'op': 'remove_list', 'list_id': 'a'}]])
+    timer.start()
+    start = time.monotonic()
+
+    assert feed.changes(0, timeout=5)['changes'] == [{'op': 'remove_list', 'list_id': 'a', 'seq': 1}]
+    assert time.monotonic() - start < 5
+    timer.join()
+    assert feed.changes(1, timeout=0.01)['changes'] == []
+
+
+def test_changes_numbered_by_the_publisher(feed):
+    feed.publish([{'op': 'remove_list', 'list_id': 'a'}, {'op': 'remove_list', 'list_id': 'b'}], [3, 7])
+    feed.publish([{'op': 'remove_list', 'list_id': 'c'}], [7])
+
+    assert [change['seq'] for change in feed.changes(0)['changes']] == [3, 7]
+    assert feed.changes(5)['changes'] == [{'op': 'remove_list', 'list_id': 'b', 'seq': 7}]
+    assert feed.changes(7)['changes'] == []
+
+    feed.invalidate(10)
+    assert feed.changes(7)['reset']
+    assert feed.changes(10) == {'token': feed.token, 'seq': 10, 'reset': False, 'changes': []}
+
+
+def test_waiting_clients_are_limited():
+    feed = ChangeFeed(size=3, max_waiters=1)
+    waiter = threading.Thread(target=feed.changes, args=(0, 1000, 5))
+    waiter.start()
+    while not feed._waiters:
+        time.sleep(0.001)
+    start = time.monotonic()
+
+    assert feed.changes(0, timeout=5)['changes'] == []
+    assert time.monotonic() - start < 1
+    feed.publish([{'op': 'remove_list', 'list_id': 'a'}])
+    waiter.join()
+    assert feed._waiters == 0
+
+
+def test_waiting_clients_refresh(feed, mocker):
+    refresh = mocker.Mock(side_effect=lambda: feed.publish([{'op': 'remove_list', 'list_id': 'a'}]))
+    feed.configure(3, refresh=refresh)
+    mocker.patch.object(feed, 'refresh_interval', 0.01)
+
+    assert feed.changes(0, timeout=5)['changes'] == [{'op': 'remove_list', 'list_id': 'a', 'seq': 1}]
+    refresh.assert_called_once_with()
+
+
+def test_song_list_publishes_committed_changes(stored, song):
+    SongList.create_song_list({'id': 'other', 'songs': []})
+    since = SongList.change_feed.changes()['seq']
+    SongList.create_song_list({'id': 'a', 'songs': []})
+    SongList.add_song_to_list(dict(song), 'a')
+    SongList.add_songs_to_lists([(dict(song, id='2'), 'a'), (dict(song), 'missing')])
+    SongList.remove_song_from_list({'id': '1'}, 'a')
+    SongList.remove_list('a')
+    SongList.remove_list('a')
+
+    changes = SongList.change_feed.changes(since)
+    assert not changes['reset']
+    assert [(change['op'], change['list_id']) for change in changes['changes']] == [
+        ('create_list', 'a'), ('add_song', 'a'), ('add_song', 'a'), ('remove_song', 'a'), ('remove_list', 'a')]
+    assert changes['changes'][0]['list'] == {'id': 'a', 'songs': []}
+    assert changes['changes'][1]['song'] == song
+
+
+def test_failed_writes_are_not_published(stored, mocker):
+    since = SongList.change_feed.changes()['seq']
+    mocker.patch('app.model.song_list.SongList.save_to_file', side_effect=OSError('disk full'))
+
+    with pytest.raises(OSError):
+        SongList.create_song_list({'id': 'a', 'songs': []})
+    assert SongList.change_feed.changes(since)['changes'] == []
+
+
+def test_journaled_changes_of_other_processes_are_published(stored, mocker, song):
+    mocker.patch.object(SongList, 'PERSISTENCE', 'journal')
+    SongList.create_song_list({'id': 'a', 'songs': []})
+    since = SongList.change_feed.changes()['seq']
+    Journal(str(stored / 'songs.json.log')).append([{'op': 'add_song', 'list_id': 'a', 'song': song, 'seq': 2}])
+    SongList.warm()
+
+    assert SongList.change_feed.changes(since)['changes'] == [
+        {'op': 'add_song', 'list_id': 'a', 'song': song, 'seq': since + 1}]
+
+
+def _add_song_and_report(song, queue):
+    SongList.add_song_to_list(song, 'a')
+    queue.put(SongList.change_feed.changes())
+
+
+def test_journaled_changes_are_numbered_alike_in_every_process(journaled_feed, song):
+    multiprocessing = pytest.importorskip('multiprocessing')
+    SongList.create_song_list({'id': 'a', 'songs': []})
+    first = journaled_feed.changes()
+
+    context = multiprocessing.get_context('fork')
+    queue = context.Queue()
+    worker = context.Process(target=_add_song_and_report, args=(dict(song), queue))
+    worker.start()
+    seen = queue.get(timeout=10)
+    worker.join()
+
+    # a client following the other process, now asking this one
+    assert seen['token'] == first['token']
+    assert journaled_feed.changes(first['seq'], timeout=5, token=seen['token']) == {
+        'token': first['token'], 'seq': seen['seq'], 'reset': False,
+        'changes': [{'op': 'add_song', 'list_id': 'a', 'song': song, 'seq': seen['seq']}]}
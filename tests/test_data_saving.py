@@ -1,6 +1,9 @@
 import json
 import pytest
 
+from app.model import file_format
+from app.model.song import fold as fold_term
+from app.model.song_index import SongIndex
 from app.model.song_list import SongList, ListNotFoundException
 
 
@@ -195,12 +198,13 @@ def test_search_songs(mocker, mock_data, mocked_list_data):
     mock_get_from_file = mocker.patch('app.model.song_list.SongList.get_from_file')
     mock_get_from_file.return_value = mock_data
 
-    mock_matched_songs = mocker.patch('app.model.song_list.SongList._matched_songs')
-    mock_matched_songs.return_value = True
+    mock_matcher = mocker.patch('app.model.song_list.matcher')
+    mock_matcher.return_value.return_value = True
 
     title = 'cancion titulo'
     found_list = SongList.search_songs(title, None, None)
     mock_get_from_file.assert_called_once()
+    mock_matcher.assert_called_once_with(title, None, None)
     expected_json_data = mocked_list_data
     assert [expected_json_data] == found_list
 
@@ -209,12 +213,13 @@ def test_search_songs_not_found(mocker, mock_data):
     mock_get_from_file = mocker.patch('app.model.song_list.SongList.get_from_file')
     mock_get_from_file.return_value = mock_data
 
-    mock_matched_songs = mocker.patch('app.model.song_list.SongList._matched_songs')
-    mock_matched_songs.return_value = False
+    mock_matcher = mocker.patch('app.model.song_list.matcher')
+    mock_matcher.return_value.return_value = False
 
     title = 'cancion titulo'
     found_list = SongList.search_songs(title, None, None)
     mock_get_from_file.assert_called_once()
+    mock_matcher.assert_called_once_with(title, None, None)
     assert [] == found_list
 
 
@@ -226,3 +231,215 @@ def test_get_list_by_id(mocker, mock_data, mocked_list_data):
     mock_get_from_file.assert_called_once()
     expected_json_data = mocked_list_data
     assert [expected_json_data] == found_list
+
+
+def test_get_from_file_is_resident(mocker, tmp_path):
+    file_path = tmp_path / 'test_song.json'
+    with open(file_path, 'w') as f:
+        json.dump({'lists': [{'id': '123'}]}, f)
+
+    mocker.patch.object(SongList, 'SONG_PATH_FILE', str(file_path))
+    first = SongList.get_from_file()
+    mock_load = mocker.patch('app.model.song_list.json.load')
+    second = SongList.get_from_file()
+
+    assert second is first
+    mock_load.assert_not_called()
+
+
+def test_get_from_file_reloads_on_change(mocker, tmp_path):
+    file_path = tmp_path / 'test_song.json'
+    with open(file_path, 'w') as f:
+        json.dump({'lists': [{'id': '123'}]}, f)
+
+    mocker.patch.object(SongList, 'SONG_PATH_FILE', str(file_path))
+    SongList.get_from_file()
+    with open(file_path, 'w') as f:
+        json.dump({'lists': [{'id': '123'}, {'id': '456'}]}, f)
+
+    data = SongList.get_from_file()
+    assert data == {'lists': [{'id': '123'}, {'id': '456'}]}
+
+
+def test_save_to_file_updates_resident(mocker, mock_data, mock_file_path):
+    mocker.patch.object(SongList, 'SONG_PATH_FILE', str(mock_file_path))
+    SongList.save_to_file(mock_data)
+    mock_load = mocker.patch('app.model.song_list.json.load')
+
+    assert SongList.get_from_file() is mock_data
+    mock_load.assert_not_called()
+
+
+def test_search_songs_matches_substrings(mocker, mock_data, mocked_list_data):
+    mock_get_from_file = mocker.patch('app.model.song_list.SongList.get_from_file')
+    mock_get_from_file.return_value = mock_data
+
+    assert SongList.search_songs('TITU', None, 'album') == [mocked_list_data]
+    assert SongList.search_songs('titulo', 'otro artista', None) == []
+
+
+def test_save_to_file_failure_keeps_previous_file(mocker, mock_data, mock_file_path):
+    mocker.patch.object(SongList, 'SONG_PATH_FILE', str(mock_file_path))
+    SongList.save_to_file(mock_data)
+    mocker.patch('app.model.song_list.json.dump', side_effect=OSError('disk full'))
+
+    with pytest.raises(OSError):
+        SongList.save_to_file({'lists': []})
+
+    with open(mock_file_path) as f:
+        assert json.load(f) == mock_data
+    assert [path.name for path in mock_file_path.parent.iterdir() if path.suffix == '.tmp'] == []
+
+
+def _add_songs(path, list_id, count):
+    SongList.SONG_PATH_FILE = path
+    SongList.reset_resident()
+    for number in range(count):
+        SongList.add_song_to_list({'title': str(number), 'artist': 'a', 'album': 'b'}, list_id)
+
+
+def test_concurrent_writers_do_not_lose_updates(mocker, mocked_list_data, mock_file_path):
+    multiprocessing = pytest.importorskip('multiprocessing')
+    mocker.patch.object(SongList, 'SONG_PATH_FILE', str(mock_file_path))
+    SongList.create_song_list(mocked_list_data)
+
+    context = multiprocessing.get_context('fork')
+    workers = [context.Process(target=_add_songs, args=(str(mock_file_path), '1234456abc', 20)) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    SongList.reset_resident()
+    assert len(SongList.get_list_by_id('1234456abc')[0]['songs']) == 81
+
+
+def test_add_songs_to_lists_persists_once(mocker, mock_data):
+    mock_get_from_file = mocker.patch('app.model.song_list.SongList.get_from_file')
+    mock_get_from_file.return_value = mock_data
+    mock_save_to_file = mocker.patch('app.model.song_list.SongList.save_to_file')
+
+    song = {'title': 'otra', 'artist': 'otro', 'album': 'otro album'}
+    results = SongList.add_songs_to_lists([(song, '1234456abc'), (song, 'missing'), ('bad', '1234456abc')])
+
+    assert results[0] is None
+    assert isinstance(results[1], ListNotFoundException)
+    assert isinstance(results[2], TypeError)
+    mock_get_from_file.assert_called_once()
+    mock_save_to_file.assert_called_once_with(mock_data)
+    assert mock_data['lists'][0]['songs'][-1] == song
+
+
+def test_create_song_lists_nothing_to_persist(mocker):
+    mocker.patch('app.model.song_list.SongList.get_from_file', return_value={})
+    mock_save_to_file = mocker.patch('app.model.song_list.SongList.save_to_file')
+
+    results = SongList.create_song_lists(['not a list'])
+    assert isinstance(results[0], TypeError)
+    mock_save_to_file.assert_not_called()
+
+
+def test_add_song_assigns_id(mocker, mock_data):
+    mocker.patch('app.model.song_list.SongList.get_from_file', return_value=mock_data)
+    mocker.patch('app.model.song_list.SongList.save_to_file')
+
+    song = {'title': 'otra', 'artist': 'otro', 'album': 'otro album'}
+    SongList.add_song_to_list(song, '1234456abc')
+    assert song['id']
+
+    SongList.remove_song_from_list({'title': 'otra', 'artist': 'otro', 'album': 'otro album'}, '1234456abc')
+    assert song not in mock_data['lists'][0]['songs']
+
+
+@pytest.mark.parametrize('name, detected', [('json-min', 'json'), ('json-gzip', 'json-gzip'), ('packed', 'packed')])
+def test_save_to_file_in_format(mocker, mock_data, mock_file_path, name, detected):
+    mocker.patch.object(SongList, 'SONG_PATH_FILE', str(mock_file_path))
+    mocker.patch.object(SongList, 'FILE_FORMAT', name)
+    SongList.save_to_file(mock_data)
+    SongList.reset_resident()
+
+    with open(mock_file_path, 'rb') as f:
+        assert file_format.detect(f.read()) == detected
+    assert SongList.get_from_file() == mock_data
+
+
+def test_convert(mocker, mock_data, mock_file_path):
+    mocker.patch.object(SongList, 'SONG_PATH_FILE', str(mock_file_path))
+    SongList.save_to_file(mock_data)
+
+    assert SongList.convert('packed') == 'json'
+    assert SongList.FILE_FORMAT == 'json'
+    SongList.reset_resident()
+    with open(mock_file_path, 'rb') as f:
+        assert f.read().startswith(file_format.PACKED_MAGIC)
+    assert SongList.get_from_file() == mock_data
+
+
+def test_convert_refuses_unreadable_file(mocker, mock_file_path):
+    mocker.patch.object(SongList, 'SONG_PATH_FILE', str(mock_file_path))
+    mock_file_path.write_text('NOT JSON')
+
+    with pytest.raises(ValueError):
+        SongList.convert('json-min')
+    assert mock_file_path.read_text() == 'NOT JSON'
+
+
+def test_unhashable_ids_are_rejected(mocker, mock_file_path):
+    mocker.patch.object(SongList, 'SONG_PATH_FILE', str(mock_file_path))
+    SongList.reset_resident()
+    SongList.create_song_list({'id': 'a', 'songs': []})
+
+    with pytest.raises(TypeError):
+        SongList.create_song_list({'id': ['x'], 'songs': []})
+    with pytest.raises(TypeError):
+        SongList.add_song_to_list({'title': 't', 'id': {'odd': 1}}, 'a')
+    results = SongList.create_song_lists([{'id': 'b', 'songs': [{'title': 't', 'id': ['y']}]}, {'id': 'c'}])
+    assert [type(error) for error in results] == [TypeError, type(None)]
+
+    SongList.reset_resident()
+    assert [list_data['id'] for list_data in SongList.get_from_file()['lists']] == ['a', 'c']
+    assert SongList.get_list_by_id('a')[0]['songs'] == []
+    SongList.reset_resident()
+
+
+def test_file_with_unhashable_ids_loads(mocker, mock_file_path):
+    mocker.patch.object(SongList, 'SONG_PATH_FILE', str(mock_file_path))
+    with open(mock_file_path, 'w') as f:
+        json.dump({'lists': [{'id': ['x'], 'songs': []}, {'id': 'a', 'songs': []}]}, f)
+    SongList.reset_resident()
+
+    assert SongList.get_list_by_id('a') == [{'id': 'a', 'songs': []}]
+    assert SongList.search_songs('anything', None, None) == []
+    SongList.reset_resident()
+
+
+def test_readers_build_the_index_under_the_lock(mocker, mock_file_path):
+    mocker.patch.object(SongList, 'SONG_PATH_FILE', str(mock_file_path))
+    with open(mock_file_path, 'w') as f:
+        json.dump({'lists': [{'id': 'a', 'songs': [{'title': 'Help', 'id': '1'}]}]}, f)
+    owned = []
+
+    def build(*args, **kwargs):
+        owned.append(SongList._lock._is_owned())
+        return SongIndex(*args, **kwargs)
+
+    mocker.patch('app.model.song_list.SongIndex', side_effect=build)
+    for read in (lambda: SongList.get_list_by_id('a'), lambda: SongList.get_list_version('a'),
+                 lambda: SongList.search_songs('help', None, None), SongList.warm):
+        SongList.reset_resident()
+        read()
+
+    assert owned == [True] * 4
+    SongList.reset_resident()
+
+
+def test_search_folds_the_query_once(mocker):
+    songs = [{'title': f'Song {n}', 'artist': 'Artist', 'album': 'Album', 'id': str(n)} for n in range(100)]
+    songs.append({'title': 'Other', 'artist': 'Artist', 'album': 'Rare', 'id': 'other'})
+    mocker.patch('app.model.song_list.SongList.get_from_file', return_value={'lists': [{'id': 'a', 'songs': songs}]})
+    SongList.search_cache.clear()
+    SongList.warm()
+    fold = mocker.patch('app.model.song.fold', wraps=fold_term)
+
+    assert SongList.search_songs('song', None, 'rare') == []
+    assert fold.call_count == 2
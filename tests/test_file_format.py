@@ -0,0 +1,94 @@
+import io
+import json
+
+import pytest
+
+from app.model import file_format
+from app.model.packing import pack, unpack
+from app.model.song import Song
+
+
+@pytest.fixture
+def document():
+    return {
+        'lists': [
+            {'id': 'abc', 'name': 'lista ñandú', 'songs': [{'id': '1', 'title': 'Help', 'artist': 'Beatles',
+                                                            'album': 'Help' * 20, 'year': 1965, 'rating': 4.5}]},
+            {'id': 'def', 'name': None, 'songs': [], 'public': True, 'tags': ['x'] * 20},
+        ]
+    }
+
+
+@pytest.mark.parametrize('name', list(file_format.FORMATS))
+def test_round_trip(name, document):
+    fmt = file_format.get_format(name)
+    out = io.BytesIO()
+    fmt.dump(document, out)
+
+    assert out.getvalue() == fmt.dumps(document)
+    assert file_format.loads(out.getvalue()) == document
+
+
+def test_detect(document):
+    assert file_format.detect(file_format.get_format('json-gzip').dumps(document)) == 'json-gzip'
+    assert file_format.detect(file_format.get_format('packed').dumps(document)) == 'packed'
+    assert file_format.detect(file_format.get_format('json-min').dumps(document)) == 'json'
+
+
+def test_formats_are_smaller_than_indented_json(document):
+    sizes = {name: len(fmt.dumps(document)) for name, fmt in file_format.FORMATS.items()}
+
+    assert sizes['json-min'] < sizes['json']
+    assert sizes['packed'] < sizes['json-min']
+    assert sizes['json-gzip'] < sizes['json-min']
+
+
+def test_loads_empty():
+    assert file_format.loads(b'') == {}
+
+
+@pytest.mark.parametrize('name', ['json', 'json-gzip', 'packed'])
+def test_loads_corrupted(name, document):
+    raw = file_format.get_format(name).dumps(document)
+
+    with pytest.raises(ValueError):
+        file_format.loads(raw[:len(raw) // 2])
+
+
+def test_get_format_unknown():
+    with pytest.raises(ValueError):
+        file_format.get_format('xml')
+
+
+@pytest.mark.parametrize('value', [0, 127, 128, 255, 256, 65536, 2 ** 32, 2 ** 64 - 1, -1, -32, -33, -129,
+                                   -2 ** 15 - 1, -2 ** 31 - 1, -2 ** 63, 0.1, '', 'a' * 31, 'a' * 32, 'a' * 256,
+                                   'a' * 65536, list(range(16)), {str(i): i for i in range(16)}, [[], {}]])
+def test_pack_round_trip(value):
+    assert unpack(pack(value)) == value
+
+
+def test_pack_is_messagepack():
+    assert pack({'a': [1, -1, None, True]}) == b'\x81\xa1a\x94\x01\xff\xc0\xc3'
+
+
+def test_pack_unsupported():
+    with pytest.raises(TypeError):
+        pack({'a': object()})
+    with pytest.raises(ValueError):
+        pack(2 ** 64)
+    with pytest.raises(ValueError):
+        unpack(pack([1, 2]) + b'\x00')
+
+
+def test_indented_json_matches_json_dump():
+    document = {'lists': [{'id': 'a', 'name': 'two\nlines', 'songs': [{'title': 't', 'artist': 'é', 'id': '1'}]},
+                          {'id': 'b', 'songs': []}], 'journal_seq': 4}
+    records = dict(document, lists=[dict(list_data, songs=[Song.from_dict(song) for song in list_data['songs']])
+                                    for list_data in document['lists']])
+
+    expected = json.dumps(document, indent=4).encode('utf-8')
+    assert file_format.get_format('json').dumps(document) == expected
+    assert file_format.get_format('json').dumps(records) == expected
+    buffer = io.BytesIO()
+    file_format.get_format('json').dump(records, buffer)
+    assert buffer.getvalue() == expected
@@ -0,0 +1,274 @@
+import json
+import threading
+import time
+
+import pytest
+
+from app.model import file_format
+from app.model.journal import GroupSync, Journal
+from app.model.song_list import SongList
+
+
+@pytest.fixture
+def journaled(mocker, tmp_path):
+    mocker.patch.object(SongList, 'SONG_PATH_FILE', str(tmp_path / 'songs.json'))
+    mocker.patch.object(SongList, 'PERSISTENCE', 'journal')
+    mocker.patch.object(SongList, 'JOURNAL_COMPACT_BYTES', 1024 * 1024)
+    SongList.reset_resident()
+    yield tmp_path
+    SongList._stop_flusher()
+    SongList.reset_resident()
+
+
+@pytest.fixture
+def song():
+    return {'title': 'cancion titulo', 'artist': 'cancion artista', 'album': 'cancion album'}
+
+
+def _read_log(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_mutations_are_appended_to_the_log(journaled, song):
+    SongList.create_song_list({'id': '1', 'name': 'lista', 'songs': []})
+    SongList.add_song_to_list(song, '1')
+    SongList.remove_list('1')
+
+    assert not (journaled / 'songs.json').exists()
+    records = _read_log(journaled / 'songs.json.log')
+    assert [record['op'] for record in records] == ['create_list', 'add_song', 'remove_list']
+    assert [record['seq'] for record in records] == [1, 2, 3]
+
+
+def test_startup_replays_snapshot_and_log(journaled, song):
+    with open(journaled / 'songs.json', 'w') as f:
+        json.dump({'lists': [{'id': '1', 'name': 'lista', 'songs': []}], 'journal_seq': 1}, f)
+    Journal(str(journaled / 'songs.json.log')).append([
+        {'op': 'create_list', 'list': {'id': '1', 'name': 'lista', 'songs': []}, 'seq': 1},
+        {'op': 'add_song', 'list_id': '1', 'song': song, 'seq': 2}
+    ])
+
+    assert SongList.get_from_file() == {'lists': [{'id': '1', 'name': 'lista', 'songs': [song]}]}
+
+
+def test_reads_pick_up_appended_records(journaled, song):
+    SongList.create_song_list({'id': '1', 'name': 'lista', 'songs': []})
+    data = SongList.get_from_file()
+    Journal(str(journaled / 'songs.json.log')).append([
+        {'op': 'add_song', 'list_id': '1', 'song': song, 'seq': 2}
+    ])
+
+    assert SongList.get_from_file() is data
+    assert SongList.get_list_by_id('1') == [{'id': '1', 'name': 'lista', 'songs': [song]}]
+
+
+def test_torn_record_is_ignored(journaled, song):
+    SongList.create_song_list({'id': '1', 'name': 'lista', 'songs': []})
+    with open(journaled / 'songs.json.log', 'a') as f:
+        f.write('{"op": "add_so')
+    SongList.add_song_to_list(song, '1')
+
+    SongList.reset_resident()
+    assert SongList.get_list_by_id('1') == [{'id': '1', 'name': 'lista', 'songs': [song]}]
+
+
+def test_compact_journal(journaled, song):
+    SongList.create_song_list({'id': '1', 'name': 'lista', 'songs': []})
+    SongList.add_song_to_list(song, '1')
+    SongList.compact_journal()
+
+    with open(journaled / 'songs.json') as f:
+        snapshot = json.load(f)
+    assert snapshot == {'lists': [{'id': '1', 'name': 'lista', 'songs': [song]}], 'journal_seq': 2}
+    assert _read_log(journaled / 'songs.json.log') == []
+
+    other = {'title': 'otra', 'artist': 'otro', 'album': 'otro album'}
+    SongList.add_song_to_list(other, '1')
+    SongList.reset_resident()
+    assert SongList.get_list_by_id('1')[0]['songs'] == [song, other]
+
+
+def test_compaction_serializes_without_blocking_writers(journaled, song, mocker):
+    SongList.create_song_list({'id': '1', 'songs': []})
+    SongList.add_song_to_list(song, '1')
+    json_format = file_format.get_format(SongList.FILE_FORMAT)
+    dumps = json_format.dumps
+    other = {'title': 'otra', 'artist': 'otro', 'album': 'otro album'}
+
+    def dumps_while_writing(data):
+        assert not SongList._lock._is_owned()
+        SongList.add_song_to_list(other, '1')
+        return dumps(data)
+
+    mocker.patch.object(json_format, 'dumps', side_effect=dumps_while_writing)
+    SongList.compact_journal()
+
+    with open(journaled / 'songs.json') as f:
+        assert json.load(f)['lists'] == [{'id': '1', 'songs': [song]}]
+    SongList.reset_resident()
+    assert SongList.get_list_by_id('1')[0]['songs'] == [song, other]
+
+
+def test_compaction_is_scheduled_past_threshold(journaled, song, mocker):
+    mocker.patch.object(SongList, 'JOURNAL_COMPACT_BYTES', 1)
+    mock_schedule = mocker.patch('app.model.song_list.SongList._schedule_compaction')
+
+    SongList.create_song_list({'id': '1', 'name': 'lista', 'songs': []})
+    mock_schedule.assert_called_once()
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_group_sync_shares_fsyncs(tmp_path, mocker):
+    journal = Journal(str(tmp_path / 'log'))
+    positions = [journal.append([{'seq': n}], sync=False) for n in range(3)]
+    fsync = mocker.patch('app.model.journal.os.fsync')
+    group = GroupSync()
+
+    group.sync(journal, positions[2])
+    for position in positions:
+        group.sync(journal, position)
+    assert fsync.call_count == 1
+
+    position = journal.append([{'seq': 3}], sync=False)
+    group.sync(journal, position)
+    assert fsync.call_count == 2
+
+
+def test_records_appended_during_a_sync_are_synced_again(tmp_path, mocker):
+    journal = Journal(str(tmp_path / 'log'))
+    first = journal.append([{'seq': 1}], sync=False)
+    appended = []
+
+    def fsync(fd):
+        if not appended:
+            appended.append(journal.append([{'seq': 2}], sync=False))
+
+    fsync = mocker.patch('app.model.journal.os.fsync', side_effect=fsync)
+    group = GroupSync()
+
+    group.sync(journal, first)
+    group.sync(journal, appended[0])
+    assert fsync.call_count == 2
+
+
+def test_group_durability_syncs_concurrent_writers_together(journaled, song, mocker):
+    mocker.patch.object(SongList, 'DURABILITY', 'group')
+    SongList.create_song_list({'id': '1', 'name': 'lista', 'songs': []})
+    real_fsync = __import__('os').fsync
+    calls = []
+
+    def slow_fsync(fd):
+        calls.append(fd)
+        time.sleep(0.02)
+        real_fsync(fd)
+
+    mocker.patch('app.model.journal.os.fsync', side_effect=slow_fsync)
+    threads = [threading.Thread(target=SongList.add_song_to_list, args=(dict(song, id=str(n)), '1'))
+               for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert 0 < len(calls) < 8
+    SongList.reset_resident()
+    assert len(SongList.get_list_by_id('1')[0]['songs']) == 8
+
+
+def test_group_durability_failed_sync_raises(journaled, song, mocker):
+    mocker.patch.object(SongList, 'DURABILITY', 'group')
+    SongList.create_song_list({'id': '1', 'name': 'lista', 'songs': []})
+    mocker.patch('app.model.journal.os.fsync', side_effect=OSError('disk gone'))
+
+    with pytest.raises(OSError):
+        SongList.add_song_to_list(song, '1')
+
+
+def test_async_durability_syncs_in_the_background(journaled, song, mocker):
+    mocker.patch.object(SongList, 'DURABILITY', 'async')
+    mocker.patch.object(SongList, 'FLUSH_INTERVAL', 0.01)
+    append = mocker.spy(Journal, 'append')
+    sync = mocker.spy(Journal, 'sync')
+
+    SongList.create_song_list({'id': '1', 'name': 'lista', 'songs': []})
+    assert append.call_args.kwargs == {'sync': False}
+    assert _read_log(journaled / 'songs.json.log')[0]['op'] == 'create_list'
+    _wait_for(lambda: sync.call_count)
+
+
+def test_snapshot_interval_compacts_the_journal(journaled, song, mocker):
+    mocker.patch.object(SongList, 'SNAPSHOT_INTERVAL', 0.01)
+    SongList.create_song_list({'id': '1', 'name': 'lista', 'songs': []})
+    SongList.add_song_to_list(song, '1')
+
+    _wait_for(lambda: not _read_log(journaled / 'songs.json.log'))
+    with open(journaled / 'songs.json') as f:
+        assert json.load(f)['lists'] == [{'id': '1', 'name': 'lista', 'songs': [song]}]
+
+
+def test_flush_writes_a_snapshot(journaled, song, mocker):
+    mocker.patch.object(SongList, 'DURABILITY', 'async')
+    mocker.patch.object(SongList, 'FLUSH_INTERVAL', 60)
+    SongList.create_song_list({'id': '1', 'name': 'lista', 'songs': []})
+    SongList.add_song_to_list(song, '1')
+    SongList.flush()
+
+    assert _read_log(journaled / 'songs.json.log') == []
+    with open(journaled / 'songs.json') as f:
+        assert json.load(f) == {'lists': [{'id': '1', 'name': 'lista', 'songs': [song]}], 'journal_seq': 2}
+    SongList.flush()
+
+
+def test_compaction_gives_up_when_the_log_was_replaced(journaled, song, mocker):
+    SongList.create_song_list({'id': '1', 'name': 'lista', 'songs': []})
+    SongList.add_song_to_list(song, '1')
+    write_temp = SongList._write_temp
+
+    def compacted_elsewhere(write):
+        # another process folds the log into its own snapshot meanwhile
+        Journal(str(journaled / 'songs.json.log')).rewrite([])
+        return write_temp(write)
+
+    mocker.patch.object(SongList, '_write_temp', side_effect=compacted_elsewhere)
+    SongList.compact_journal()
+
+    assert not (journaled / 'songs.json').exists()
+    assert not list(journaled.glob('*.tmp'))
+
+
+def _add_songs_from_threads(list_id, threads, count):
+    def add_songs(thread):
+        for number in range(count):
+            SongList.add_song_to_list({'title': f'{thread}-{number}', 'artist': 'a', 'album': 'b'}, list_id)
+
+    workers = [threading.Thread(target=add_songs, args=(thread,)) for thread in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+@pytest.mark.parametrize('durability', ['sync', 'group', 'async'])
+def test_concurrent_processes_do_not_lose_writes_across_compactions(journaled, mocker, durability):
+    multiprocessing = pytest.importorskip('multiprocessing')
+    mocker.patch.object(SongList, 'JOURNAL_COMPACT_BYTES', 2000)
+    mocker.patch.object(SongList, 'DURABILITY', durability)
+    list_ids = [str(number) for number in range(4)]
+    SongList.create_song_lists([{'id': list_id, 'songs': []} for list_id in list_ids])
+
+    context = multiprocessing.get_context('fork')
+    workers = [context.Process(target=_add_songs_from_threads, args=(list_id, 3, 30)) for list_id in list_ids]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    SongList.reset_resident()
+    assert [len(SongList.get_list_by_id(list_id)[0]['songs']) for list_id in list_ids] == [90] * 4
@@ -0,0 +1,113 @@
+import json
+import threading
+
+import pytest
+
+from app import app
+from app.json_provider import FragmentCache, JSONProvider
+from app.model.song import Song
+from app.model.song_list import SongList
+
+
+@pytest.fixture
+def provider():
+    provider = JSONProvider(app)
+    provider.configure({'JSON_ENCODER': 'auto', 'JSON_FRAGMENT_CACHE_BYTES': 1024})
+    return provider
+
+
+@pytest.fixture
+def stored(mocker, tmp_path):
+    mocker.patch.object(SongList, 'SONG_PATH_FILE', str(tmp_path / 'songs.json'))
+    SongList.reset_resident()
+    yield tmp_path
+    SongList.reset_resident()
+
+
+def test_fragment_cache_keeps_latest_version():
+    cache = FragmentCache(max_bytes=10)
+    cache.put('a', 'v1', b'1234')
+    assert cache.get('a', 'v1') == b'1234'
+
+    cache.put('a', 'v2', b'5678')
+    assert cache.get('a', 'v1') is None
+    assert cache.get('a', 'v2') == b'5678'
+    assert cache.stats() == {'hits': 2, 'misses': 1, 'entries': 1, 'bytes': 4}
+
+
+def test_fragment_cache_drops_least_recently_used():
+    cache = FragmentCache(max_bytes=10)
+    cache.put('a', 'v1', b'1234')
+    cache.put('b', 'v1', b'1234')
+    cache.get('a', 'v1')
+    cache.put('c', 'v1', b'1234')
+    cache.put('d', 'v1', b'12345678901')
+
+    assert cache.get('b', 'v1') is None
+    assert cache.get('a', 'v1') == b'1234'
+    assert cache.get('d', 'v1') is None
+
+
+@pytest.mark.parametrize('encoder', ['auto', 'json'])
+def test_encoders_agree(provider, encoder):
+    provider.configure({'JSON_ENCODER': encoder})
+    data = {'b': [Song.from_dict({'title': 'Straße', 'id': '1'})], 'a': None, 'c': 2 ** 70}
+
+    expected = {'a': None, 'b': [{'title': 'Straße', 'id': '1'}], 'c': 2 ** 70}
+    assert json.loads(provider.dumps(data, separators=(',', ':'))) == expected
+    assert json.loads(provider.dumps(data, indent=2)) == expected
+    assert json.loads(provider.encode_list(data, None)) == expected
+
+
+def test_unknown_encoder(provider):
+    with pytest.raises(ValueError):
+        provider.configure({'JSON_ENCODER': 'yaml'})
+
+
+def test_encode_list_reuses_fragments(provider, mocker):
+    list_data = {'id': 'a', 'songs': []}
+    fragment = provider.encode_list(list_data, 'v1')
+    encode = mocker.spy(provider, '_encode')
+
+    assert provider.encode_list(list_data, 'v1') is fragment
+    assert provider.encode_list(list_data, None) == fragment
+    assert encode.call_count == 1
+
+
+def test_search_responses_follow_changes(stored):
+    song = {'title': 'Paranoid', 'artist': 'Black Sabbath', 'album': 'Paranoid'}
+    SongList.create_song_lists([{'id': 'a', 'songs': [dict(song)]}, {'id': 'b', 'songs': [dict(song)]}])
+    client = app.test_client()
+    headers = {'Authorization': 'Bearer 123'}
+    query = {'artist': 'sabbath'}
+
+    first = client.get('/list/search', headers=headers, query_string=query)
+    assert first.json == SongList.search_songs(None, 'sabbath', None)
+    assert client.get('/list/search', headers=headers, query_string=query).data == first.data
+
+    SongList.add_song_to_list(dict(song, title='War Pigs'), 'b')
+    response = client.get('/list/search', headers=headers, query_string=query)
+    assert [len(song_list['songs']) for song_list in response.json] == [1, 2]
+    assert client.get('/list/b', headers=headers).json == response.json[1]
+    streamed = client.get('/list/search', headers=headers, query_string=dict(query, stream=1))
+    assert [json.loads(line) for line in streamed.data.splitlines()] == response.json
+
+
+def test_list_versions_do_not_wait_for_writers(stored):
+    SongList.create_song_lists([{'id': 'a', 'songs': [{'title': 'Paranoid'}]}])
+    lists = SongList.search_songs('paranoid', None, None)
+    held, release = threading.Event(), threading.Event()
+
+    def write():
+        with SongList._lock:
+            held.set()
+            release.wait(5)
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    held.wait(5)
+    try:
+        assert SongList.list_versions(lists + [{'id': 'a'}]) == [SongList.get_list_version('a'), None]
+    finally:
+        release.set()
+        writer.join()
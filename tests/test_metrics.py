@@ -0,0 +1,98 @@
+import json
+
+import pytest
+
+from app import app, metrics
+from app.metrics import Counter, Histogram, Registry
+from app.model.song_list import SongList
+
+
+@pytest.fixture
+def registry():
+    registry = Registry()
+    registry.enabled = True
+    return registry
+
+
+@pytest.fixture
+def enabled():
+    metrics.REGISTRY.enabled = True
+    metrics.REGISTRY.clear()
+    yield metrics.REGISTRY
+    metrics.REGISTRY.enabled = False
+    metrics.REGISTRY.clear()
+
+
+@pytest.fixture
+def client():
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        yield client
+
+
+def test_counter_render(registry):
+    counter = Counter('requests_total', 'Requests', ('path',), registry=registry)
+    counter.inc('/a')
+    counter.inc('/a', amount=2)
+    counter.inc('/"b"')
+
+    assert registry.render() == (
+        '# HELP requests_total Requests\n'
+        '# TYPE requests_total counter\n'
+        'requests_total{path="/\\"b\\""} 1.0\n'
+        'requests_total{path="/a"} 3.0\n'
+    )
+
+
+def test_histogram_render(registry):
+    histogram = Histogram('latency_seconds', 'Latency', buckets=(0.1, 1), registry=registry)
+    histogram.observe(0.05)
+    histogram.observe(0.1)
+    histogram.observe(5)
+
+    assert histogram.render() == [
+        'latency_seconds_bucket{le="0.1"} 2',
+        'latency_seconds_bucket{le="1.0"} 2',
+        'latency_seconds_bucket{le="+Inf"} 3',
+        'latency_seconds_sum 5.15',
+        'latency_seconds_count 3',
+    ]
+
+
+def test_disabled_registry_records_nothing(registry):
+    registry.enabled = False
+    counter = Counter('requests_total', 'Requests', registry=registry)
+    histogram = Histogram('latency_seconds', 'Latency', registry=registry)
+    counter.inc()
+    histogram.observe(1)
+    with histogram.time():
+        pass
+
+    assert counter.render() == []
+    assert histogram.render() == []
+
+
+def test_metrics_disabled(client):
+    assert client.get('/metrics').status_code == 404
+
+
+def test_metrics_endpoint(client, enabled, mocker, tmp_path):
+    file_path = tmp_path / 'songs.json'
+    with open(file_path, 'w') as f:
+        json.dump({'lists': [{'id': 'abc', 'songs': [{'title': 'Help'}, {'title': 'Yesterday'}]}]}, f)
+    mocker.patch.object(SongList, 'SONG_PATH_FILE', str(file_path))
+    SongList.reset_resident()
+
+    client.get('/list/abc', headers={'Authorization': 'Bearer 123'})
+    response = client.get('/metrics')
+    body = response.get_data(as_text=True)
+
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    assert 'song_api_request_duration_seconds_count{method="GET",endpoint="song_api.get_song_list",status="200"} 1' \
+        in body
+    assert 'song_api_auth_duration_seconds_count 1' in body
+    assert 'song_storage_read_bytes_total{storage="json"} %s' % float(file_path.stat().st_size) in body
+    assert 'song_storage_lists{storage="json"} 1.0' in body
+    assert 'song_storage_songs{storage="json"} 2.0' in body
+    assert 'song_api_json_encode_duration_seconds_count' in body
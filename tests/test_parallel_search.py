@@ -0,0 +1,64 @@
+import pytest
+
+from app.model.parallel_search import ParallelSearch
+from app.model.song_list import SongList
+
+
+@pytest.fixture
+def parallel(mocker, tmp_path):
+    mocker.patch.object(SongList, 'SONG_PATH_FILE', str(tmp_path / 'songs.json'))
+    parallel_search = ParallelSearch(workers=2, min_lists=1)
+    mocker.patch.object(SongList, 'parallel_search', parallel_search)
+    SongList.reset_resident()
+    SongList.search_cache.clear()
+    SongList.create_song_lists([
+        {'id': str(number), 'songs': [{'title': f'Song {number}', 'artist': 'Band' if number % 2 else 'Solo',
+                                       'album': 'Album'}]}
+        for number in range(8)
+    ])
+    yield parallel_search
+    parallel_search.close()
+    SongList.reset_resident()
+    SongList.search_cache.clear()
+
+
+def _search(*query):
+    SongList.search_cache.clear()
+    return [song_list['id'] for song_list in SongList.search_songs(*query)]
+
+
+def test_results_are_merged_in_list_order(parallel, mocker):
+    search = mocker.spy(parallel, 'search')
+
+    assert _search(None, 'band', None) == ['1', '3', '5', '7']
+    assert _search('song', None, 'alb') == [str(number) for number in range(8)]
+    assert search.call_count == 2
+
+
+def test_workers_follow_changes(parallel):
+    assert _search(None, 'band', None) == ['1', '3', '5', '7']
+
+    SongList.add_song_to_list({'title': 'Other', 'artist': 'Band', 'album': 'Album'}, '2')
+    SongList.remove_list('3')
+    SongList.create_song_list({'id': '8', 'songs': [{'title': 'Song 8', 'artist': 'Band', 'album': 'Album'}]})
+    SongList.remove_song_from_list({'title': 'Song 5', 'artist': 'Band', 'album': 'Album'}, '5')
+
+    assert _search(None, 'band', None) == ['1', '2', '7', '8']
+
+
+def test_small_searches_run_in_process(parallel, mocker):
+    parallel.min_lists = 5
+    search = mocker.spy(parallel, 'search')
+
+    assert _search('song 3', None, None) == ['3']
+    search.assert_not_called()
+
+
+def test_failed_workers_fall_back_to_the_process(parallel):
+    index = SongList._get_index(SongList.get_from_file())
+    # workers believe they already hold the lists, but were never sent any
+    parallel._start()
+    parallel._token, parallel._mark = index.token, index.mark()
+
+    assert parallel.search(index, SongList._lock, index.seqs(), None, 'band', None) is None
+    assert _search(None, 'band', None) == ['1', '3', '5', '7']
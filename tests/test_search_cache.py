@@ -0,0 +1,107 @@
+import pytest
+
+from app.model.search_cache import SearchCache, normalize_query
+from app.model.song import matcher
+from app.model.song_list import SongList
+
+
+@pytest.fixture
+def cache():
+    return SearchCache(matcher, max_entries=2, ttl=60)
+
+
+@pytest.fixture
+def rock():
+    return {'id': 'a', 'name': 'rock', 'songs': [{'title': 'Paranoid', 'artist': 'Black Sabbath', 'album': 'Paranoid'}]}
+
+
+def test_normalize_query():
+    assert normalize_query('Money', None, '') == ('money', '', '')
+
+
+def test_hits_and_misses(cache, rock):
+    key = normalize_query(None, 'sabbath', None)
+    assert cache.get(key) is None
+    cache.put(key, [rock], cache.generation())
+
+    assert cache.get(key) == [rock]
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'invalidations': 0, 'entries': 1}
+
+
+def test_least_recently_used_is_evicted(cache, rock):
+    for artist in ('a', 'b', 'c'):
+        cache.put(normalize_query(None, artist, None), [rock], cache.generation())
+    assert cache.get(normalize_query(None, 'a', None)) is None
+    assert cache.get(normalize_query(None, 'c', None)) == [rock]
+
+
+def test_expired_entries_are_misses(cache, rock, mocker):
+    key = normalize_query('paranoid', None, None)
+    cache.put(key, [rock], cache.generation())
+    mocker.patch('app.model.search_cache.time.monotonic', return_value=10 ** 9)
+
+    assert cache.get(key) is None
+
+
+def test_stale_results_are_not_stored(cache, rock):
+    key = normalize_query('paranoid', None, None)
+    generation = cache.generation()
+    cache.list_removed({'id': 'other'})
+    cache.put(key, [rock], generation)
+
+    assert cache.get(key) is None
+
+
+def test_invalidation_is_limited_to_affected_queries(cache, rock):
+    sabbath, floyd = normalize_query(None, 'sabbath', None), normalize_query(None, 'floyd', None)
+    cache.put(sabbath, [rock], cache.generation())
+    cache.put(floyd, [], cache.generation())
+
+    cache.song_added(rock, {'title': 'Iron Man', 'artist': 'Black Sabbath', 'album': 'Paranoid'})
+    assert cache.get(sabbath) == [rock]
+    assert cache.get(floyd) == []
+
+    cache.song_added(rock, {'title': 'Money', 'artist': 'Pink Floyd', 'album': 'Dark Side'})
+    assert cache.get(floyd) is None
+    assert cache.get(sabbath) == [rock]
+
+    cache.list_removed(rock)
+    assert cache.get(sabbath) is None
+
+
+def test_song_list_search_uses_cache(mocker, rock):
+    mocker.patch('app.model.song_list.SongList.get_from_file', return_value={'lists': [rock]})
+    mocker.patch('app.model.song_list.SongList.save_to_file')
+    mock_matcher = mocker.patch('app.model.song_list.matcher', wraps=matcher)
+
+    assert SongList.search_songs(None, 'sabbath', None) == [rock]
+    assert SongList.search_songs(None, 'SABBATH', None) == [rock]
+    assert mock_matcher.call_count == 1
+
+    SongList.create_song_list({'id': 'b', 'name': 'more', 'songs': [
+        {'title': 'War Pigs', 'artist': 'Black Sabbath', 'album': 'Paranoid'}
+    ]})
+    assert [item['id'] for item in SongList.search_songs(None, 'sabbath', None)] == ['a', 'b']
+
+
+def test_entries_match_changes_with_their_own_matcher(rock, mocker):
+    build = mocker.Mock(wraps=matcher)
+    cache = SearchCache(build, max_entries=2, ttl=60)
+    sabbath = normalize_query(None, 'sabbath', None)
+    cache.put(sabbath, [rock], cache.generation())
+
+    cache.song_added({'id': 'b'}, {'title': 'Money', 'artist': 'Pink Floyd', 'album': 'Dark Side'})
+    cache.list_created({'id': 'c', 'songs': [{'title': 'Time', 'artist': 'Pink Floyd', 'album': 'Dark Side'}]})
+    assert cache.get(sabbath) == [rock]
+    build.assert_called_once_with('', 'sabbath', '')
+
+
+def test_large_changes_clear_the_cache(cache, rock, mocker):
+    mocker.patch.object(cache, 'max_checked_songs', 1)
+    floyd = {'title': 'Money', 'artist': 'Pink Floyd', 'album': 'Dark Side'}
+    cache.put(normalize_query(None, 'sabbath', None), [rock], cache.generation())
+    generation = cache.generation()
+
+    cache.list_created({'id': 'b', 'songs': [floyd, dict(floyd, title='Time')]})
+    assert cache.get(normalize_query(None, 'sabbath', None)) is None
+    assert cache.generation() != generation
@@ -0,0 +1,89 @@
+import http.client
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from app import app
+from app.model.song_list import SongList
+from app.server import PooledWSGIServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _get(port, path, timeout=10):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            conn.request('GET', path, headers={'Authorization': 'Bearer 123'})
+            response = conn.getresponse()
+            return response.status, response.read()
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+@pytest.fixture
+def song_file(tmp_path):
+    path = tmp_path / 'songs.json'
+    with open(path, 'w') as f:
+        json.dump({'lists': [{'id': 'abc', 'songs': [{'id': '1', 'title': 'Help', 'artist': 'Beatles',
+                                                      'album': 'Help'}]},
+                             {'id': 'def', 'songs': [{'id': '2', 'title': 'Yesterday', 'artist': 'Beatles',
+                                                      'album': 'Help'}]}]}, f)
+    return str(path)
+
+
+def test_warm_indexes_song_lists(mocker, song_file):
+    mocker.patch.object(SongList, 'SONG_PATH_FILE', song_file)
+    SongList.reset_resident()
+    SongList.warm()
+
+    assert SongList._index.data is SongList.get_from_file()
+    assert SongList._index.get('abc')['id'] == 'abc'
+
+
+def test_pooled_server_handles_requests(mocker, song_file):
+    mocker.patch.object(SongList, 'SONG_PATH_FILE', song_file)
+    SongList.reset_resident()
+    server = PooledWSGIServer('127.0.0.1', 0, app, threads=2)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        status, body = _get(server.port, '/list/search?song_title=help')
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+    assert status == 200
+    assert [song_list['id'] for song_list in json.loads(body)] == ['abc']
+
+
+def test_serve_forks_workers(song_file):
+    port = _free_port()
+    env = dict(os.environ, SONG_PATH_FILE=song_file, SERVER_PORT=str(port), SERVER_WORKERS='2',
+               SERVER_THREADS='2')
+    process = subprocess.Popen([sys.executable, 'serve.py'], cwd=ROOT, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        status, body = _get(port, '/list/abc')
+        assert status == 200
+        assert json.loads(body)['id'] == 'abc'
+    finally:
+        process.send_signal(signal.SIGTERM)
+        assert process.wait(timeout=10) == 0
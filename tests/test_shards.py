@@ -0,0 +1,151 @@
+import json
+import threading
+
+import pytest
+
+from app.model import file_format
+from app.model.journal import Journal
+from app.model.song_list import SongList
+
+
+@pytest.fixture
+def sharded(mocker, tmp_path):
+    mocker.patch.object(SongList, 'SONG_PATH_FILE', str(tmp_path / 'songs.json'))
+    mocker.patch.object(SongList, 'PERSISTENCE', 'sharded')
+    mocker.patch.object(SongList, 'SHARDS', 8)
+    SongList.reset_resident()
+    yield tmp_path / 'songs.shards'
+    SongList.reset_resident()
+
+
+@pytest.fixture
+def song():
+    return {'title': 'cancion titulo', 'artist': 'cancion artista', 'album': 'cancion album'}
+
+
+def _ids_in_different_shards():
+    ids = [str(number) for number in range(100)]
+    first = ids[0]
+    second = next(list_id for list_id in ids if SongList._shard_of(list_id) != SongList._shard_of(first))
+    return first, second
+
+
+def _shard_file(directory, list_id):
+    return directory / ('%03d.json' % SongList._shard_of(list_id))
+
+
+def _read_shard(path):
+    with open(path, 'rb') as f:
+        return file_format.loads(f.read())
+
+
+def test_imports_single_file(sharded, song):
+    with open(sharded.parent / 'songs.json', 'w') as f:
+        json.dump({'lists': [{'id': str(number), 'songs': []} for number in range(20)], 'journal_seq': 1}, f)
+    Journal(str(sharded.parent / 'songs.json.log')).append([
+        {'op': 'add_song', 'list_id': '3', 'song': song, 'seq': 2}
+    ])
+
+    data = SongList.get_from_file()
+
+    assert [list_data['id'] for list_data in data['lists']] == [str(number) for number in range(20)]
+    assert SongList.get_list_by_id('3')[0]['songs'] == [song]
+    with open(sharded / 'manifest.json') as f:
+        assert json.load(f) == {'versions': [0] * 8}
+    assert sum(len(_read_shard(path)['lists']) for path in sharded.glob('0*.json')) == 20
+
+
+def test_changes_only_rewrite_their_shard(sharded, song):
+    first, second = _ids_in_different_shards()
+    SongList.create_song_list({'id': first, 'songs': []})
+    SongList.create_song_list({'id': second, 'songs': []})
+    untouched = _shard_file(sharded, second).stat()
+
+    SongList.add_song_to_list(song, first)
+
+    assert _shard_file(sharded, second).stat().st_ino == untouched.st_ino
+    assert _read_shard(_shard_file(sharded, first))['lists'] == [{'id': first, 'songs': [song]}]
+    with open(sharded / 'manifest.json') as f:
+        versions = json.load(f)['versions']
+    assert versions[SongList._shard_of(first)] == 2
+    assert versions[SongList._shard_of(second)] == 1
+
+
+def test_reload_keeps_creation_order(sharded, song):
+    for list_id in ['5', '1', '9', '3', '7']:
+        SongList.create_song_list({'id': list_id, 'songs': []})
+    SongList.remove_list('9')
+
+    SongList.reset_resident()
+    assert [list_data['id'] for list_data in SongList.get_from_file()['lists']] == ['5', '1', '3', '7']
+
+
+def test_reads_pick_up_changed_shards(sharded, song):
+    first, second = _ids_in_different_shards()
+    SongList.create_song_list({'id': first, 'songs': []})
+    SongList.create_song_list({'id': second, 'songs': []})
+    data = SongList.get_from_file()
+    kept = SongList.get_list_by_id(second)[0]
+
+    # another process adds a song to the first list
+    shard = SongList._shard_of(first)
+    content = _read_shard(_shard_file(sharded, first))
+    content['lists'][0]['songs'].append(song)
+    SongList._write_shard(shard, list(zip(content['seqs'], content['lists'])))
+    with open(sharded / 'manifest.json') as f:
+        manifest = json.load(f)
+    manifest['versions'][shard] += 1
+    SongList._write_manifest(manifest)
+
+    assert SongList.get_from_file() is data
+    assert SongList.get_list_by_id(first)[0]['songs'] == [song]
+    assert SongList.get_list_by_id(second)[0] is kept
+    assert [list_data['id'] for list_data in data['lists']] == [first, second]
+
+
+def test_failed_write_restores_shard(sharded, mocker, song):
+    SongList.create_song_list({'id': '1', 'songs': []})
+    mocker.patch.object(SongList, '_write_shard', side_effect=OSError('disk full'))
+
+    with pytest.raises(OSError):
+        SongList.add_song_to_list(song, '1')
+    assert SongList.get_list_by_id('1') == [{'id': '1', 'songs': []}]
+
+
+def test_writers_of_other_shards_are_not_blocked(sharded, song):
+    first, second = _ids_in_different_shards()
+    SongList.create_song_lists([{'id': first, 'songs': []}, {'id': second, 'songs': []}])
+
+    with SongList._write_lock(first):
+        writer = threading.Thread(target=SongList.add_song_to_list, args=(song, second))
+        writer.start()
+        writer.join(timeout=5)
+        assert not writer.is_alive()
+
+    assert SongList.get_list_by_id(second)[0]['songs'] == [song]
+
+
+def _add_songs(list_ids, count):
+    for number in range(count):
+        for list_id in list_ids:
+            SongList.add_song_to_list({'title': str(number), 'artist': 'a', 'album': 'b'}, list_id)
+
+
+def test_concurrent_writers_do_not_lose_updates(sharded):
+    multiprocessing = pytest.importorskip('multiprocessing')
+    list_ids = [str(number) for number in range(6)]
+    SongList.create_song_lists([{'id': list_id, 'songs': []} for list_id in list_ids])
+
+    context = multiprocessing.get_context('fork')
+    workers = [context.Process(target=_add_songs, args=(list_ids[number % 3:], 10))
+               for number in range(4)]
+    threads = [threading.Thread(target=_add_songs, args=([list_id], 10))
+               for list_id in list_ids]
+    for worker in workers + threads:
+        worker.start()
+    for worker in workers + threads:
+        worker.join()
+
+    SongList.reset_resident()
+    counts = [len(SongList.get_list_by_id(list_id)[0]['songs']) for list_id in list_ids]
+    assert counts == [30, 40, 50, 50, 50, 50]
@@ -0,0 +1,114 @@
+import json
+import pickle
+
+import pytest
+
+from app.model import file_format
+from app.model.song import Song, compact, json_default, matcher
+from app.model.song_list import SongList
+
+
+@pytest.fixture
+def song():
+    return {'title': 'Paranoid', 'artist': 'Black Sabbath', 'album': 'Paranoid', 'id': '1'}
+
+
+def test_record_reads_like_its_dict(song):
+    record = Song.from_dict(song)
+
+    assert record == song
+    assert song == record
+    assert dict(record) == song
+    assert record['artist'] == 'Black Sabbath'
+    assert record.get('year') is None
+    assert 'album' in record
+    with pytest.raises(KeyError):
+        record['year']
+
+
+def test_missing_and_extra_fields_are_kept():
+    song = {'title': 'Money', 'year': 1973, 'tags': ['rock']}
+    record = Song.from_dict(song)
+
+    assert record.to_dict() == song
+    assert len(record) == 3
+    assert 'artist' not in record
+    assert record.get('artist', '') == ''
+    assert pickle.loads(pickle.dumps(record)) == song
+
+
+def test_strings_are_shared(song):
+    first = Song.from_dict(json.loads(json.dumps(song)))
+    second = Song.from_dict(json.loads(json.dumps(song)))
+
+    assert first['artist'] is second['artist']
+    assert first['album'] is second['album']
+
+
+def test_compact_leaves_records_alone(song):
+    record = compact(song)
+    assert isinstance(record, Song)
+    assert compact(record) is record
+
+
+def test_records_are_encoded_as_objects(song):
+    document = {'lists': [{'id': 'a', 'songs': [Song.from_dict(song)]}]}
+
+    assert json.loads(json.dumps(document, default=json_default)) == document
+    for name in file_format.FORMATS:
+        assert file_format.loads(file_format.get_format(name).dumps(document)) == document
+    with pytest.raises(TypeError):
+        json_default(object())
+
+
+def test_storage_keeps_records(mocker, tmp_path, song):
+    mocker.patch.object(SongList, 'SONG_PATH_FILE', str(tmp_path / 'songs.json'))
+    SongList.reset_resident()
+    SongList.create_song_list({'id': 'a', 'songs': [dict(song)]})
+    SongList.add_song_to_list({'title': 'Money', 'artist': 'Pink Floyd', 'album': 'The Dark Side of the Moon'}, 'a')
+
+    songs = SongList.get_list_by_id('a')[0]['songs']
+    assert all(isinstance(stored, Song) for stored in songs)
+    with open(tmp_path / 'songs.json') as f:
+        assert json.load(f)['lists'][0]['songs'] == songs
+
+    SongList.reset_resident()
+    assert SongList.get_list_by_id('a')[0]['songs'] == songs
+    SongList.reset_resident()
+
+
+
+def test_records_keep_folded_search_keys(song):
+    record = Song.from_dict(dict(song, title='Straße', album=None))
+
+    assert record.title_key == 'strasse'
+    assert record.artist_key == 'black sabbath'
+    assert record.album_key == ''
+    lower = Song.from_dict(dict(song, title='paranoid'))
+    assert lower.title_key is lower.title
+
+
+@pytest.mark.parametrize('query, expected', [
+    (('STRASSE', None, None), True),
+    (('straße', 'sabbath', None), True),
+    ((None, None, 'paranoid'), True),
+    (('strasse', 'floyd', None), False),
+    ((None, None, None), True),
+])
+def test_matcher_on_records_and_dicts(song, query, expected):
+    song = dict(song, title='Straße')
+    matches = matcher(*query)
+
+    assert matches(song) is expected
+    assert matches(Song.from_dict(song)) is expected
+    assert SongList._matched_songs(Song.from_dict(song), *query) is expected
+
+
+def test_search_folds_case(mocker, tmp_path, song):
+    mocker.patch.object(SongList, 'SONG_PATH_FILE', str(tmp_path / 'songs.json'))
+    SongList.reset_resident()
+    SongList.create_song_list({'id': 'a', 'songs': [dict(song, title='Straße')]})
+
+    assert [item['id'] for item in SongList.search_songs('STRASSE', None, None)] == ['a']
+    assert SongList.search_songs('strase', None, None) == []
+    SongList.reset_resident()
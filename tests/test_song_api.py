@@ -4,6 +4,7 @@ import pytest
 from app import app
 from unittest.mock import MagicMock
 
+from app.model.song import Song
 from app.model.song_list import ListNotFoundException
 
 
@@ -170,3 +171,195 @@ def test_methods_throws_exception(client, headers, mocker, mock_data):
     response = client.post('/list', data=json.dumps(mock_data), headers=headers)
     assert response.status_code == 400
     assert response.json == {'message': 'Exception'}
+
+
+def test_create_song_lists(client, headers, mocker, mock_data):
+    mock_create_song_lists = mocker.patch('app.model.song_list.SongList.create_song_lists')
+    mock_create_song_lists.return_value = [None, TypeError('Song list must be an object')]
+
+    response = client.post('/list/batch', data=json.dumps([mock_data, 'not a list']), headers=headers)
+    assert response.status_code == 207
+    assert response.json == [{'status': 201, 'message': 'Song List created Successfully!'},
+                             {'status': 400, 'message': 'Song list must be an object'}]
+    mock_create_song_lists.assert_called_once_with([mock_data, 'not a list'])
+
+
+def test_create_song_lists_requires_array(client, headers, mock_data):
+    response = client.post('/list/batch', data=json.dumps(mock_data), headers=headers)
+    assert response.status_code == 400
+
+
+def test_add_songs_to_lists(client, headers, mocker):
+    mock_add_songs_to_lists = mocker.patch('app.model.song_list.SongList.add_songs_to_lists')
+    mock_add_songs_to_lists.return_value = [None, ListNotFoundException()]
+    song = {'title': 'Song Title', 'artist': 'Artist', 'album': 'Album'}
+
+    items = [{'list_id': '123', 'song': song}, {'list_id': '456', 'song': song}]
+    response = client.put('/list/songs/add', data=json.dumps(items), headers=headers)
+    assert response.status_code == 207
+    assert response.json == [{'status': 201, 'message': 'Song Added to list 123 Successfully!'},
+                             {'status': 404, 'message': 'List 456 not found'}]
+    mock_add_songs_to_lists.assert_called_once_with([(song, '123'), (song, '456')])
+
+
+def test_remove_songs_from_lists(client, headers, mocker):
+    mock_remove_songs_from_lists = mocker.patch('app.model.song_list.SongList.remove_songs_from_lists')
+    mock_remove_songs_from_lists.return_value = [None]
+    song = {'title': 'Song Title', 'artist': 'Artist', 'album': 'Album'}
+
+    response = client.put('/list/songs/remove', data=json.dumps([{'list_id': '123', 'song': song}]),
+                          headers=headers)
+    assert response.status_code == 207
+    assert response.json == [{'status': 410, 'message': 'Song removed from list 123 Successfully!'}]
+
+
+def test_search_list_with_song_paginated(client, headers, mocker):
+    mock_iter_search_songs = mocker.patch('app.model.song_list.SongList.iter_search_songs')
+    mock_iter_search_songs.return_value = iter([{'id': str(number)} for number in range(5)])
+
+    response = client.get('/list/search', headers=headers,
+                          query_string={'artist': 'a', 'offset': 1, 'limit': 2})
+    assert response.status_code == 200
+    assert response.json == [{'id': '1'}, {'id': '2'}]
+    assert response.headers['X-Next-Offset'] == '3'
+    mock_iter_search_songs.assert_called_once_with(None, 'a', None)
+
+
+def test_search_list_with_song_last_page(client, headers, mocker):
+    mock_iter_search_songs = mocker.patch('app.model.song_list.SongList.iter_search_songs')
+    mock_iter_search_songs.return_value = iter([{'id': str(number)} for number in range(5)])
+
+    response = client.get('/list/search', headers=headers, query_string={'offset': 3, 'limit': 2})
+    assert response.json == [{'id': '3'}, {'id': '4'}]
+    assert 'X-Next-Offset' not in response.headers
+
+
+def test_search_list_with_song_invalid_page(client, headers):
+    response = client.get('/list/search', headers=headers, query_string={'limit': -1})
+    assert response.status_code == 400
+
+
+def test_search_list_with_song_streamed(client, headers, mocker):
+    mock_iter_search_songs = mocker.patch('app.model.song_list.SongList.iter_search_songs')
+    mock_iter_search_songs.return_value = iter([{'id': '1'}, {'id': '2'}, {'id': '3'}])
+
+    response = client.get('/list/search', headers=headers, query_string={'stream': 1, 'limit': 2})
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    assert [json.loads(line) for line in response.data.splitlines()] == [{'id': '1'}, {'id': '2'}]
+
+
+def test_search_list_with_song_projected(client, headers, mocker):
+    lists = [{'id': str(number), 'name': 'list', 'songs': [{'id': str(song)} for song in range(3)]}
+             for number in range(2)]
+    mocker.patch('app.model.song_list.SongList.search_songs', return_value=lists)
+    mocker.patch('app.model.song_list.SongList.iter_search_songs', side_effect=lambda *args: iter(lists))
+
+    response = client.get('/list/search', headers=headers, query_string={'fields': 'id,missing'})
+    assert response.json == [{'id': '0'}, {'id': '1'}]
+
+    response = client.get('/list/search', headers=headers,
+                          query_string={'fields': 'id,songs', 'songs_limit': 1, 'stream': 1})
+    assert [json.loads(line) for line in response.data.splitlines()] == [
+        {'id': '0', 'songs': [{'id': '0'}], 'songs_total': 3}, {'id': '1', 'songs': [{'id': '0'}], 'songs_total': 3}]
+    assert len(lists[0]['songs']) == 3
+
+    response = client.get('/list/search', headers=headers, query_string={'songs_offset': -1})
+    assert response.status_code == 400
+
+
+def test_remove_song_by_id(client, headers, mocker):
+    mock_remove_song_from_list = mocker.patch('app.model.song_list.SongList.remove_song_from_list')
+    mock_remove_song_from_list.return_value = None
+    response = client.delete('/list/1234456abc/song/abc', headers=headers)
+
+    assert response.status_code == 410
+    assert response.json == {'message': 'Song removed from list 1234456abc Successfully!'}
+    mock_remove_song_from_list.assert_called_once_with({'id': 'abc'}, '1234456abc')
+
+
+def test_get_song_list(client, headers, mocker, mock_data):
+    mocker.patch('app.model.song_list.SongList.get_list_version', return_value='abc-1')
+    mock_get_list_by_id = mocker.patch('app.model.song_list.SongList.get_list_by_id')
+    mock_get_list_by_id.return_value = [mock_data]
+
+    response = client.get('/list/1234456abc', headers=headers)
+    assert response.status_code == 200
+    assert response.json == mock_data
+    mock_get_list_by_id.assert_called_once_with('1234456abc')
+
+    # the ETag follows the content, not the version of the process that served it
+    mocker.patch('app.model.song_list.SongList.get_list_version', return_value='other-worker-7')
+    assert client.get('/list/1234456abc', headers=headers).headers['ETag'] == response.headers['ETag']
+    mocker.patch('app.model.song_list.SongList.get_list_version', return_value='other-worker-8')
+    mock_get_list_by_id.return_value = [dict(mock_data, name='otro nombre')]
+    assert client.get('/list/1234456abc', headers=headers).headers['ETag'] != response.headers['ETag']
+
+
+@pytest.mark.parametrize('if_none_match', ['{}', 'W/{}', '"abc-0", W/{}', '*'])
+def test_get_song_list_not_modified(client, headers, mocker, mock_data, if_none_match):
+    mocker.patch('app.model.song_list.SongList.get_list_version', return_value='abc-1')
+    mocker.patch('app.model.song_list.SongList.get_list_by_id', return_value=[mock_data])
+    etag = client.get('/list/1234456abc', headers=headers).headers['ETag']
+
+    response = client.get('/list/1234456abc', headers=dict(headers, **{'If-None-Match': if_none_match.format(etag)}))
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+    assert response.data == b''
+
+
+def test_get_song_list_not_found(client, headers, mocker):
+    mocker.patch('app.model.song_list.SongList.get_list_version', return_value=None)
+
+    response = client.get('/list/1234456abc', headers=headers)
+    assert response.status_code == 404
+    assert response.json == {'message': 'List 1234456abc not found'}
+
+
+def test_search_cache_stats(client, headers):
+    response = client.get('/list/search/stats', headers=headers)
+    assert response.status_code == 200
+    assert set(response.json) == {'hits', 'misses', 'invalidations', 'entries'}
+
+
+def test_get_list_encodes_song_records(client, mocker):
+    song = {'title': 'Paranoid', 'artist': 'Black Sabbath', 'album': 'Paranoid', 'id': '1'}
+    mocker.patch('app.model.song_list.SongList.get_list_by_id',
+                 return_value=[{'id': 'a', 'songs': [Song.from_dict(song)]}])
+    mocker.patch('app.model.song_list.SongList.get_list_version', return_value='v1')
+
+    response = client.get('/list/a', headers={'Authorization': 'Bearer 123'})
+
+    assert response.status_code == 200
+    assert response.get_json() == {'id': 'a', 'songs': [song]}
+
+
+def test_get_changes(client, headers, mocker):
+    feed = mocker.patch('app.model.song_list.SongList.change_feed')
+    feed.size = 10
+    feed.changes.return_value = {'token': 't', 'seq': 3, 'reset': False, 'changes': []}
+    mocker.patch('app.model.song_list.SongList.warm')
+
+    response = client.get('/changes', headers=headers, query_string={'since': 3, 'timeout': 600, 'token': 't'})
+    assert response.status_code == 200
+    assert response.json == {'token': 't', 'seq': 3, 'reset': False, 'changes': []}
+    feed.changes.assert_called_once_with(3, 1000, 30, 't')
+
+    response = client.get('/changes', headers=headers, query_string={'limit': 0})
+    assert response.status_code == 400
+    feed.size = 0
+    assert client.get('/changes', headers=headers).status_code == 404
+
+
+def test_get_song_list_page_of_songs(client, headers, mocker, mock_data):
+    mock_data['songs'] = [{'id': str(number)} for number in range(5)]
+    mocker.patch('app.model.song_list.SongList.get_list_version', return_value='abc-1')
+    mocker.patch('app.model.song_list.SongList.get_list_by_id', return_value=[mock_data])
+
+    response = client.get('/list/1234456abc', headers=headers, query_string={'songs_offset': 3, 'songs_limit': 50})
+    assert response.status_code == 200
+    assert response.json == dict(mock_data, songs=[{'id': '3'}, {'id': '4'}], songs_total=5)
+    assert response.headers['ETag'] != client.get('/list/1234456abc', headers=headers).headers['ETag']
+
+    response = client.get('/list/1234456abc', headers=headers, query_string={'fields': 'name'})
+    assert response.json == {'name': 'lista nombre'}
@@ -0,0 +1,252 @@
+import pytest
+
+from app.model.song_index import SongIndex
+
+
+@pytest.fixture
+def mock_data():
+    return {
+        'lists': [
+            {'id': 'a', 'name': 'first', 'songs': []},
+            {'id': 'b', 'name': 'second', 'songs': []},
+            {'id': 'c', 'name': 'third', 'songs': []}
+        ]
+    }
+
+
+def test_get_by_id(mock_data):
+    index = SongIndex(mock_data)
+    assert index.get('b') is mock_data['lists'][1]
+    assert index.get('missing') is None
+
+
+def test_append_indexes_list(mock_data):
+    index = SongIndex(mock_data)
+    new_list = {'id': 'd', 'name': 'fourth', 'songs': []}
+    index.append(new_list)
+
+    assert mock_data['lists'][-1] is new_list
+    assert index.get('d') is new_list
+
+
+def test_remove_keeps_document_in_sync(mock_data):
+    index = SongIndex(mock_data)
+    index.append({'id': 'd', 'name': 'fourth', 'songs': []})
+
+    removed = index.remove('b')
+    assert removed['name'] == 'second'
+    assert [item['id'] for item in mock_data['lists']] == ['a', 'c', 'd']
+
+    index.remove('d')
+    index.remove('a')
+    assert [item['id'] for item in mock_data['lists']] == ['c']
+    assert index.get('c') is mock_data['lists'][0]
+
+
+def test_remove_missing_list(mock_data):
+    index = SongIndex(mock_data)
+    assert index.remove('missing') is None
+    assert len(mock_data['lists']) == 3
+
+
+@pytest.fixture
+def library():
+    return {
+        'lists': [
+            {'id': 'a', 'name': 'rock', 'songs': [
+                {'title': 'Paranoid', 'artist': 'Black Sabbath', 'album': 'Paranoid'},
+                {'title': 'Money', 'artist': 'Pink Floyd', 'album': 'The Dark Side of the Moon'}
+            ]},
+            {'id': 'b', 'name': 'pop', 'songs': [
+                {'title': 'Money Money Money', 'artist': 'ABBA', 'album': 'Arrival'}
+            ]},
+            {'id': 'c', 'name': 'empty', 'songs': []}
+        ]
+    }
+
+
+def _ids(lists):
+    return [item['id'] for item in lists]
+
+
+def test_candidates_by_substring(library):
+    index = SongIndex(library)
+    assert _ids(index.candidates('MONEY', None, None)) == ['a', 'b']
+    assert _ids(index.candidates(None, 'floyd', None)) == ['a']
+    assert _ids(index.candidates('money', None, 'arriv')) == ['b']
+    assert index.candidates('yesterday', None, None) == []
+
+
+def test_candidates_fold_case():
+    index = SongIndex({'lists': [{'id': 'a', 'songs': [{'title': 'Straße', 'artist': 'x', 'album': 'y'}]}]})
+    assert _ids(index.candidates('STRASSE', None, None)) == ['a']
+    assert index.candidates('strase', None, None) == []
+
+
+def test_candidates_short_terms_do_not_narrow(library):
+    index = SongIndex(library)
+    assert _ids(index.candidates('mo', None, None)) == ['a', 'b', 'c']
+    assert _ids(index.candidates(None, None, None)) == ['a', 'b', 'c']
+
+
+def test_candidates_follow_song_changes(library):
+    index = SongIndex(library)
+    song = {'title': 'Waterloo', 'artist': 'ABBA', 'album': 'Waterloo'}
+
+    index.add_song('c', song)
+    assert _ids(index.candidates('waterloo', None, None)) == ['c']
+
+    index.remove_song('c', dict(song))
+    assert index.candidates('waterloo', None, None) == []
+    assert _ids(index.candidates(None, None, 'arrival')) == ['b']
+
+
+def test_candidates_follow_list_changes(library):
+    index = SongIndex(library)
+    index.remove('a')
+    assert _ids(index.candidates('money', None, None)) == ['b']
+
+    index.append({'id': 'd', 'name': 'new', 'songs': [{'title': 'Money', 'artist': 'x', 'album': 'y'}]})
+    assert _ids(index.candidates('money', None, None)) == ['b', 'd']
+
+
+def test_remove_song_by_id_and_content():
+    songs = [{'id': str(number), 'title': 't%d' % (number % 3), 'artist': 'a', 'album': 'b'} for number in range(9)]
+    data = {'lists': [{'id': 'a', 'name': 'list', 'songs': songs}]}
+    index = SongIndex(data)
+
+    assert index.remove_song('a', {'id': '4'})['title'] == 't1'
+    assert index.remove_song('a', {'title': 't1', 'artist': 'a', 'album': 'b'})['id'] == '1'
+    assert index.remove_song('a', {'title': 't1', 'artist': 'a', 'album': 'b'})['id'] == '7'
+    assert [song['id'] for song in songs] == ['0', '2', '3', '5', '6', '8']
+
+    index.add_song('a', {'id': '9', 'title': 't1', 'artist': 'a', 'album': 'b'})
+    assert index.remove_song('a', {'id': '8'})['id'] == '8'
+    assert index.remove_song('a', {'title': 't1', 'artist': 'a', 'album': 'b'})['id'] == '9'
+    assert [song['id'] for song in songs] == ['0', '2', '3', '5', '6']
+
+
+def test_remove_song_not_in_list():
+    index = SongIndex({'lists': [{'id': 'a', 'name': 'list', 'songs': [{'id': '1', 'title': 't'}]}]})
+
+    with pytest.raises(ValueError):
+        index.remove_song('a', {'id': '2'})
+    with pytest.raises(ValueError):
+        index.remove_song('a', {'title': 't', 'artist': 'x'})
+
+
+def test_add_song_with_duplicate_id():
+    index = SongIndex({'lists': [{'id': 'a', 'name': 'list', 'songs': [{'id': '1', 'title': 't'}]}]})
+
+    with pytest.raises(ValueError):
+        index.add_song('a', {'id': '1', 'title': 'other'})
+
+
+def test_version_changes_with_list(library):
+    index = SongIndex(library)
+    first = index.version('a')
+    assert index.version('b') != first
+
+    index.add_song('a', {'id': 'x', 'title': 'New', 'artist': 'x', 'album': 'y'})
+    second = index.version('a')
+    assert second != first
+
+    index.remove_song('a', {'id': 'x'})
+    assert index.version('a') not in (first, second)
+
+    index.remove('a')
+    assert index.version('a') is None
+
+
+def test_insert_and_discard_keep_seq_order():
+    index = SongIndex({'lists': [{'id': 'a', 'songs': []}, {'id': 'c', 'songs': []}]}, [10, 30],
+                      lambda list_data: list_data['id'] < 'b')
+    index.insert({'id': 'b', 'songs': [{'id': '1', 'title': 'Bohemian', 'artist': 'x', 'album': 'y'}]}, 20)
+
+    assert [list_data['id'] for list_data in index.data['lists']] == ['a', 'b', 'c']
+    assert [seq for seq, _ in index.part(False)] == [20, 30]
+    assert index.candidates('bohem', None, None) == [index.get('b')]
+    with pytest.raises(ValueError):
+        index.insert({'id': 'd', 'songs': []}, 30)
+
+    assert index.discard(20)['id'] == 'b'
+    assert index.discard(20) is None
+    assert index.get('b') is None
+    assert index.candidates('bohem', None, None) == []
+    assert [list_data['id'] for list_data in index.data['lists']] == ['a', 'c']
+    assert [seq for seq, _ in index.part(False)] == [30]
+
+
+def test_lists_sharing_an_id_are_found_in_turn():
+    first, second, third = ({'id': 'a', 'songs': [], 'n': n} for n in range(3))
+    index = SongIndex({'lists': [first, second]})
+    index.insert(third, -1)
+
+    assert index.get('a') is third
+    assert index.remove('a') is third
+    assert index.get('a') is first
+    index.add_song('a', {'title': 'Help'})
+    assert index.remove('a') is first
+    assert index.get('a') is second
+    assert index.remove('a') is second
+    assert index.get('a') is None
+    assert index.data == {'lists': []}
+
+    index = SongIndex({'lists': [first, second]})
+    assert index.discard(1) is second
+    assert index.remove('a') is first
+    assert index.get('a') is None
+
+
+def test_changes_since(library):
+    index = SongIndex(library)
+    mark = index.mark()
+    assert index.changes_since(mark) == set()
+
+    index.add_song('a', {'id': 'x', 'title': 'New', 'artist': 'x', 'album': 'y'})
+    index.remove('b')
+    index.append({'id': 'd', 'songs': []})
+    changed = index.changes_since(mark)
+    assert {index.by_seq(seq)['id'] for seq in changed if index.by_seq(seq)} == {'a', 'd'}
+    assert len(changed) == 3
+
+
+def test_changes_log_is_bounded():
+    index = SongIndex({'lists': [{'id': 'a', 'songs': []}]})
+    mark = index.mark()
+    for number in range(1100):
+        index.add_song('a', {'id': str(number), 'title': 't', 'artist': 'a', 'album': 'b'})
+
+    assert index.changes_since(mark) is None
+    assert index.changes_since(index.mark()) == set()
+
+
+def test_unhashable_ids_are_not_looked_up():
+    song = {'title': 'Money', 'artist': 'Pink Floyd', 'album': 'x', 'id': {'odd': 1}}
+    data = {'lists': [{'id': ['x'], 'songs': []}, {'id': 'a', 'songs': [song]}]}
+    index = SongIndex(data)
+
+    assert index.get(['x']) is None
+    assert index.version(['x']) is None
+    assert _ids(index.candidates('money', None, None)) == ['a']
+    assert index.remove_song('a', {'title': 'Money', 'artist': 'Pink Floyd', 'album': 'x'}) == song
+    assert index.discard(index.seqs()[0])['id'] == ['x']
+
+
+def test_failed_append_leaves_document_unchanged():
+    data = {'lists': [{'id': 'a', 'songs': []}]}
+
+    def partition(list_data):
+        if list_data.get('id') == 'bad':
+            raise ValueError('cannot place list')
+        return 0
+
+    index = SongIndex(data, partition=partition)
+    with pytest.raises(ValueError):
+        index.append({'id': 'bad', 'songs': []})
+    with pytest.raises(ValueError):
+        index.insert({'id': 'bad', 'songs': []}, 10)
+
+    assert data == {'lists': [{'id': 'a', 'songs': []}]}
+    assert index.get('bad') is None
+    assert len(index.seqs()) == 1
@@ -0,0 +1,108 @@
+import pytest
+
+from app.model.sqlite_song_list import SqliteSongList
+from app.model.storage import ListNotFoundException, get_storage
+
+
+@pytest.fixture(autouse=True)
+def database(tmp_path):
+    SqliteSongList.configure({'SONG_DB_PATH': str(tmp_path / 'songs.db')})
+    yield tmp_path / 'songs.db'
+    SqliteSongList.configure({})
+
+
+@pytest.fixture
+def song():
+    return {'title': 'cancion titulo', 'artist': 'cancion artista', 'album': 'cancion album'}
+
+
+@pytest.fixture
+def mocked_list_data(song):
+    return {'id': '1234456abc', 'name': 'lista nombre', 'songs': [song]}
+
+
+def test_get_storage():
+    assert get_storage('sqlite') is SqliteSongList
+    with pytest.raises(ValueError):
+        get_storage('unknown')
+
+
+def test_uses_wal_mode():
+    assert SqliteSongList._connection().execute('PRAGMA journal_mode').fetchone() == ('wal',)
+
+
+def test_create_and_get_list(mocked_list_data):
+    SqliteSongList.create_song_list(mocked_list_data)
+
+    assert SqliteSongList.get_list_by_id('1234456abc') == [mocked_list_data]
+    assert SqliteSongList.get_list_by_id('missing') == []
+
+
+def test_add_and_remove_song(mocked_list_data, song):
+    SqliteSongList.create_song_list(mocked_list_data)
+    other = {'title': 'otra', 'artist': 'otro', 'album': 'otro album'}
+
+    SqliteSongList.add_song_to_list(other, '1234456abc')
+    assert SqliteSongList.get_list_by_id('1234456abc')[0]['songs'] == [song, other]
+
+    SqliteSongList.remove_song_from_list(dict(song), '1234456abc')
+    assert SqliteSongList.get_list_by_id('1234456abc')[0]['songs'] == [other]
+
+    with pytest.raises(ValueError):
+        SqliteSongList.remove_song_from_list(song, '1234456abc')
+
+
+def test_song_operations_on_missing_list(song):
+    with pytest.raises(ListNotFoundException):
+        SqliteSongList.add_song_to_list(song, '123')
+    with pytest.raises(ListNotFoundException):
+        SqliteSongList.remove_song_from_list(song, '123')
+
+
+def test_remove_list(mocked_list_data):
+    SqliteSongList.create_song_list(mocked_list_data)
+    SqliteSongList.remove_list('1234456abc')
+
+    assert SqliteSongList.get_list_by_id('1234456abc') == []
+    assert SqliteSongList.search_songs('cancion', None, None) == []
+
+
+def test_search_songs(mocked_list_data):
+    SqliteSongList.create_song_list(mocked_list_data)
+    SqliteSongList.create_song_list({'id': 'other', 'name': 'otra', 'songs': [
+        {'title': 'Money', 'artist': 'Pink Floyd', 'album': 'The Dark Side of the Moon'}
+    ]})
+
+    assert SqliteSongList.search_songs('TITULO', None, 'album') == [mocked_list_data]
+    assert [item['id'] for item in SqliteSongList.search_songs('o', None, None)] == ['1234456abc', 'other']
+    assert SqliteSongList.search_songs('titulo', 'floyd', None) == []
+
+
+def test_batch_operations(mocked_list_data, song):
+    results = SqliteSongList.create_song_lists([mocked_list_data, 'bad'])
+    assert results[0] is None and isinstance(results[1], TypeError)
+
+    other = {'title': 'otra', 'artist': 'otro', 'album': 'otro album'}
+    results = SqliteSongList.add_songs_to_lists([(other, '1234456abc'), (other, 'missing')])
+    assert results[0] is None and isinstance(results[1], ListNotFoundException)
+
+    results = SqliteSongList.remove_songs_from_lists([(song, '1234456abc'), (song, '1234456abc')])
+    assert results[0] is None and isinstance(results[1], ValueError)
+    assert SqliteSongList.get_list_by_id('1234456abc')[0]['songs'] == [other]
+
+
+def test_remove_song_by_id(mocked_list_data, song):
+    SqliteSongList.create_song_list(mocked_list_data)
+    song_id = mocked_list_data['songs'][0]['id']
+
+    SqliteSongList.remove_song_from_list({'id': song_id}, '1234456abc')
+    assert SqliteSongList.get_list_by_id('1234456abc')[0]['songs'] == []
+
+
+def test_list_version(mocked_list_data):
+    assert SqliteSongList.get_list_version('1234456abc') is None
+    SqliteSongList.create_song_list(mocked_list_data)
+    first = SqliteSongList.get_list_version('1234456abc')
+
+    SqliteSongList.add_song_to_list({'title': 'otra'}, '1234456abc')
+    assert SqliteSongList.get_list_version('1234456abc') != first